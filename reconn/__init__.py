@@ -13,19 +13,27 @@ def start_reconn(target_file,
                  log_file='/var/log/reconn/reconn.log',
                  survey_action_message_format=None,
                  user_data=None,
+                 start_position=None,
                  ):
     '''Function to be invoked when using
-    reconn as importable package'''
+    reconn as importable package.
+    target_file is a file path or a list of file paths to reconn.
+    start_position is one of beginning, end, offset:N or tail_bytes:N'''
     args_dict = {
-        '--target_file': target_file,
         '--config-file': config_file,
         '--log-file': log_file,
     }
+    if isinstance(target_file, (list, tuple)):
+        args_dict['--target_files'] = ','.join(target_file)
+    else:
+        args_dict['--target_file'] = target_file
     if survey_action_message_format is not None:
         args_dict[
             '--survey_action_message_format'] = survey_action_message_format
     if user_data is not None:
         args_dict['--msg_user_data'] = user_data
+    if start_position is not None:
+        args_dict['--start_position'] = start_position
 
     sys_argv = ['{0}={1}'.format(k, v) for k, v in args_dict.items()]
     init_reconn(sys_argv)
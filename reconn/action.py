@@ -2,18 +2,22 @@
    that can be taken for matched survey patterns"""
 
 from abc import ABCMeta, abstractmethod
+import collections
 import io
 import codecs
 import datetime
+import threading
+import time
+
 import pika
-import json
 import six
 
 from oslo_log import log as logging
 
 from reconn import conf as reconn_conf
-from reconn import exception as reconn_exception
-from reconn import retry as reconn_retry
+from reconn import message as reconn_message
+from reconn import pool as reconn_pool
+from reconn import spool as reconn_spool
 
 if six.PY2:
     import Queue as native_queue
@@ -24,6 +28,7 @@ else:
 CONF = reconn_conf.CONF
 LOG = logging.getLogger(__name__)
 supported_actions = ('log_survey', 'rmq_survey')
+overflow_policies = ('block', 'drop_oldest', 'spill')
 _action_mapper = {}
 
 
@@ -47,13 +52,41 @@ class SurveyAction(object):
         pass
 
 
+def _timestamp():
+    return datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+def create_message_renderer(msg_format, user_data=None,
+                            json_template=False):
+    '''Compile msg_format of a survey action, with user_data as its
+    constant fields. Fields neither computed nor user data are named
+    groups of matched survey patterns'''
+    # Computed fields are not overridden by user data
+    constants = dict((name, value) for name, value in
+                     six.iteritems(user_data or {})
+                     if name not in reconn_message.computed_fields)
+    renderer = reconn_message.MessageRenderer(msg_format, constants,
+                                              json_template=json_template)
+    captured = [field_name for field_name in renderer.field_names
+                if field_name not in reconn_message.computed_fields]
+    if captured:
+        LOG.info("Fields %s of message format %s are substituted by named "
+                 "groups of matched survey pattern", captured, msg_format)
+    return renderer
+
+
+def _unicode_escape(text):
+    return codecs.encode(text, 'unicode_escape').decode('ascii')
+
+
 class LogSurvey(SurveyAction):
     """Action that logs matched survey patterns"""
-    def __init__(self, log_file, log_format):
+    def __init__(self, log_file, log_format, user_data=None):
         # Note(jay): We want control characters have special meaning
         # while we log and not get written as string.
         # The below decode will transform \\r to \r and so on.
         self.log_format = codecs.decode(log_format, 'unicode_escape')
+        self._renderer = create_message_renderer(self.log_format, user_data)
         # Init with None help avoid exception in destructor when
         # exception raised during io.open()
         self.f = None
@@ -70,169 +103,597 @@ class LogSurvey(SurveyAction):
         # Note(jay): Handle control characters so they are
         #  written out to log as characters and not their
         # interpretation.
-        line = codecs.encode(line, 'unicode_escape')
-        s = self.log_format
-        try:
-            s = s.format(
-                timestamp=datetime.datetime.utcnow().strftime(
-                    '%Y-%m-%d %H:%M:%S.%f'),
-                line=line,
-                matched_pattern=pattern,
-                name=survey_grp_name)
-        except KeyError:
-            pass
-
-        self.f.write(s)
+        fields = dict((name, _unicode_escape(value)) for name, value in
+                      six.iteritems(kwargs.get('captures') or {}))
+        fields.update(
+            timestamp=_timestamp(),
+            line=_unicode_escape(line),
+            context=_unicode_escape(kwargs.get('context', line)),
+            matched_pattern=pattern,
+            name=survey_grp_name)
+        s = self._renderer.render(fields)
+
+        self.f.write(s.encode('utf-8'))
         self.f.flush()
 
 
+def _confirm_delivery(channel, callback):
+    '''Enable confirm mode of pika BlockingChannel channel, calling back
+    callback with the method frame of every Basic.Ack and Basic.Nack.
+
+    Note(jay): Confirm mode of BlockingChannel waits for the confirm of
+    every publish. Confirm mode of its underlying channel, its private
+    _impl, calls back on confirms as they arrive, with connection events,
+    so that many publishes can be waiting for confirms. Checked with pika
+    0.11 to 0.13, as pinned in requirements.txt. pika 1.0 renamed the
+    callback argument, and dropped BlockingChannel.publish'''
+    channel._impl.confirm_delivery(callback)
+
+
 class RMQSurvey(SurveyAction):
-    """Action that publish messages to RMQ for matched survey patterns"""
+    """Action that publish messages to RMQ for matched survey patterns.
+
+    Messages are rendered on the thread executing the action and put in a
+    bounded queue. A publisher thread owns the RMQ connection and drains
+    the queue, so that waiting for the broker to confirm a publish never
+    holds up reading target files. When the queue is full, the overflow
+    policy either blocks the thread executing the action till there is
+    room, drops the oldest queued message, or spills the message to an
+    unbounded holding queue drained after the queue. With rmq_spool_dir,
+    messages are spilled to a spool of segment files on disk instead, of
+    up to rmq_spool_max_mb, truncated as their publishes get confirmed.
+    Messages not published when the action is destroyed are spooled too,
+    whatever the overflow policy, and published once the action is
+    created again, ahead of new messages unless they spill too.
+
+    Publisher keeps up to rmq_confirm_window publishes outstanding, not
+    yet confirmed by the broker, matching Basic.Ack and Basic.Nack to
+    publishes by delivery tag. Nacked publishes, and publishes not
+    confirmed when connection is lost, are published again, before
+    queued messages, up to rmq_publish_retries times before they are
+    dropped. With rmq_batch_messages, messages queued within
+    rmq_batch_linger_ms of each other are published together, as a JSON
+    array of up to rmq_batch_size messages.
+
+    Connection to RMQ server is acquired from the process wide connection
+    pool, shared with other RMQ survey actions of the process over a
+    channel of each action's own.
+    """
     _exchange_type = 'topic'
-
-    def __init__(self, rmq_params):
+    # Seconds publisher waits for a message before serving connection
+    # events, like heartbeats and Connection.Unblocked
+    _poll_interval = 1
+    # Seconds publisher waits for confirms, with publishes outstanding
+    _confirm_poll_interval = 0.01
+    # Seconds publisher waits before retrying a failed publish
+    _retry_interval = 1
+    # Seconds destructor waits for queued messages to be published
+    _stop_timeout = 5
+
+    def __init__(self, rmq_params, renderer=None):
+        # Compiled rmq_message_format, on first message when not given
+        self._renderer = renderer
         self._username = rmq_params.get('username')
         self._password = rmq_params.get('password')
         self._host = rmq_params.get('host', '127.0.0.1')
         self._port = rmq_params.get('port', 5672)
         self._virtual_host = rmq_params.get('virtual_host', '/')
-        self._connection = None
+        # Connection of the pool, shared with other actions
+        self._pooled = None
         self._channel = None
         self._exchange_name = rmq_params.get('exchange_name')
         self._queue_name = rmq_params.get('queue_name')
         self._routing_key = rmq_params.get('routing_key')
         self._blocked_connection_timeout = 5
         self._flag_rmq_blocked = False
+        self._overflow_policy = rmq_params.get('rmq_overflow_policy',
+                                               'block')
+        # Messages to publish, as (time queued, msg, spool sequence
+        # number or None, times published again)
+        self._queue = native_queue.Queue(
+            rmq_params.get('rmq_queue_size', 1000))
         # Lets create an indefinite queue. It's safe as this
-        # is just a temporary msg holder, used in a rare cases
-        # when RMQ server is blocked because of low resource
+        # is just a temporary msg holder, for messages spilled
+        # over from a full queue
         self.q = native_queue.Queue(-1)
+        self._spool = None
+        self._confirm_window = rmq_params.get('rmq_confirm_window', 64)
+        self._batch_messages = rmq_params.get('rmq_batch_messages', False)
+        self._batch_size = 1
+        if self._batch_messages:
+            self._batch_size = rmq_params.get('rmq_batch_size', 100)
+        self._batch_linger = rmq_params.get('rmq_batch_linger_ms',
+                                            5) / 1000.0
+        # Messages to publish again, before queued ones, up to
+        # rmq_publish_retries times each
+        self._retry = collections.deque()
+        self._publish_retries = rmq_params.get('rmq_publish_retries', 3)
+        # Publishes not yet confirmed by delivery tag, as lists of
+        # messages published together
+        self._unconfirmed = collections.OrderedDict()
+        self._unconfirmed_msgs = 0
+        # Delivery tag of last publish on channel
+        self._delivery_tag = 0
+        # Guards publishes not yet confirmed, messages to publish again
+        # and publish statistics, as confirms are called back on
+        # whichever thread serves events of the shared connection.
+        # Never held while acquiring the connection's lock
+        self._confirm_lock = threading.RLock()
+        self._publisher = None
+        self._publisher_lock = threading.Lock()
+        self._stopping = threading.Event()
+        # Time publisher gives up publishing, once stopping
+        self._stop_deadline = None
+        # Publish statistics
+        self.published = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        if rmq_params.get('rmq_spool_dir'):
+            self._spool = reconn_spool.Spool(
+                rmq_params.get('rmq_spool_dir'),
+                rmq_params.get('rmq_spool_max_mb', 1024) * 1024 * 1024,
+                fsync_batch=rmq_params.get('rmq_spool_fsync_batch', 100))
         self._estb_rmq_connection()
-        self._setup_rmq_exchange_queue()
+        if self._spool is not None and self._spool.pending:
+            # Publish messages spooled before
+            self._start_publisher()
 
     def destructor(self):
-        if self._channel is not None and \
-                not self._channel.is_closed and \
-                not self._channel.is_closing:
-            self._channel.close()
-            LOG.debug("RMQ channel closed")
-
-        if self._connection is not None and \
-                not self._connection.is_closed and \
-                not self._connection.is_closing:
-            self._connection.close()
-            LOG.debug("RMQ connection closed")
+        '''Stop publisher, once queued messages are published or
+        _stop_timeout passes, spool messages not published and close RMQ
+        connection'''
+        publisher = self._publisher
+        if publisher is not None:
+            self._stop_deadline = time.time() + self._stop_timeout
+            self._stopping.set()
+            # Publisher waits on connection events for up to
+            # _poll_interval before it sees the deadline passed
+            publisher.join(self._stop_timeout + self._poll_interval)
+            if publisher.is_alive():
+                LOG.error("RMQ publisher did not stop in %s seconds, %s "
+                          "messages not published", self._stop_timeout,
+                          self.queue_depth + self._unconfirmed_msgs)
+            self._publisher = None
+            self.log_stats()
+        # Confirms are no longer called back once channel is closed
+        self._close_rmq_connection()
+        if self._spool is not None:
+            self._spool_unpublished()
+            self._spool.close()
+
+    def _close_rmq_connection(self):
+        '''Close channel and release connection to the pool, closed once
+        no other action uses it'''
+        pooled = self._pooled
+        if pooled is None:
+            return
+        with pooled.lock:
+            if self._channel is not None and \
+                    not self._channel.is_closed and \
+                    not self._channel.is_closing:
+                self._channel.close()
+                LOG.debug("RMQ channel closed")
+        pooled.remove_connection_callbacks(
+            self._connection_blocked_callback,
+            self._connection_unblocked_callback)
+        self._pooled = None
+        reconn_pool.get_connection_pool().release(pooled)
 
     def __del__(self):
         self.destructor()
 
-    def _construct_msg(self, survey_grp_name, pattern, line):
+    def _construct_msg(self, survey_grp_name, pattern, line, context=None,
+                       captures=None):
         '''Construct msg to be publish in RMQ.
-        Msg will be a string formed from json dumped msg obj'''
-        msg_format = CONF.rmq_survey.rmq_message_format
-        msg = {}
-        msg.update(CONF.msg_user_data)
-        msg.update(CONF.rmq_survey.rmq_msg_user_data)
-        msg.update(
-            {'line': line,
-             'name': survey_grp_name,
-             'matched_pattern': pattern,
-             'timestamp':
-                 datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S.%f")
-             })
+        Msg is rendered by compiled rmq_message_format as valid JSON,
+        with named groups of matched pattern in captures as fields'''
+        if self._renderer is None:
+            self._renderer = create_rmq_message_renderer()
+        fields = dict(captures or {})
+        fields.update(
+            line=line,
+            context=line if context is None else context,
+            name=survey_grp_name,
+            matched_pattern=pattern,
+            timestamp=_timestamp())
+        return self._renderer.render(fields)
 
-        try:
-            msg = msg_format.format(**msg)
-        except KeyError as e:
-            LOG.exception("%s", e)
-            LOG.exception("rmq_message_format or rmq_msg_user_data incorrect. "
-                          "Key not found while composing message for RMQ. "
-                          "Verify configuration")
-
-        # TODO(jay): Validate json schema in the message.
-        # Like property names in the message should be double quoted
-        # and not single quote.
-
-        # Handling control characters like \r \n.
-        LOG.debug('json load msg: %s', msg)
-        tmp_json_obj = json.loads(msg, strict=False)
-        msg = json.dumps(tmp_json_obj, ensure_ascii=False)
-        return msg
-
-    @reconn_retry.retry(3)
     def _publish_msg_to_rmq(self, msg):
-        if self._channel is None or not self._channel.is_open:
-            LOG.error("Channel is None or not open. "
-                      "Re-establishing connection")
-            self._reestb_rmq_connection()
-
+        '''Publish msg, without waiting for broker to confirm it.
+        Raises ChannelClosed or ConnectionClosed when publish fails'''
         hdrs = {}
         properties = pika.BasicProperties(app_id='reconn',
                                           content_type='application/json',
                                           headers=hdrs)
 
-        try:
-            # set immediate=False, become independent of consumer exists
-            # set mandatory=True, if msg cannot be routed to queue, we can get
-            # exception and act to re-create queue and re-bind again or
-            # verify routing_key, if necessary.
-            self._channel.publish(self._exchange_name,
-                                  self._routing_key,
-                                  msg,
-                                  properties=properties,
-                                  mandatory=True,
-                                  immediate=False)
-        except pika.exceptions.UnroutableError as unroutable_excp:
-            LOG.exception("%s" % unroutable_excp)
-            (return_msg, ) = unroutable_excp.messages
-            # return_msg is of type:
-            # pika.adapters.blocking_connection.ReturnedMessage
-
-            LOG.exception("%s", return_msg.method)
-            # <Basic.Return(['exchange=test_exchange', 'reply_code=312',
-            #   'reply_text=NO_ROUTE', 'routing_key=some_key'])>
-        except pika.exceptions.NackError as nack_excp:
-            LOG.exception("%s" % nack_excp)
-        except pika.exceptions.ChannelClosed as channel_closed_excp:
-            LOG.exception("%s" % channel_closed_excp)
-        except pika.exceptions.ConnectionClosed as connection_closed_excp:
-            LOG.exception("%s" % connection_closed_excp)
-            self._reestb_rmq_connection()
-            # raising RetryAgain to retry this function to send the msg
-            raise reconn_exception.RetryAgain
+        # set immediate=False, become independent of consumer exists
+        # set mandatory=True, if msg cannot be routed to queue, broker
+        # returns it with Basic.Return, logged by _msg_rejected_callback,
+        # before confirming it.
+        self._channel.publish(self._exchange_name,
+                              self._routing_key,
+                              msg,
+                              properties=properties,
+                              mandatory=True,
+                              immediate=False)
 
     def execute(self, survey_grp_name, pattern, line, *args, **kwargs):
-        """Publish message"""
-        msg = self._construct_msg(survey_grp_name, pattern, line)
-        if self._flag_rmq_blocked is True:
-            # Note(jay): Race condition here.
-            # A call back to _connection_unblocked_callback
-            # might have unset  _flag_rmq_blocked. One msg
-            # will be queued and not flushed until next msg
-            # is published or flush is invoked
-            self._queue_msg(msg)
+        """Queue message for publisher thread to publish"""
+        msg = self._construct_msg(survey_grp_name, pattern, line,
+                                  kwargs.get('context'),
+                                  kwargs.get('captures'))
+        self._start_publisher()
+        item = (time.time(), msg, None, 0)
+        if self._spilling():
+            # Keep order of messages spilled before
+            self.spilled += 1
+            self._queue_msg(item)
+            return
+        try:
+            self._queue.put_nowait(item)
+            return
+        except native_queue.Full:
+            pass
+        if self._overflow_policy == 'spill':
+            self.spilled += 1
+            self._queue_msg(item)
+        elif self._overflow_policy == 'drop_oldest':
+            self._put_dropping_oldest(item)
         else:
-            self._flush_queued_msgs()
-            self._publish_msg_to_rmq(msg)
-
-    def _queue_msg(self, msg):
+            self._put_blocking(item)
+
+    def _spilling(self):
+        '''Whether messages are spilled, so that messages are queued
+        after spilled ones, in order. Messages are spilled to spool till
+        all spilled messages are confirmed, so that messages held in
+        memory are always older than spooled ones. Only the spill policy
+        spills, other policies leave spooled messages to _next_msg'''
+        if self._overflow_policy != 'spill':
+            return False
+        if self._spool is not None:
+            return self._spool.pending > 0
+        return not self.q.empty()
+
+    def _put_dropping_oldest(self, item):
+        while True:
+            try:
+                self._queue.get_nowait()
+                self._count_dropped()
+            except native_queue.Empty:
+                pass
+            try:
+                self._queue.put_nowait(item)
+                return
+            except native_queue.Full:
+                continue
+
+    def _put_blocking(self, item):
+        '''Wait for room in queue, as long as publisher is alive'''
+        while True:
+            try:
+                self._queue.put(item, timeout=self._poll_interval)
+                return
+            except native_queue.Full:
+                publisher = self._publisher
+                if publisher is None or not publisher.is_alive():
+                    self._count_dropped()
+                    LOG.error("RMQ publisher is not running. Dropped msg: "
+                              "%s", item[1])
+                    return
+
+    def _count_dropped(self, count=1):
+        with self._confirm_lock:
+            self.dropped += count
+
+    @property
+    def queue_depth(self):
+        '''Number of messages queued, not yet published'''
+        depth = self._queue.qsize() + self.q.qsize() + len(self._retry)
+        if self._spool is not None:
+            depth += len(self._spool)
+        return depth
+
+    def get_stats(self):
+        '''Returns dict of publish statistics: queue depth, messages
+        published and not yet confirmed, published, dropped and spilled,
+        and average and most seconds from queuing a message to its
+        publish getting confirmed'''
+        with self._confirm_lock:
+            return {'queue_depth': self.queue_depth,
+                    'unconfirmed': self._unconfirmed_msgs,
+                    'published': self.published,
+                    'dropped': self.dropped,
+                    'spilled': self.spilled,
+                    'latency_avg': (self.latency_total / self.published
+                                    if self.published else 0.0),
+                    'latency_max': self.latency_max}
+
+    def log_stats(self):
+        LOG.info("RMQ publisher statistics: %s", self.get_stats())
+
+    def _start_publisher(self):
+        if self._publisher is not None:
+            return
+        with self._publisher_lock:
+            if self._publisher is not None:
+                return
+            self._stopping.clear()
+            publisher = threading.Thread(target=self._publish_queued_msgs,
+                                         name='RMQSurveyPublisher')
+            publisher.daemon = True
+            publisher.start()
+            self._publisher = publisher
+
+    def _next_msg(self, timeout):
+        '''Returns next item of a message to publish, or None when there
+        is none within timeout seconds'''
+        with self._confirm_lock:
+            if self._retry:
+                return self._retry.popleft()
+        # Spooled messages are left for the action created next, once
+        # stopping. Without spill policy, spooled messages are the ones
+        # left unpublished by the action created before, older than
+        # queued ones
+        reading_spool = self._spool is not None and \
+            not self._stopping.is_set()
+        if reading_spool and self._overflow_policy != 'spill':
+            item = self._spool.read()
+            if item is not None:
+                return item + (0,)
+        try:
+            return self._queue.get_nowait()
+        except native_queue.Empty:
+            pass
+        # Spilled messages are newer than queued ones
+        if reading_spool and self._overflow_policy == 'spill':
+            item = self._spool.read()
+            if item is not None:
+                return item + (0,)
+        try:
+            return self.q.get_nowait()
+        except native_queue.Empty:
+            pass
+        if timeout <= 0:
+            return None
+        try:
+            return self._queue.get(timeout=timeout)
+        except native_queue.Empty:
+            return None
+
+    def _next_batch(self):
+        '''Returns list of next items of messages to publish together.
+        Empty when there is none within _poll_interval, or right away
+        while publishes are waiting for confirms'''
+        item = self._next_msg(0 if self._unconfirmed else
+                              self._poll_interval)
+        if item is None:
+            return []
+        batch = [item]
+        deadline = time.time() + self._batch_linger
+        while len(batch) < self._batch_size:
+            item = self._next_msg(deadline - time.time())
+            if item is None:
+                break
+            batch.append(item)
+        return batch
+
+    def _batch_msg(self, batch):
+        '''Msg to publish for batch, a JSON array of its messages when
+        batching messages'''
+        if not self._batch_messages:
+            return batch[0][1]
+        return u'[%s]' % u','.join(item[1] for item in batch)
+
+    def _process_data_events(self, time_limit=0):
+        '''Serve connection events, like confirms of publishes, for up to
+        time_limit seconds'''
+        pooled = self._pooled
+        if pooled is None:
+            return
+        try:
+            pooled.process_data_events(time_limit)
+        except Exception as e:
+            LOG.error("Failed to process RMQ connection events: %s", e)
+
+    def _stop_expired(self):
+        '''Whether stopping and _stop_timeout passed, so that publisher
+        no longer waits for messages to be published or confirmed'''
+        return self._stopping.is_set() and \
+            time.time() >= self._stop_deadline
+
+    def _publish_queued_msgs(self):
+        '''Publisher thread. Publishes queued messages in order till
+        stopped, once queued messages are published and confirmed, or
+        _stop_timeout passed since stopping, like when the broker stops
+        confirming publishes'''
+        while True:
+            if self._stop_expired():
+                break
+            if self._flag_rmq_blocked:
+                if self._stopping.is_set():
+                    break
+                # Connection.Unblocked is served with connection events
+                self._process_data_events()
+                self._stopping.wait(self._poll_interval)
+                continue
+            if (self._channel is None or not self._channel.is_open) and \
+                    (self._unconfirmed or self.queue_depth):
+                LOG.error("Channel is None or not open. "
+                          "Re-establishing connection")
+                try:
+                    self._reestb_rmq_connection()
+                except Exception as e:
+                    LOG.error("Failed to re-establish RMQ connection: %s",
+                              e)
+                    if self._stopping.wait(self._retry_interval):
+                        break
+                    continue
+            if len(self._unconfirmed) >= self._confirm_window:
+                self._process_data_events(self._confirm_poll_interval)
+                continue
+            batch = self._next_batch()
+            if not batch:
+                if self._unconfirmed:
+                    self._process_data_events(self._confirm_poll_interval)
+                    continue
+                if self._stopping.is_set():
+                    break
+                if self._spool is not None:
+                    self._spool.sync()
+                self._process_data_events()
+                continue
+            try:
+                self._publish_batch(batch)
+            except Exception as e:
+                LOG.exception("Failed to publish msg to RMQ: %s", e)
+                self._retry_msgs(batch)
+                if self._stopping.wait(self._retry_interval):
+                    break
+                continue
+        not_published = self.queue_depth + self._unconfirmed_msgs
+        if not_published:
+            LOG.error("RMQ publisher stopped with %s messages not "
+                      "published", not_published)
+
+    def _publish_batch(self, batch):
+        '''Publish batch, waiting for its confirm by delivery tag.
+        Confirm of the publish may be served by another action sharing
+        the connection, as soon as the connection is released'''
+        with self._pooled.lock:
+            # Publish serves connection events, so its confirm may be
+            # called back before publish returns
+            self._delivery_tag += 1
+            tag = self._delivery_tag
+            with self._confirm_lock:
+                self._unconfirmed[tag] = batch
+                self._unconfirmed_msgs += len(batch)
+            try:
+                self._publish_msg_to_rmq(self._batch_msg(batch))
+            except Exception:
+                with self._confirm_lock:
+                    if self._unconfirmed.pop(tag, None) is not None:
+                        self._unconfirmed_msgs -= len(batch)
+                self._delivery_tag -= 1
+                raise
+
+    def _delivery_confirmed_callback(self, method_frame):
+        """Callback when RMQ has sent Basic.Ack or Basic.Nack for the
+        publish of delivery tag, or with multiple set, for publishes up
+        to delivery tag. Nacked messages are published again"""
+        method = method_frame.method
+        with self._confirm_lock:
+            tags = [tag for tag in self._unconfirmed
+                    if tag == method.delivery_tag or
+                    (method.multiple and tag < method.delivery_tag)]
+            nacked = []
+            now = time.time()
+            for tag in tags:
+                batch = self._unconfirmed.pop(tag)
+                self._unconfirmed_msgs -= len(batch)
+                if isinstance(method, pika.spec.Basic.Nack):
+                    nacked.extend(batch)
+                    continue
+                for queued, _, seq, _ in batch:
+                    if seq is not None:
+                        self._spool.confirm(seq)
+                    latency = now - queued
+                    self.published += 1
+                    self.latency_total += latency
+                    self.latency_max = max(self.latency_max, latency)
+            if nacked:
+                LOG.warning("RMQ server nacked %s messages. Publishing "
+                            "them again", len(nacked))
+                self._retry_msgs(nacked)
+
+    def _requeue_unconfirmed(self):
+        '''Publish messages not confirmed on a lost channel again, in
+        order, before queued messages'''
+        with self._confirm_lock:
+            items = [item for batch in self._unconfirmed.values()
+                     for item in batch]
+            if items:
+                LOG.warning("%s messages published to RMQ were not "
+                            "confirmed. Publishing them again", len(items))
+            self._unconfirmed.clear()
+            self._unconfirmed_msgs = 0
+            self._retry_msgs(items)
+
+    def _retry_msgs(self, items):
+        '''Publish messages of items again, in order, before queued
+        messages. Messages published again rmq_publish_retries times
+        already are dropped, so that a message RMQ server keeps
+        rejecting does not hold up messages after it'''
+        retry = []
+        with self._confirm_lock:
+            for queued, msg, seq, retries in items:
+                if retries < self._publish_retries:
+                    retry.append((queued, msg, seq, retries + 1))
+                    continue
+                self.dropped += 1
+                LOG.error("RMQ publish failed %s times. Dropped msg: %s",
+                          retries + 1, msg)
+                if seq is not None:
+                    # Not to be read from spool again
+                    self._spool.confirm(seq)
+            self._retry.extendleft(reversed(retry))
+
+    def _queue_msg(self, item):
         """Queue the msg for RMQ for later dispatch"""
+        if self._spool is not None:
+            self._spool_msg(item)
+            return
         try:
-            self.q.put_nowait(msg)
+            self.q.put_nowait(item)
         except native_queue.Full:
             # This will not happen as our queue in indefinite.
             # But better be safe
             LOG.exception("Failed to queue msg for later dispatch to RMQ."
-                          "Reason: Queue is full. Msg: %s", str(msg))
+                          "Reason: Queue is full. Msg: %s", str(item[1]))
 
-    def _flush_queued_msgs(self):
-        """Flush all queued msgs to RMQ server"""
-        while not self.q.empty():
-            try:
-                msg = self.q.get_nowait()
-                self._publish_msg_to_rmq(msg)
-            except native_queue.Empty as e:
-                break
+    def _spool_msg(self, item):
+        '''Append msg to spool, dropping it when spool is full'''
+        try:
+            seq = self._spool.append(item[0], item[1])
+        except (IOError, OSError) as e:
+            LOG.error("Failed to spool msg for later dispatch to RMQ. "
+                      "Error: %s", e)
+            seq = None
+        if seq is None:
+            self._count_dropped()
+            LOG.error("RMQ spool is full. Dropped msg: %s", item[1])
+
+    def _spool_unpublished(self):
+        '''Spool messages held in memory, not published, before spooled
+        messages, to be published once the action is created again'''
+        with self._confirm_lock:
+            items = [item for batch in self._unconfirmed.values()
+                     for item in batch]
+            self._unconfirmed.clear()
+            self._unconfirmed_msgs = 0
+            items.extend(self._retry)
+            self._retry.clear()
+        for queue in (self._queue, self.q):
+            while True:
+                try:
+                    items.append(queue.get_nowait())
+                except native_queue.Empty:
+                    break
+        # Spooled messages are read again, as they are not confirmed
+        items = [(queued, msg) for queued, msg, seq, _ in items
+                 if seq is None]
+        if not items:
+            return
+        try:
+            spooled = self._spool.prepend(items)
+        except (IOError, OSError) as e:
+            LOG.error("Failed to spool messages not published to RMQ. "
+                      "Error: %s", e)
+            spooled = 0
+        self._count_dropped(len(items) - spooled)
+        LOG.info("Spooled %s messages not published to RMQ, %s dropped",
+                 spooled, len(items) - spooled)
 
     def _connection_blocked_callback(self, method):
         """Callback when RMQ has sent Connection.Blocked frame indicating
@@ -260,9 +721,11 @@ class RMQSurvey(SurveyAction):
                   channel, method, properties, body))
 
     def _estb_rmq_connection(self):
-        """Create blocking connection to RMQ broker and a channel.
-        Adds necessary callbacks on connection and channel obj.
-        Sets confirm delivery on channel."""
+        """Acquire blocking connection to RMQ broker from the pool and
+        create a channel. Adds necessary callbacks on connection and
+        channel obj. Sets confirm delivery on channel and sets up exchange
+        and queue. Connection is released to the pool when any of it
+        fails."""
         credentials = pika.credentials.PlainCredentials(self._username,
                                                         self._password)
         parameters = pika.ConnectionParameters(
@@ -272,74 +735,105 @@ class RMQSurvey(SurveyAction):
             credentials=credentials,
             blocked_connection_timeout=self._blocked_connection_timeout,
         )
-        self._connection = pika.BlockingConnection(parameters=parameters)
-        LOG.info("RMQ Connection with broker established at %s:%s" % (
-            self._host, self._port))
-
-        self._connection.add_on_connection_blocked_callback(
-            self._connection_blocked_callback)
-        self._connection.add_on_connection_unblocked_callback(
-            self._connection_unblocked_callback)
-
-        self._channel = self._connection.channel()
-        LOG.info("RMQ Channel created")
-
-        # Register call back for msg rejected by server
-        self._channel.add_on_return_callback(self._msg_rejected_callback)
-
-        # enable RMQ confirm mode, publish confirms
-        self._channel.confirm_delivery()
+        pooled = reconn_pool.get_connection_pool().acquire(parameters)
+        self._pooled = pooled
+        try:
+            pooled.add_connection_callbacks(
+                self._connection_blocked_callback,
+                self._connection_unblocked_callback)
+
+            with pooled.lock:
+                self._channel = pooled.channel()
+                self._delivery_tag = 0
+                LOG.info("RMQ Channel created")
+
+                # Register call back for msg rejected by server
+                self._channel.add_on_return_callback(
+                    self._msg_rejected_callback)
+
+                # enable RMQ confirm mode, publish confirms
+                _confirm_delivery(self._channel,
+                                  self._delivery_confirmed_callback)
+
+            # Declared again over a new connection, in case RMQ server
+            # lost them, like on a restart
+            self._setup_rmq_exchange_queue()
+        except Exception:
+            self._close_rmq_connection()
+            raise
 
     def _reestb_rmq_connection(self):
         """Re-establish RMQ connection and channel"""
         # to be safe:
-        self.destructor()
+        self._close_rmq_connection()
+        self._requeue_unconfirmed()
         LOG.info("Re-establishing RMQ connection")
         self._estb_rmq_connection()
 
     def _setup_rmq_exchange_queue(self):
         """Creates 'topic' typed, durable exchange and
-        durable queue and binds them together"""
+        durable queue and binds them together, unless another action
+        sharing the connection did already"""
+        pooled = self._pooled
         # setup exchange
         try:
-            self._channel.exchange_declare(self._exchange_name,
-                                           self._exchange_type,
-                                           durable=True)
+            if pooled.declare_once(
+                    ('exchange', self._exchange_name, self._exchange_type),
+                    lambda: self._channel.exchange_declare(
+                        self._exchange_name, self._exchange_type,
+                        durable=True)):
+                LOG.info("RMQ Exchange %s of type %s created" %
+                         (self._exchange_name, self._exchange_type))
         except pika.exceptions.ChannelClosed as channel_closed_excp:
             # Raised when the exchange is already declared and no permission
             # to redeclare it. Like declaring default exchange of some topic
             # type.
             LOG.exception("%s" % channel_closed_excp)
             raise
-        LOG.info("RMQ Exchange %s of type %s created" %
-                 (self._exchange_name, self._exchange_type))
 
         # setup queue
-        self._channel.queue_declare(self._queue_name,
-                                    durable=True)
-        LOG.info("RMQ Queue %s created", self._queue_name)
+        if pooled.declare_once(
+                ('queue', self._queue_name),
+                lambda: self._channel.queue_declare(self._queue_name,
+                                                    durable=True)):
+            LOG.info("RMQ Queue %s created", self._queue_name)
 
         # Bind queue with Exchange using routing key
-        self._channel.queue_bind(self._queue_name,
-                                 self._exchange_name, self._routing_key)
+        if pooled.declare_once(
+                ('binding', self._queue_name, self._exchange_name,
+                 self._routing_key),
+                lambda: self._channel.queue_bind(self._queue_name,
+                                                 self._exchange_name,
+                                                 self._routing_key)):
+            LOG.info("RMQ Queue %s binding with Exchange %s done" %
+                     (self._queue_name, self._exchange_name))
+
 
-        LOG.info("RMQ Queue %s binding with Exchange %s done" %
-                 (self._queue_name, self._exchange_name))
+def create_rmq_message_renderer():
+    '''Compile rmq_message_format, with msg_user_data overridden by
+    rmq_msg_user_data as its constant fields'''
+    user_data = dict(CONF.msg_user_data)
+    user_data.update(CONF.rmq_survey.rmq_msg_user_data)
+    return create_message_renderer(CONF.rmq_survey.rmq_message_format,
+                                   user_data, json_template=True)
 
 
 def create_survey_actions(action_names):
-    '''Create action, for given a list of valid input action names'''
+    '''Create action, for given a list of valid input action names.
+    Message formats of actions are compiled here, once'''
     global _action_mapper
 
     for action_name in action_names:
         if action_name == 'log_survey':
             log_survey_obj = LogSurvey(
                 CONF.log_survey.log_survey_action_log_file,
-                CONF.log_survey.log_survey_action_log_format)
+                CONF.log_survey.log_survey_action_log_format,
+                CONF.msg_user_data)
             _action_mapper[action_name] = log_survey_obj
         elif action_name == 'rmq_survey':
             rmq_params = CONF.rmq_survey
-            rmq_survey_obj = RMQSurvey(rmq_params)
+            rmq_survey_obj = RMQSurvey(rmq_params,
+                                       create_rmq_message_renderer())
             _action_mapper[action_name] = rmq_survey_obj
         else:
             LOG.error("action name %s not found. Supported actions: %s" %
@@ -0,0 +1,129 @@
+"""Persistent read offset checkpoints of target files.
+Allows reconn to resume reading a target file where it left off,
+instead of re-surveying the whole file after a restart."""
+
+import base64
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+
+from oslo_log import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+
+def get_patterns_hash(re_objs):
+    '''Hash of survey group names and their patterns.
+    Checkpoints taken with a different set of survey patterns
+    are not resumed from'''
+    sha = hashlib.sha1()
+    for survey_grp_name, re_obj in re_objs:
+        pattern = re_obj.pattern
+        if not isinstance(pattern, bytes):
+            pattern = pattern.encode('utf-8')
+        sha.update(survey_grp_name.encode('utf-8'))
+        sha.update(b'\0')
+        sha.update(pattern)
+        sha.update(b'\0')
+    return sha.hexdigest()
+
+
+class CheckpointStore(object):
+    """Checkpoints of (device, inode, offset, partial line, patterns hash)
+    for every target file, kept in a json file.
+
+    update() only records a checkpoint in memory. Checkpoints are written
+    to file by save(), atomically and at most once per interval seconds.
+    """
+    def __init__(self, file_path, patterns_hash, interval=5):
+        self._file_path = file_path
+        self._patterns_hash = patterns_hash
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._checkpoints = {}
+        self._dirty = False
+        self._last_save = 0
+        self._load()
+
+    def _load(self):
+        try:
+            with io.open(self._file_path, 'rb') as f:
+                checkpoints = json.loads(f.read().decode('utf-8'))
+        except (IOError, OSError):
+            # No checkpoints yet
+            return
+        except ValueError as e:
+            LOG.error("Ignoring corrupt checkpoint file %s. Error: %s",
+                      self._file_path, e)
+            return
+        if isinstance(checkpoints, dict):
+            self._checkpoints = checkpoints
+
+    def get(self, target_file, dev, ino):
+        '''Returns (offset, partial_line) to resume target_file from, or
+        None when there is no checkpoint for this very file with current
+        survey patterns'''
+        with self._lock:
+            checkpoint = self._checkpoints.get(target_file)
+        if checkpoint is None:
+            return None
+        if (checkpoint.get('dev') != dev or
+                checkpoint.get('ino') != ino or
+                checkpoint.get('patterns_hash') != self._patterns_hash):
+            LOG.info("Checkpoint of %s is stale. Not resuming from it",
+                     target_file)
+            return None
+        partial_line = base64.b64decode(
+            checkpoint.get('partial_line', '').encode('ascii'))
+        return checkpoint.get('offset', 0), partial_line
+
+    def update(self, target_file, dev, ino, offset, partial_line):
+        '''Record checkpoint of target_file in memory'''
+        checkpoint = {
+            'dev': dev,
+            'ino': ino,
+            'offset': offset,
+            'partial_line': base64.b64encode(partial_line).decode('ascii'),
+            'patterns_hash': self._patterns_hash,
+        }
+        with self._lock:
+            if self._checkpoints.get(target_file) != checkpoint:
+                self._checkpoints[target_file] = checkpoint
+                self._dirty = True
+
+    def remove(self, target_file):
+        with self._lock:
+            if self._checkpoints.pop(target_file, None) is not None:
+                self._dirty = True
+
+    def save(self, force=False):
+        '''Write checkpoints to file if they changed and interval
+        seconds passed since last save, or force is True.
+        File is replaced atomically by renaming a fully written
+        temporary file over it'''
+        with self._lock:
+            if not self._dirty:
+                return
+            now = time.time()
+            if not force and now - self._last_save < self._interval:
+                return
+            data = json.dumps(self._checkpoints, sort_keys=True)
+            self._dirty = False
+            self._last_save = now
+
+        tmp_file_path = self._file_path + '.tmp'
+        try:
+            with io.open(tmp_file_path, 'wb') as f:
+                f.write(data.encode('utf-8'))
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp_file_path, self._file_path)
+        except (IOError, OSError) as e:
+            LOG.error("Failed to save checkpoints to %s. Error: %s",
+                      self._file_path, e)
+            with self._lock:
+                self._dirty = True
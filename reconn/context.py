@@ -0,0 +1,139 @@
+"""Context lines of matched lines of a target file, like grep -B and -A.
+
+Lines before a matched line are sliced out of the block the line was
+read in. For a line near start of its block, the rest come from the
+window of last lines its reader keeps, rather than a copy of every line
+read.
+
+A match needing lines after it is held till that many more lines are
+read, taken from the rest of its block and from the blocks read next.
+Matches after a held match are held behind it, so that survey actions
+are taken in order of lines. At most one match per line is held, for no
+more lines than its context_after, so memory per target file stays
+bounded.
+
+A held match keeps the read position of the block its line was read in,
+so that a checkpoint taken while it is held resumes reading from there,
+rather than past a match not acted on yet.
+"""
+
+import collections
+
+from reconn import reader as reconn_reader
+
+
+_NEWLINE = b'\n'
+
+
+def _lines_after(data, start, count):
+    '''Returns end of the count complete lines from start in data, or of
+    the last complete line, and number of lines found'''
+    end = start
+    found = 0
+    while found < count:
+        nl = data.find(_NEWLINE, end)
+        if nl == -1:
+            break
+        end = nl + 1
+        found += 1
+    return end, found
+
+
+class ContextMatch(object):
+    '''Matched line, survey groups matched in it and its context lines'''
+    __slots__ = ('line', 'matched_groups', 'before', 'after', 'needed',
+                 'position')
+
+    def __init__(self, line, matched_groups, before, after, needed,
+                 position=None):
+        self.line = line
+        self.matched_groups = matched_groups
+        self.before = before
+        self.after = after
+        # Lines after line yet to be read
+        self.needed = needed
+        # Read position, as (offset, partial line), to read line again
+        self.position = position
+
+    @property
+    def context(self):
+        '''Context lines and the matched line, in order of lines'''
+        return self.before + self.line + b''.join(self.after)
+
+
+class LineContext(object):
+    """Context lines of matched lines of a target file.
+
+    Every block read from the file, with matches in it or not, is to be
+    fed before its matches are added. Context of a match is the most
+    context_before and context_after of the survey groups matched in
+    its line.
+    """
+    def __init__(self):
+        # Matches held for lines after them, and matches after them
+        self._held = collections.deque()
+
+    def add(self, line, matched_groups, block=None, start=None,
+            window=None, position=None):
+        '''Add a match of line, starting at start in block, or of partial
+        last line of the file without block. Lines before it not in
+        block are taken from reconn.reader.LineWindow window. position
+        is the read position, as (offset, partial line), block was read
+        from. Returns list of matches ready to be acted on, in order'''
+        before_count = max(g.context_before for g in matched_groups)
+        after_count = max(g.context_after for g in matched_groups)
+        before = b''
+        after = []
+        if before_count:
+            if window is not None:
+                before = window.lines_before(before_count, block, start)
+            elif block is not None:
+                begin, _ = reconn_reader.lines_before(block, start,
+                                                      before_count)
+                before = block[begin:start]
+        if after_count and block is not None:
+            start += len(line)
+            end, found = _lines_after(block, start, after_count)
+            if found:
+                after.append(block[start:end])
+            after_count -= found
+        match = ContextMatch(line, matched_groups, before, after,
+                             after_count, position)
+        if not after_count and not self._held:
+            return [match]
+        self._held.append(match)
+        return self._pop_ready()
+
+    def feed(self, block):
+        '''Give held matches their lines after them from a new block.
+        Returns list of matches ready to be acted on, in order'''
+        if not self._held:
+            return []
+        for match in self._held:
+            if match.needed:
+                end, found = _lines_after(block, 0, match.needed)
+                if found:
+                    match.after.append(block[:end])
+                    match.needed -= found
+        return self._pop_ready()
+
+    @property
+    def held_position(self):
+        '''Read position of the oldest match held, or None when no match
+        is held'''
+        if not self._held:
+            return None
+        return self._held[0].position
+
+    def flush(self):
+        '''Returns list of all held matches, with lines after them read
+        so far, as no more lines are to be read'''
+        held = list(self._held)
+        self._held.clear()
+        return held
+
+    def _pop_ready(self):
+        ready = []
+        while self._held and not self._held[0].needed:
+            ready.append(self._held.popleft())
+        return ready
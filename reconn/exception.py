@@ -1,2 +0,0 @@
-class RetryAgain(Exception):
-    pass
@@ -0,0 +1,356 @@
+"""Linux inotify based observer.
+
+Watches a target file itself instead of its whole directory, so that
+writes to sibling files in the directory do not generate events. Events
+are read in batches from the inotify fd and many modify events of a file
+in a batch are delivered to its event handler as one modified event.
+
+InotifyObserver schedules watchdog event handlers and delivers watchdog
+event objects to them, so it can be used in place of
+watchdog.observers.Observer.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+
+import six
+import watchdog.events
+
+from oslo_log import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+IN_MODIFY = 0x00000002
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_MASK_ADD = 0x20000000
+IN_ISDIR = 0x40000000
+
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+# Events of a watched file
+_FILE_MASK = IN_MODIFY | IN_MOVE_SELF
+# Events on directory of a watched file, to know when file is deleted
+# or (re-)created. Writes to other files in directory are not watched.
+_PARENT_MASK = IN_CREATE | IN_MOVED_TO | IN_DELETE | IN_ONLYDIR
+# Events of a watched directory
+_DIR_MASK = IN_CREATE | IN_MOVED_TO | IN_DELETE | IN_ONLYDIR
+
+_EVENT_HEADER = struct.Struct('iIII')
+_READ_SIZE = 64 * 1024
+
+_libc = None
+
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                            use_errno=True)
+    return _libc
+
+
+def is_supported():
+    '''Returns True when inotify is available on this platform'''
+    if not sys.platform.startswith('linux'):
+        return False
+    try:
+        libc = _get_libc()
+    except OSError:
+        return False
+    return (hasattr(libc, 'inotify_init1') and
+            hasattr(libc, 'inotify_add_watch') and
+            hasattr(libc, 'inotify_rm_watch'))
+
+
+def _fsencode(path):
+    if isinstance(path, bytes):
+        return path
+    return path.encode(sys.getfilesystemencoding())
+
+
+def _fsdecode(name):
+    if six.PY2:
+        return name
+    return name.decode(sys.getfilesystemencoding(), 'surrogateescape')
+
+
+class InotifyWatch(object):
+    """A scheduled path, its event handlers and watch descriptors"""
+    def __init__(self, path, recursive, is_directory):
+        self.path = path
+        self.recursive = recursive
+        self.is_directory = is_directory
+        self.handlers = set()
+        self.wds = set()
+        # wd watching the file itself, when path is a file
+        self.file_wd = None
+
+    @property
+    def key(self):
+        return self.path, self.recursive
+
+
+class InotifyObserver(threading.Thread):
+    """Observer thread reading events of scheduled paths from an
+    inotify fd.
+
+    Scheduling a file path watches the file itself for modifications
+    and moves, plus its directory for the file being deleted or created.
+    Scheduling a directory path watches entries created, moved in or
+    deleted in it, and in its sub-directories when recursive.
+    """
+    def __init__(self):
+        super(InotifyObserver, self).__init__(name='InotifyObserver')
+        self.daemon = True
+        libc = _get_libc()
+        self._libc = libc
+        self._fd = libc.inotify_init1(IN_CLOEXEC | IN_NONBLOCK)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        self._lock = threading.RLock()
+        self._stopping = False
+        # (path, recursive) to InotifyWatch
+        self._watches = {}
+        # wd to list of (InotifyWatch, role, path watched by wd)
+        self._wd_watches = {}
+        # Counters
+        self.events_read = 0
+        self.events_dispatched = 0
+
+    def _add_wd(self, path, mask, watch, role):
+        wd = self._libc.inotify_add_watch(self._fd, _fsencode(path),
+                                          mask | IN_MASK_ADD)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        watch.wds.add(wd)
+        if role == 'file':
+            watch.file_wd = wd
+        entries = self._wd_watches.setdefault(wd, [])
+        entry = (watch, role, path)
+        if entry not in entries:
+            entries.append(entry)
+        return wd
+
+    def _rm_wd(self, wd, watch):
+        entries = [e for e in self._wd_watches.get(wd, [])
+                   if e[0] is not watch]
+        watch.wds.discard(wd)
+        if watch.file_wd == wd:
+            watch.file_wd = None
+        if entries:
+            self._wd_watches[wd] = entries
+            return
+        self._wd_watches.pop(wd, None)
+        # Fails when kernel already removed the watch, which is fine
+        self._libc.inotify_rm_watch(self._fd, wd)
+
+    def _add_dir_wds(self, watch, path):
+        self._add_wd(path, _DIR_MASK, watch, 'dir')
+        if not watch.recursive:
+            return
+        for name in os.listdir(path):
+            sub_path = os.path.join(path, name)
+            if os.path.isdir(sub_path) and not os.path.islink(sub_path):
+                self._add_dir_wds(watch, sub_path)
+
+    def schedule(self, event_handler, path, recursive=False):
+        '''Schedule event_handler to receive events of path.
+        Returns watch, to be used to unschedule'''
+        with self._lock:
+            key = (path, recursive)
+            watch = self._watches.get(key)
+            if watch is None:
+                watch = InotifyWatch(path, recursive, os.path.isdir(path))
+                if watch.is_directory:
+                    self._add_dir_wds(watch, path)
+                else:
+                    self._add_wd(os.path.dirname(path), _PARENT_MASK,
+                                 watch, 'parent')
+                    self._add_wd(path, _FILE_MASK, watch, 'file')
+                self._watches[key] = watch
+            watch.handlers.add(event_handler)
+            return watch
+
+    def add_handler_for_watch(self, event_handler, watch):
+        with self._lock:
+            watch.handlers.add(event_handler)
+
+    def remove_handler_for_watch(self, event_handler, watch):
+        '''Remove event_handler from watch. Watch is unscheduled
+        once it has no handlers left'''
+        with self._lock:
+            watch.handlers.remove(event_handler)
+            if not watch.handlers:
+                self.unschedule(watch)
+
+    def unschedule(self, watch):
+        with self._lock:
+            self._watches.pop(watch.key, None)
+            for wd in list(watch.wds):
+                self._rm_wd(wd, watch)
+            watch.handlers.clear()
+
+    def unschedule_all(self):
+        with self._lock:
+            for watch in list(self._watches.values()):
+                self.unschedule(watch)
+
+    def stop(self):
+        self._stopping = True
+        try:
+            os.write(self._wakeup_w, b'x')
+        except OSError:
+            pass
+
+    def run(self):
+        try:
+            while not self._stopping:
+                try:
+                    readable, _, _ = select.select(
+                        [self._fd, self._wakeup_r], [], [])
+                except (OSError, select.error) as e:
+                    if e.args[0] == errno.EINTR:
+                        continue
+                    raise
+                if self._fd in readable:
+                    self._read_events()
+        finally:
+            self.unschedule_all()
+            for fd in (self._fd, self._wakeup_r, self._wakeup_w):
+                os.close(fd)
+            LOG.debug("Inotify observer exiting. events read: %s, "
+                      "events dispatched: %s",
+                      self.events_read, self.events_dispatched)
+
+    def _read_events(self):
+        '''Read all queued events and dispatch them'''
+        try:
+            buf = os.read(self._fd, _READ_SIZE)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return
+            raise
+        events = []
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(buf):
+            wd, mask, cookie, length = _EVENT_HEADER.unpack_from(buf, offset)
+            offset += _EVENT_HEADER.size
+            name = buf[offset:offset + length].rstrip(b'\0')
+            offset += length
+            events.append((wd, mask, _fsdecode(name)))
+        self.events_read += len(events)
+        self._dispatch(events)
+
+    def _dispatch(self, events):
+        '''Translate a batch of inotify events to watchdog events.
+        Modify events of a watch are coalesced, modified event is
+        delivered once per batch, ahead of any other event of the watch'''
+        modified = []
+        with self._lock:
+            pending = []
+            for wd, mask, name in events:
+                if mask & IN_Q_OVERFLOW:
+                    LOG.warning("Inotify event queue overflowed")
+                    for watch in self._watches.values():
+                        if not watch.is_directory and watch not in modified:
+                            modified.append(watch)
+                    continue
+                if mask & IN_IGNORED:
+                    self._wd_watches.pop(wd, None)
+                    continue
+                for watch, role, path in list(self._wd_watches.get(wd, [])):
+                    if role == 'file':
+                        # Writes to a moved file are delivered too, till
+                        # file is re-created, so that it is read till end
+                        if mask & IN_MODIFY and watch not in modified:
+                            modified.append(watch)
+                        if mask & IN_MOVE_SELF:
+                            pending.append((watch,
+                                            watchdog.events.FileMovedEvent(
+                                                watch.path, '')))
+                    elif role == 'parent':
+                        self._on_parent_event(watch, mask, name, pending)
+                    else:
+                        self._on_dir_event(watch, path, mask, name, pending)
+            handlers = dict((watch, list(watch.handlers))
+                            for watch in self._watches.values())
+
+        # Modified events first, then rest of the events in order
+        for watch in modified:
+            self._deliver(handlers.get(watch, []),
+                          watchdog.events.FileModifiedEvent(watch.path))
+        for watch, event in pending:
+            self._deliver(handlers.get(watch, []), event)
+
+    def _on_parent_event(self, watch, mask, name, pending):
+        if name != os.path.basename(watch.path):
+            return
+        if mask & IN_DELETE:
+            pending.append((watch, watchdog.events.FileDeletedEvent(
+                watch.path)))
+        elif mask & (IN_CREATE | IN_MOVED_TO):
+            # (Re-)created, watch the new file instead of the old one
+            if watch.file_wd is not None:
+                self._rm_wd(watch.file_wd, watch)
+            try:
+                self._add_wd(watch.path, _FILE_MASK, watch, 'file')
+            except OSError as e:
+                LOG.error("Failed to watch %s. Error: %s", watch.path, e)
+                return
+            pending.append((watch, watchdog.events.FileCreatedEvent(
+                watch.path)))
+
+    def _on_dir_event(self, watch, path, mask, name, pending):
+        entry_path = os.path.join(path, name)
+        is_dir = bool(mask & IN_ISDIR)
+        if mask & IN_DELETE:
+            if is_dir:
+                event = watchdog.events.DirDeletedEvent(entry_path)
+            else:
+                event = watchdog.events.FileDeletedEvent(entry_path)
+            pending.append((watch, event))
+        elif mask & (IN_CREATE | IN_MOVED_TO):
+            if not is_dir:
+                pending.append((watch, watchdog.events.FileCreatedEvent(
+                    entry_path)))
+                return
+            pending.append((watch, watchdog.events.DirCreatedEvent(
+                entry_path)))
+            if watch.recursive:
+                # Entries created before the new directory got watched
+                try:
+                    self._add_dir_wds(watch, entry_path)
+                    for root, dirs, files in os.walk(entry_path):
+                        for file_name in files:
+                            pending.append((
+                                watch, watchdog.events.FileCreatedEvent(
+                                    os.path.join(root, file_name))))
+                except OSError as e:
+                    LOG.debug("Failed to watch %s. Error: %s",
+                              entry_path, e)
+
+    def _deliver(self, handlers, event):
+        for handler in handlers:
+            self.events_dispatched += 1
+            try:
+                handler.dispatch(event)
+            except Exception:
+                LOG.exception("Event handler %s failed on event %s",
+                              handler, event)
@@ -0,0 +1,704 @@
+"""Single pass matcher of all survey patterns.
+
+Survey patterns are combined into one alternation, so a line is scanned
+once for all of them, instead of once per pattern. Leading literal text
+of the patterns is merged into a trie, so that at any position of a line
+re module tries every distinct first char once, rather than every
+pattern. Alternatives are non-capturing groups, as capturing groups
+defeat re module's optimizations of an alternation.
+
+First configured survey group matching a line wins, as if every
+pattern were searched in turn:
+
+Combined pattern matches at the leftmost position any pattern matches.
+The pattern that matched is the first configured pattern that matches
+right at that position. A pattern configured before it could still
+match further in the line, so the search continues past that position
+with a combination of only the patterns configured before it, until no
+earlier pattern matches. Lines without any pattern in them, most of the
+lines, take a single scan.
+
+Patterns that can't be combined without changing their meaning are
+searched on their own:
+ - patterns with back references or conditionals, as their group
+   numbers shift once combined
+ - patterns with inline global flags, like (?i), which would apply to
+   all combined patterns
+ - patterns whose named groups clash with an earlier pattern's
+
+Most survey patterns are literals or require some literal text, like
+login:. Such patterns are not combined, but prefiltered: the literal
+text they require is looked up first, with a single scan for the
+literals of all of them, and a pattern is searched only in lines having
+its literal text. Lines and blocks of lines without any required literal
+in them are rejected without running any survey pattern.
+
+Blocks of lines read in a go can be scanned for all survey patterns at
+once, with all patterns combined in MULTILINE mode, instead of being
+split into lines searched one by one. Only lines a match starts in are
+cut out of the block and searched on their own.
+
+Multiline survey patterns, like of a Python traceback, are searched in a
+window of the last lines read, by MultilineMatcher. The window is
+searched only for lines having the anchor literal of a pattern, so lines
+without any anchor are never searched.
+"""
+
+import re
+
+import six
+from oslo_log import log as logging
+
+try:
+    # Python 3.11+
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+
+LOG = logging.getLogger(__name__)
+
+
+def _walk(parsed):
+    '''Yields (op name, op args) of all ops of parsed pattern,
+    including ops of its subpatterns'''
+    for op, av in parsed:
+        yield str(op).upper(), av
+        for item in (av if isinstance(av, (list, tuple)) else [av]):
+            if isinstance(item, sre_parse.SubPattern):
+                for sub_op in _walk(item):
+                    yield sub_op
+            elif isinstance(item, (list, tuple)):
+                for sub_item in item:
+                    if isinstance(sub_item, sre_parse.SubPattern):
+                        for sub_op in _walk(sub_item):
+                            yield sub_op
+
+
+def _has_group_refs(parsed):
+    '''Returns True when parsed pattern refers to groups by number'''
+    for name, av in _walk(parsed):
+        if name in ('GROUPREF', 'GROUPREF_EXISTS', 'GROUPREF_IGNORE',
+                    'GROUPREF_LOC_IGNORE', 'GROUPREF_UNI_IGNORE'):
+            return True
+    return False
+
+
+def is_combinable(re_obj, default_flags=None):
+    '''Returns True when re_obj can be searched as part of an
+    alternation with other patterns without changing its meaning'''
+    if default_flags is None:
+        default_flags = re.compile(re_obj.pattern[:0]).flags
+    if re_obj.flags != default_flags:
+        # Inline global flags
+        return False
+    try:
+        parsed = sre_parse.parse(re_obj.pattern)
+    except Exception:
+        return False
+    return not _has_group_refs(parsed)
+
+
+def is_block_scannable(re_obj):
+    '''Returns True when re_obj, searched in a block of lines in
+    MULTILINE mode, matches wherever it matches a line of the block
+    searched on its own. Block matches may span lines, but no line match
+    is missed. Patterns with negative lookarounds or \\A or \\Z can fail
+    in a block where they match a line, and are not block scannable'''
+    if not is_combinable(re_obj):
+        return False
+    for name, av in _walk(sre_parse.parse(re_obj.pattern)):
+        if name == 'ASSERT_NOT':
+            return False
+        if name == 'AT' and str(av).upper() in ('AT_BEGINNING_STRING',
+                                                'AT_END_STRING'):
+            return False
+    return True
+
+
+# Shortest literal worth prefiltering a pattern with
+_MIN_LITERAL_LENGTH = 2
+# Up to these many literals are looked up one by one with substring
+# search, which beats scanning for an alternation of few literals
+_MAX_LITERALS_TO_FIND = 8
+
+
+def _flag_free_subpattern(av):
+    '''Returns subpattern of SUBPATTERN op args, or None when the
+    group sets flags for its subpattern'''
+    if len(av) == 2:
+        # Python 2, (group, subpattern)
+        return av[1]
+    group, add_flags, del_flags, subpattern = av
+    if add_flags or del_flags:
+        return None
+    return subpattern
+
+
+def _required_literals(parsed):
+    '''Returns list of literal texts, one of which is in any text
+    parsed pattern matches, as lists of char codes. Returns None when
+    there is no such literal'''
+    candidates = []
+    run = []
+    for op, av in parsed:
+        name = str(op).upper()
+        if name == 'LITERAL':
+            run.append(av)
+            continue
+        if run:
+            candidates.append([run])
+            run = []
+        literals = None
+        if name == 'SUBPATTERN':
+            subpattern = _flag_free_subpattern(av)
+            if subpattern is not None:
+                literals = _required_literals(subpattern)
+        elif name == 'BRANCH':
+            branch_literals = [_required_literals(b) for b in av[1]]
+            if all(branch_literals):
+                literals = [lit for b in branch_literals for lit in b]
+        elif name in ('MAX_REPEAT', 'MIN_REPEAT'):
+            min_count, max_count, subpattern = av
+            if min_count >= 1:
+                literals = _required_literals(subpattern)
+        if literals:
+            candidates.append(literals)
+    if run:
+        candidates.append([run])
+    if not candidates:
+        return None
+    # Longest literals reject most lines
+    return max(candidates, key=lambda c: min(len(lit) for lit in c))
+
+
+def required_literals(re_obj):
+    '''Returns list of literal texts of same type as re_obj.pattern, one
+    of which is in any text re_obj matches. Returns None when re_obj has
+    no such literal of at least _MIN_LITERAL_LENGTH'''
+    if re_obj.flags & (re.IGNORECASE | re.VERBOSE):
+        return None
+    try:
+        parsed = sre_parse.parse(re_obj.pattern)
+    except Exception:
+        return None
+    literals = _required_literals(parsed)
+    if literals is None:
+        return None
+    if min(len(lit) for lit in literals) < _MIN_LITERAL_LENGTH:
+        return None
+    if isinstance(re_obj.pattern, bytes):
+        return [bytes(bytearray(lit)) for lit in literals]
+    return [u''.join(six.unichr(c) for c in lit) for lit in literals]
+
+
+def anchor_literal(re_obj):
+    '''Returns literal text of same type as re_obj.pattern, of at least
+    _MIN_LITERAL_LENGTH, in the last line of any text multiline re_obj
+    matches. It is the last literal text of the pattern, after any \\n
+    the pattern requires but ends with. Returns None when re_obj has no
+    such literal'''
+    if re_obj.flags & (re.IGNORECASE | re.VERBOSE):
+        return None
+    try:
+        parsed = sre_parse.parse(re_obj.pattern)
+    except Exception:
+        return None
+    newline = ord('\n')
+    # Chars of the literal text being looked at, in reverse
+    run = []
+    # Pattern has ops after the literal text being looked at
+    seen = False
+    for op, av in reversed(list(parsed)):
+        name = str(op).upper()
+        if name == 'LITERAL' and av != newline:
+            run.append(av)
+            continue
+        if len(run) >= _MIN_LITERAL_LENGTH:
+            break
+        if name == 'LITERAL' and seen:
+            # \n ending a line before the last line of a match
+            return None
+        seen = seen or name != 'LITERAL' or bool(run)
+        run = []
+    if len(run) < _MIN_LITERAL_LENGTH:
+        return None
+    run.reverse()
+    if isinstance(re_obj.pattern, bytes):
+        return bytes(bytearray(run))
+    return u''.join(six.unichr(c) for c in run)
+
+
+def compile_alternation(patterns, flags=0):
+    '''Compile alternation of str or bytes patterns, with their literal
+    prefixes merged in a trie'''
+    is_bytes = isinstance(patterns[0], bytes)
+    if is_bytes:
+        # latin-1 maps every byte to a char and back
+        patterns = [pattern.decode('latin-1') for pattern in patterns]
+    pattern = _trie_pattern(patterns)
+    if is_bytes:
+        pattern = pattern.encode('latin-1')
+    return re.compile(pattern, flags)
+
+
+# Characters that stand for themselves in a pattern
+_LITERAL_CHARS = frozenset(
+    'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+    ' _-:=,/<>@%\'"!#&~;`')
+_QUANTIFIER_CHARS = frozenset('*+?{')
+
+
+def _has_top_level_branch(pattern):
+    '''Returns True when pattern has a | outside of any group'''
+    depth = 0
+    in_class = False
+    escaped = False
+    for c in pattern:
+        if escaped:
+            escaped = False
+        elif c == '\\':
+            escaped = True
+        elif in_class:
+            in_class = c != ']'
+        elif c == '[':
+            in_class = True
+        elif c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif c == '|' and depth == 0:
+            return True
+    return False
+
+
+def split_literal_prefix(pattern):
+    '''Split pattern into leading literal text and rest of the pattern.
+    Literal prefix is empty for patterns with a top level |'''
+    if _has_top_level_branch(pattern):
+        return '', pattern
+    n = 0
+    while n < len(pattern) and pattern[n] in _LITERAL_CHARS:
+        n += 1
+    if n < len(pattern) and pattern[n] in _QUANTIFIER_CHARS:
+        # Quantifier applies to last literal char
+        n -= 1
+    return pattern[:max(n, 0)], pattern[max(n, 0):]
+
+
+def _trie_pattern(patterns):
+    '''Alternation of patterns with their literal prefixes merged in a
+    trie, so that re module tries each distinct prefix char once at a
+    position, instead of every pattern'''
+    trie = {}
+    for pattern in patterns:
+        prefix, rest = split_literal_prefix(pattern)
+        node = trie
+        for c in prefix:
+            node = node.setdefault(c, {})
+        node.setdefault(None, []).append(rest)
+    return _trie_node_pattern(trie)
+
+
+def _trie_node_pattern(node):
+    alternatives = []
+    for c, child in sorted((k, v) for k, v in node.items() if k is not None):
+        alternatives.append(c + _trie_node_pattern(child))
+    for rest in node.get(None, []):
+        alternatives.append('(?:' + rest + ')' if rest else '')
+    if len(alternatives) == 1:
+        return alternatives[0]
+    return '(?:' + '|'.join(alternatives) + ')'
+
+
+class SurveyMatcher(object):
+    """Searches a line for the first configured survey pattern in it.
+
+    re_objs is the list of (survey group name, compiled pattern), in
+    configured order.
+    Optional survey_groups are the reconn.utils.SurveyGroup of re_objs,
+    in same order, returned by match. With match_all, lines are searched
+    for all survey patterns in them, rather than the first configured.
+    """
+    def __init__(self, re_objs, survey_groups=None, match_all=False):
+        self._re_objs = list(re_objs)
+        self._survey_groups = survey_groups
+        self._match_all = match_all
+        # Index in re_objs of prefiltered patterns, in order
+        self._filtered = []
+        # Index in re_objs to required literals of prefiltered pattern
+        self._literals = {}
+        # Index in re_objs of patterns searched on their own
+        self._separate = []
+        # Index in re_objs of patterns combined, in order
+        self._combined = []
+        group_names = set()
+        for i, (survey_grp_name, re_obj) in enumerate(self._re_objs):
+            literals = required_literals(re_obj)
+            if literals is not None:
+                self._filtered.append(i)
+                self._literals[i] = literals
+            elif (is_combinable(re_obj) and
+                    not group_names.intersection(re_obj.groupindex)):
+                group_names.update(re_obj.groupindex)
+                self._combined.append(i)
+            else:
+                self._separate.append(i)
+        unfiltered = sorted(self._combined + self._separate)
+        # Combined pattern of first n combined patterns, compiled on use
+        self._prefix_re_objs = {}
+        # Index in re_objs to number of combined patterns before it
+        self._combined_position = {}
+        if len(self._combined) < 2:
+            # Nothing to gain from combining
+            self._separate = unfiltered
+            self._combined = []
+        elif self._compile_prefix(len(self._combined)) is None:
+            self._separate = unfiltered
+            self._combined = []
+        for position, i in enumerate(self._combined):
+            self._combined_position[i] = position
+
+        # Required literals of all prefiltered patterns, looked up
+        # one by one or with a single scan for all of them
+        self._all_literals = [literal for i in self._filtered
+                              for literal in self._literals[i]]
+        self._literal_re_obj = None
+        if len(self._all_literals) > _MAX_LITERALS_TO_FIND:
+            self._literal_re_obj = compile_alternation(
+                [re.escape(literal) for literal in self._all_literals])
+
+        # Combination of all patterns, scanning a block of lines for
+        # the lines any pattern may match in
+        self._block_re_obj = None
+        if self._re_objs and all(is_block_scannable(re_obj)
+                                 for _, re_obj in self._re_objs):
+            try:
+                self._block_re_obj = compile_alternation(
+                    [re_obj.pattern for _, re_obj in self._re_objs],
+                    re.MULTILINE)
+            except (re.error, AssertionError, OverflowError,
+                    RuntimeError) as e:
+                LOG.warning("Failed to combine survey patterns for "
+                            "scanning blocks. Error: %s", e)
+
+        # Prefilter statistics
+        self.lines = 0
+        self.lines_rejected = 0
+        # Index in re_objs to lines having the pattern's literal and to
+        # lines the pattern matched, of prefiltered patterns
+        self.candidates = dict((i, 0) for i in self._filtered)
+        self.matches = dict((i, 0) for i in self._filtered)
+        LOG.debug("Survey matcher: %s patterns prefiltered, %s combined, "
+                  "%s searched on their own", len(self._filtered),
+                  len(self._combined), len(self._separate))
+
+    @property
+    def combined_count(self):
+        return len(self._combined)
+
+    @property
+    def prefiltered_count(self):
+        return len(self._filtered)
+
+    @property
+    def block_scannable(self):
+        '''True when blocks of lines can be scanned with scan_block'''
+        return self._block_re_obj is not None
+
+    def _compile_prefix(self, n):
+        '''Compile combination of first n combined patterns'''
+        re_obj = self._prefix_re_objs.get(n)
+        if re_obj is not None:
+            return re_obj
+        patterns = [self._re_objs[i][1].pattern for i in self._combined[:n]]
+        try:
+            re_obj = compile_alternation(patterns)
+        except (re.error, AssertionError, OverflowError, RuntimeError) as e:
+            # Like too many groups for re module to handle
+            LOG.warning("Failed to combine survey patterns, searching "
+                        "them one by one. Error: %s", e)
+            return None
+        self._prefix_re_objs[n] = re_obj
+        return re_obj
+
+    def _match_at(self, line, pos, n):
+        '''Index in re_objs of first of first n combined patterns
+        matching at pos'''
+        for position in range(n):
+            i = self._combined[position]
+            if self._re_objs[i][1].match(line, pos) is not None:
+                return i
+        # Not reached, one of the patterns matched at pos
+        return self._combined[n - 1]
+
+    def prefilter_block(self, block):
+        '''Returns False when none of the lines in block can match any
+        survey pattern, so that block can be skipped as a whole'''
+        if self._combined or self._separate:
+            return True
+        if self._has_literal(block):
+            return True
+        n = block.count(b'\n' if isinstance(block, bytes) else u'\n')
+        self.lines += n
+        self.lines_rejected += n
+        return False
+
+    def _has_literal(self, text):
+        '''Returns True when text has any required literal in it'''
+        if self._literal_re_obj is not None:
+            return self._literal_re_obj.search(text) is not None
+        for literal in self._all_literals:
+            if literal in text:
+                return True
+        return False
+
+    def _search_filtered(self, i, line):
+        '''Returns True when prefiltered pattern i is found in line.
+        Pattern is searched only when line has its literal'''
+        for literal in self._literals[i]:
+            if literal in line:
+                break
+        else:
+            return False
+        self.candidates[i] += 1
+        if self._re_objs[i][1].search(line) is None:
+            return False
+        self.matches[i] += 1
+        return True
+
+    def _search_prefiltered(self, line, found):
+        '''Returns index in re_objs of first prefiltered pattern found
+        in line, configured before found, or found'''
+        for i in self._filtered:
+            if found is not None and i > found:
+                break
+            if self._search_filtered(i, line):
+                return i
+        return found
+
+    def search_index(self, line):
+        '''Returns index in re_objs of first configured pattern found in
+        line, or None'''
+        self.lines += 1
+        found = None
+        if self._combined or self._separate:
+            found = self._search_unfiltered(line)
+        if self._filtered:
+            if self._has_literal(line):
+                found = self._search_prefiltered(line, found)
+            else:
+                self.lines_rejected += 1
+        return found
+
+    def search_all(self, line):
+        '''Returns list of indexes in re_objs of all patterns found in
+        line, in configured order'''
+        self.lines += 1
+        found = []
+        if self._combined:
+            # Combined patterns are searched one by one only in lines
+            # some of them is found in
+            combined_re_obj = self._compile_prefix(len(self._combined))
+            if combined_re_obj.search(line) is not None:
+                found.extend(i for i in self._combined
+                             if self._re_objs[i][1].search(line) is not None)
+        for i in self._separate:
+            if self._re_objs[i][1].search(line) is not None:
+                found.append(i)
+        if self._filtered:
+            if self._has_literal(line):
+                found.extend(i for i in self._filtered
+                             if self._search_filtered(i, line))
+            else:
+                self.lines_rejected += 1
+        found.sort()
+        return found
+
+    def search_indexes(self, line):
+        '''Returns list of indexes in re_objs of patterns found in line:
+        all of them with match_all, otherwise the first configured'''
+        if self._match_all:
+            return self.search_all(line)
+        i = self.search_index(line)
+        return [] if i is None else [i]
+
+    def match_groups(self, line):
+        '''Returns list of SurveyGroup of patterns found in line: all of
+        them with match_all, otherwise the first configured'''
+        return [self._survey_groups[i] for i in self.search_indexes(line)]
+
+    def scan_block(self, block):
+        '''Yields (line, list of indexes in re_objs of patterns found in
+        line, as by search_indexes, start of line in block) of lines in
+        block having any survey pattern, in order. block holds complete
+        lines.
+
+        Block is scanned for all patterns at once. Only lines a match
+        starts in are cut out of the block and searched on their own, to
+        find the patterns in them, or none for a match spanning lines.
+        Scan resumes at the line after.'''
+        newline = b'\n' if isinstance(block, bytes) else u'\n'
+        n = block.count(newline)
+        # Lines not searched on their own are rejected
+        self.lines += n
+        self.lines_rejected += n
+        search = self._block_re_obj.search
+        size = len(block)
+        pos = 0
+        while pos < size:
+            match_obj = search(block, pos)
+            if match_obj is None or match_obj.start() == size:
+                break
+            start = match_obj.start()
+            end = block.find(newline, start)
+            end = size if end == -1 else end + 1
+            start = block.rfind(newline, 0, start) + 1
+            line = block[start:end]
+            # Counted again by search_indexes
+            self.lines -= 1
+            self.lines_rejected -= 1
+            found = self.search_indexes(line)
+            if found:
+                yield line, found, start
+            pos = end
+
+    def match_block(self, block):
+        '''Yields (line, list of SurveyGroup of patterns found in line, as
+        by match_groups, start of line in block) of lines in block having
+        any survey pattern, in order'''
+        for line, found, start in self.scan_block(block):
+            yield line, [self._survey_groups[i] for i in found], start
+
+    def _search_unfiltered(self, line):
+        found = None
+        if self._combined:
+            n = len(self._combined)
+            pos = 0
+            while n > 0:
+                match_obj = self._compile_prefix(n).search(line, pos)
+                if match_obj is None:
+                    break
+                pos = match_obj.start()
+                found = self._match_at(line, pos, n)
+                # Only patterns configured before found can still win
+                n = self._combined_position[found]
+                pos += 1
+                if pos > len(line):
+                    break
+        for i in self._separate:
+            if found is not None and i > found:
+                break
+            if self._re_objs[i][1].search(line) is not None:
+                return i
+        return found
+
+    def _pattern_text(self, i):
+        '''Configured text of pattern at index i of re_objs, rather than
+        the bytes it is compiled from'''
+        pattern = self._re_objs[i][1].pattern
+        if self._survey_groups is not None:
+            pattern = self._survey_groups[i].pattern
+        if isinstance(pattern, bytes):
+            pattern = pattern.decode('utf-8', 'replace')
+        return pattern
+
+    def get_stats(self):
+        '''Returns list of (survey group name, pattern text, lines having
+        its literal, lines matched) of prefiltered patterns'''
+        return [(self._re_objs[i][0], self._pattern_text(i),
+                 self.candidates[i], self.matches[i])
+                for i in self._filtered]
+
+    def log_stats(self):
+        LOG.info("Survey matcher prefilter rejected %s of %s lines",
+                 self.lines_rejected, self.lines)
+        for survey_grp_name, pattern, candidates, matches in \
+                self.get_stats():
+            LOG.info("Survey pattern %s of %s: literal in %s lines, "
+                     "matched %s of them (hit ratio %.2f)", pattern,
+                     survey_grp_name, candidates, matches,
+                     float(matches) / candidates if candidates else 0.0)
+
+    def match(self, line):
+        '''Returns SurveyGroup of first configured survey pattern found
+        in line, or None'''
+        i = self.search_index(line)
+        if i is None:
+            return None
+        return self._survey_groups[i]
+
+    def search(self, line):
+        '''Returns first configured survey pattern found in line and its
+        survey group name. Returns (None, None) when none is found'''
+        i = self.search_index(line)
+        if i is None:
+            return None, None
+        survey_grp_name, re_obj = self._re_objs[i]
+        LOG.debug("Matched %s in line: %s", re_obj.pattern, line)
+        return survey_grp_name, re_obj.pattern
+
+
+class MultilineMatcher(object):
+    """Searches multiline survey patterns in a window of last lines read.
+
+    survey_groups are the multiline reconn.utils.SurveyGroup, in
+    configured order. The pattern of a survey group is searched in the
+    window of its window_lines lines ending at a line having its anchor
+    literal, and matches when its match ends in that line. So a match is
+    found once, at its last line. A block of lines without any anchor is
+    rejected with a substring search per anchor.
+    """
+    def __init__(self, survey_groups):
+        self._survey_groups = list(survey_groups)
+        # Windows searched and windows matched, for statistics
+        self.windows = 0
+        self.matches = 0
+
+    def __len__(self):
+        return len(self._survey_groups)
+
+    def _search_window(self, survey_group, before, line):
+        '''Returns text matched by survey_group's pattern in before and
+        line, ending in line, or None'''
+        self.windows += 1
+        text = before + line
+        for match_obj in survey_group.re_obj.finditer(text):
+            if match_obj.end() > len(before):
+                self.matches += 1
+                return match_obj.group(0)
+        return None
+
+    def match_block(self, block, window, retired_groups=frozenset()):
+        '''Returns list of (end of line in block, SurveyGroup, matched
+        text) of matches ending in lines of block, in order of lines and
+        then configured order. Lines before block are taken from
+        reconn.reader.LineWindow window. block may be the partial last
+        line of a file, read after all lines in window. Survey groups in
+        retired_groups indexes are not searched'''
+        found = []
+        for survey_group in self._survey_groups:
+            if survey_group.index in retired_groups:
+                continue
+            anchor = survey_group.anchor
+            pos = block.find(anchor)
+            while pos != -1:
+                start = block.rfind(b'\n', 0, pos) + 1
+                end = block.find(b'\n', pos + len(anchor))
+                end = len(block) if end == -1 else end + 1
+                text = self._search_window(
+                    survey_group,
+                    window.lines_before(survey_group.window_lines - 1,
+                                        block, start),
+                    block[start:end])
+                if text is not None:
+                    found.append((end, survey_group.index, survey_group,
+                                  text))
+                pos = block.find(anchor, end)
+        found.sort(key=lambda item: item[:2])
+        return [(end, survey_group, text)
+                for end, _, survey_group, text in found]
+
+    def log_stats(self):
+        LOG.info("Multiline survey matcher searched %s windows, matched %s "
+                 "of them", self.windows, self.matches)
@@ -0,0 +1,149 @@
+"""Messages of survey actions, rendered from a compiled template.
+
+A message template, like survey_action_message_format, is a str.format
+style template. It is parsed once into its literal text and fields, with
+constant fields, like msg_user_data, substituted right away. Rendering a
+message then only puts values of the rest of the fields in place and
+joins the parts, rather than parsing the template for every message.
+
+A JSON template has values of fields escaped as JSON, so that a message
+stays valid JSON whatever the matched line holds, like quotes or control
+characters. A field within a JSON string gets the escaped text, and a
+field outside of any string a JSON string of its own.
+"""
+
+import json
+import string
+
+import six
+
+# Fields computed for every message
+computed_fields = ('timestamp', 'line', 'context', 'matched_pattern',
+                   'name')
+
+_formatter = string.Formatter()
+# JSON escapes of control characters, as json.dumps writes them
+_control_chars = dict(
+    (six.unichr(c), json.dumps(six.unichr(c))[1:-1]) for c in range(0x20))
+
+
+def _json_text(value):
+    '''value as text to put within a JSON string'''
+    return json.dumps(six.text_type(value), ensure_ascii=False)[1:-1]
+
+
+def _json_string(value):
+    '''value as a JSON string'''
+    return json.dumps(six.text_type(value), ensure_ascii=False)
+
+
+def _text(value):
+    return six.text_type(value)
+
+
+def _escape_literal(text, in_string):
+    '''Escape control characters of template literal text within JSON
+    strings. Returns the text and whether the text ends within a JSON
+    string, given whether it starts within one'''
+    chars = []
+    escaped = False
+    for char in text:
+        if not in_string:
+            in_string = char == '"'
+        elif escaped:
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif char == '"':
+            in_string = False
+        elif char in _control_chars:
+            char = _control_chars[char]
+        chars.append(char)
+    return u''.join(chars), in_string
+
+
+class MessageRenderer(object):
+    """Renders messages from a str.format style template.
+
+    constants are values of fields known once, like msg_user_data, and
+    are rendered into the template when it is compiled. Fields other
+    than constants are looked up in fields passed to render, and render
+    empty when not given. With json_template, values of fields are
+    escaped as JSON. Raises ValueError when template is malformed, or
+    with json_template, when it doesn't render valid JSON.
+    """
+    def __init__(self, template, constants=None, json_template=False):
+        self.template = template
+        constants = constants or {}
+        # Literal text and rendered constants, with None in place of
+        # fields rendered for every message
+        self._parts = []
+        # (index in parts, field name, conversion, format spec, escape)
+        # of fields rendered for every message
+        self._fields = []
+        in_string = False
+        try:
+            parsed = list(_formatter.parse(template))
+        except ValueError as e:
+            raise ValueError("Malformed message template %s: %s" %
+                             (template, e))
+        for literal, field_name, format_spec, conversion in parsed:
+            if literal:
+                if json_template:
+                    literal, in_string = _escape_literal(literal, in_string)
+                self._append(literal)
+            if field_name is None:
+                continue
+            escape = _text
+            if json_template:
+                escape = _json_text if in_string else _json_string
+            if field_name in constants:
+                self._append(escape(self._format(
+                    constants[field_name], conversion, format_spec)))
+                continue
+            self._fields.append((len(self._parts), field_name, conversion,
+                                 format_spec, escape))
+            self._parts.append(None)
+        if json_template:
+            self._check_json()
+
+    def _append(self, text):
+        '''Append literal text, merged into literal text before it'''
+        if self._parts and self._parts[-1] is not None:
+            self._parts[-1] += text
+        else:
+            self._parts.append(text)
+
+    @staticmethod
+    def _format(value, conversion, format_spec):
+        if conversion:
+            value = _formatter.convert_field(value, conversion)
+        if format_spec:
+            value = _formatter.format_field(value, format_spec)
+        return value
+
+    def _check_json(self):
+        sample = self.render(dict((field_name, u'"\n')
+                                  for _, field_name, _, _, _ in self._fields))
+        try:
+            json.loads(sample)
+        except ValueError as e:
+            raise ValueError("Message template %s does not render valid "
+                             "JSON: %s" % (self.template, e))
+
+    @property
+    def field_names(self):
+        '''Names of fields rendered for every message, in order'''
+        return [field_name for _, field_name, _, _, _ in self._fields]
+
+    def render(self, fields):
+        '''Returns message with values of fields in place'''
+        parts = list(self._parts)
+        for i, field_name, conversion, format_spec, escape in self._fields:
+            value = fields.get(field_name)
+            if value is None:
+                value = u''
+            elif conversion or format_spec:
+                value = self._format(value, conversion, format_spec)
+            parts[i] = escape(value)
+        return u''.join(parts)
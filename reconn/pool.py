@@ -0,0 +1,196 @@
+"""Process wide pool of RMQ connections.
+
+RMQ survey actions of the process, like ones of reconn sessions embedded
+in another application, share one connection per RMQ server, virtual
+host and credentials, each over a channel of its own. Exchanges, queues
+and bindings are declared once per connection, rather than by every
+action, and again once connection is re-established, in case RMQ server
+lost them."""
+
+import threading
+import time
+
+import pika
+
+from oslo_log import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+
+class PooledConnection(object):
+    """A pika.BlockingConnection shared by users of the pool.
+
+    pika connections are not thread safe, so users hold lock around any
+    use of the connection or its channels. Callbacks of a channel, like
+    confirms of its publishes, are called by whichever user serves
+    connection events, with lock held. Connection.Blocked and
+    Connection.Unblocked are passed on to callbacks of every user.
+    """
+    def __init__(self, key, parameters):
+        self.key = key
+        self.lock = threading.RLock()
+        self.connection = None
+        self.users = 0
+        self.blocked = False
+        self._parameters = parameters
+        # Entities declared over connection
+        self._declared = set()
+        self._blocked_callbacks = []
+        self._unblocked_callbacks = []
+
+    @property
+    def is_open(self):
+        return self.connection is not None and self.connection.is_open
+
+    def connect(self):
+        '''Connect to RMQ server, unless connected'''
+        with self.lock:
+            if self.is_open:
+                return
+            self.close()
+            self.connection = pika.BlockingConnection(
+                parameters=self._parameters)
+            self.blocked = False
+            # Declared again over new connection
+            self._declared.clear()
+            LOG.info("RMQ Connection with broker established at %s:%s" % (
+                self._parameters.host, self._parameters.port))
+            self.connection.add_on_connection_blocked_callback(
+                self._connection_blocked_callback)
+            self.connection.add_on_connection_unblocked_callback(
+                self._connection_unblocked_callback)
+
+    def channel(self):
+        '''Returns a new channel, re-establishing connection when it is
+        lost, like when another user's channel found it closed'''
+        with self.lock:
+            if not self.is_open:
+                LOG.info("Re-establishing RMQ connection")
+                self.connect()
+            return self.connection.channel()
+
+    def close(self):
+        with self.lock:
+            connection = self.connection
+            self.connection = None
+            if connection is not None and \
+                    not connection.is_closed and \
+                    not connection.is_closing:
+                connection.close()
+                LOG.debug("RMQ connection closed")
+
+    def declare_once(self, entity, declare):
+        '''Call declare to declare entity, like ('exchange', name, type),
+        unless entity is declared over connection already. Returns
+        whether declare was called'''
+        with self.lock:
+            if entity in self._declared:
+                LOG.debug("RMQ %s already declared", entity)
+                return False
+            declare()
+            self._declared.add(entity)
+            return True
+
+    def process_data_events(self, time_limit=0):
+        '''Serve connection events for up to time_limit seconds. Waiting
+        for events holds the connection, so a shared connection is only
+        polled, and the rest of time_limit slept without holding it'''
+        with self.lock:
+            if not self.is_open:
+                return
+            shared = self.users > 1
+            self.connection.process_data_events(
+                time_limit=0 if shared else time_limit)
+        if shared and time_limit:
+            time.sleep(time_limit)
+
+    def add_connection_callbacks(self, blocked_callback, unblocked_callback):
+        '''Add callbacks of a user for Connection.Blocked and
+        Connection.Unblocked. blocked_callback is called right away when
+        connection is blocked'''
+        with self.lock:
+            self._blocked_callbacks.append(blocked_callback)
+            self._unblocked_callbacks.append(unblocked_callback)
+            if self.blocked:
+                blocked_callback(None)
+
+    def remove_connection_callbacks(self, blocked_callback,
+                                    unblocked_callback):
+        with self.lock:
+            if blocked_callback in self._blocked_callbacks:
+                self._blocked_callbacks.remove(blocked_callback)
+            if unblocked_callback in self._unblocked_callbacks:
+                self._unblocked_callbacks.remove(unblocked_callback)
+
+    def _connection_blocked_callback(self, method):
+        self.blocked = True
+        for callback in list(self._blocked_callbacks):
+            callback(method)
+
+    def _connection_unblocked_callback(self, method):
+        self.blocked = False
+        for callback in list(self._unblocked_callbacks):
+            callback(method)
+
+
+class ConnectionPool(object):
+    """Connections to RMQ servers, by (host, port, virtual host, username,
+    password), shared by users acquiring them. A connection is closed once
+    its last user releases it."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._connections = {}
+
+    @staticmethod
+    def _key(parameters):
+        credentials = parameters.credentials
+        return (parameters.host, parameters.port, parameters.virtual_host,
+                getattr(credentials, 'username', None),
+                getattr(credentials, 'password', None))
+
+    def acquire(self, parameters):
+        '''Returns PooledConnection connected as per pika
+        ConnectionParameters parameters, shared by users acquiring it
+        with same RMQ server, virtual host and credentials. Raises
+        exceptions of pika.BlockingConnection when connecting fails'''
+        key = self._key(parameters)
+        with self._lock:
+            pooled = self._connections.get(key)
+            if pooled is None:
+                pooled = PooledConnection(key, parameters)
+                self._connections[key] = pooled
+            pooled.users += 1
+        try:
+            pooled.connect()
+        except Exception:
+            self.release(pooled)
+            raise
+        return pooled
+
+    def release(self, pooled):
+        '''Release pooled connection of a user. Closes it once released
+        by all of its users'''
+        with self._lock:
+            pooled.users -= 1
+            if pooled.users > 0:
+                return
+            if self._connections.get(pooled.key) is pooled:
+                del self._connections[pooled.key]
+        pooled.close()
+
+    def __len__(self):
+        return len(self._connections)
+
+
+_connection_pool = None
+_connection_pool_lock = threading.Lock()
+
+
+def get_connection_pool():
+    '''RMQ connection pool shared by all reconn sessions of the process'''
+    global _connection_pool
+    with _connection_pool_lock:
+        if _connection_pool is None:
+            _connection_pool = ConnectionPool()
+        return _connection_pool
@@ -0,0 +1,293 @@
+"""Block reader for target files.
+Reads large chunks of a file and hands out complete lines, carrying the
+trailing partial line over to the next read."""
+
+import io
+import re
+
+from oslo_log import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 256 * 1024
+# Bare \r, not followed by \n
+_bare_cr_re = re.compile(b'\r(?!\n)')
+# Largest repeat count re module takes on all python versions
+_MAX_REPEAT = 65535
+
+
+def _long_line_pattern(max_line_bytes):
+    '''Pattern matching start of a line longer than max_line_bytes'''
+    count = max_line_bytes + 1
+    repeats, rest = divmod(count, _MAX_REPEAT)
+    pattern = b'(?m)^'
+    if repeats:
+        pattern += b'(?:[^\n]{%d}){%d}' % (_MAX_REPEAT, repeats)
+    return pattern + b'[^\n]{%d}' % rest
+
+
+def split_lines(block):
+    '''Split a block of complete lines into a list of lines.
+    Every line keeps its trailing \\n, like file.readline() does'''
+    return io.BytesIO(block).readlines()
+
+
+def lines_before(data, end, count):
+    '''Returns start of the count lines before end in data, or start of
+    data, and number of lines found'''
+    begin = end
+    found = 0
+    while found < count and begin > 0:
+        begin = data.rfind(b'\n', 0, begin - 1) + 1
+        found += 1
+    return begin, found
+
+
+class LineWindow(object):
+    """Last max_lines lines of blocks read from a file.
+
+    Lines before a line of the block being read are sliced out of the
+    block, and the rest out of the last lines of blocks read before it,
+    kept as a single slice rather than a copy of every line read.
+    """
+    def __init__(self, max_lines):
+        self.max_lines = max_lines
+        self._tail = b''
+
+    def add_block(self, block):
+        '''Keep the last max_lines lines of block, and of blocks before
+        it when block has fewer lines'''
+        begin, found = lines_before(block, len(block), self.max_lines)
+        if found < self.max_lines and self._tail:
+            data = self._tail + block
+            begin, _ = lines_before(data, len(data), self.max_lines)
+            self._tail = data[begin:]
+        else:
+            self._tail = block[begin:]
+
+    def lines_before(self, count, block=None, start=None):
+        '''Returns up to count lines before the line starting at start
+        in block, or before lines yet to be read without block'''
+        before, found = b'', 0
+        if block is not None:
+            begin, found = lines_before(block, start, count)
+            before = block[begin:start]
+        if found < count and self._tail:
+            begin, _ = lines_before(self._tail, len(self._tail),
+                                    count - found)
+            before = self._tail[begin:] + before
+        return before
+
+    def clear(self):
+        self._tail = b''
+
+
+class LineReader(object):
+    """Reads a binary file object in chunks of chunk_size bytes.
+
+    Partial trailing line of every chunk is kept in a growable buffer
+    and prefixed to the next chunk, so that only complete lines are
+    handed to the caller.
+
+    Lines longer than max_line_bytes, when set, are either truncated to
+    max_line_bytes, discarding rest of the line, or split into lines of
+    max_line_bytes, as per long_line_policy. Either way lines handed out
+    and the partial line carried over stay bounded. With cr_terminates,
+    a bare \r, like that of a progress bar, ends a line as \n does.
+
+    With window_lines, window keeps the last window_lines lines of
+    blocks read before the one last read.
+    """
+    def __init__(self, file_obj, chunk_size=DEFAULT_CHUNK_SIZE,
+                 max_line_bytes=0, long_line_policy='truncate',
+                 cr_terminates=False, window_lines=0):
+        self._file = file_obj
+        self._chunk_size = chunk_size
+        self._partial = bytearray()
+        self._offset = file_obj.tell()
+        # Discard content till next \n, when reading starts mid line
+        self._skip_to_newline = False
+        self._max_line_bytes = max_line_bytes
+        self._split_long_lines = long_line_policy == 'split'
+        self._long_line_re = None
+        if max_line_bytes:
+            self._long_line_re = re.compile(
+                _long_line_pattern(max_line_bytes))
+        self._cr_terminates = cr_terminates
+        # Last byte read was a bare \r, yet to know if \n follows it
+        self._cr_pending = False
+        # Partial line is a long line being split
+        self._splitting = False
+        # Lines truncated or split for being longer than max_line_bytes
+        self.truncated_lines = 0
+        self.window = None
+        if window_lines:
+            self.window = LineWindow(window_lines)
+        # Block last read, added to window on next read
+        self._last_block = None
+
+    @property
+    def file(self):
+        return self._file
+
+    @property
+    def offset(self):
+        '''File position up to which the file has been read'''
+        return self._offset
+
+    @property
+    def partial_line(self):
+        '''Content read after the last \\n, not yet returned as a line'''
+        return bytes(self._partial)
+
+    def clear_partial_line(self):
+        del self._partial[:]
+
+    def resume(self, offset, partial_line=b''):
+        '''Continue reading from offset, with partial_line as the
+        content read before offset that is yet to be completed by \\n'''
+        self._file.seek(offset)
+        self._offset = offset
+        self._partial = bytearray(partial_line)
+        self._skip_to_newline = False
+        self._cr_pending = False
+        self._splitting = False
+        self._last_block = None
+        if self.window is not None:
+            self.window.clear()
+
+    def seek(self, offset):
+        '''Start reading from offset. When offset lands in middle of
+        a line, reading starts from the next line'''
+        self.resume(offset)
+        if offset > 0:
+            self._file.seek(offset - 1)
+            self._skip_to_newline = self._file.read(1) != b'\n'
+            self._file.seek(offset)
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def read_block(self):
+        '''Read one chunk from file.
+        Returns bytes holding one or more complete lines,
+        empty bytes when the chunk had no \\n in it,
+        or None at end of file.'''
+        if self.window is None:
+            return self._read_block()
+        if self._last_block:
+            self.window.add_block(self._last_block)
+        self._last_block = self._read_block()
+        return self._last_block
+
+    def _read_block(self):
+        chunk = self._file.read(self._chunk_size)
+        if not chunk:
+            return None
+        self._offset += len(chunk)
+
+        # Line completed by a bare \r ending the previous chunk
+        completed = b''
+        if self._cr_terminates:
+            completed, chunk = self._terminate_bare_cr(chunk)
+
+        if self._skip_to_newline:
+            nl = chunk.find(b'\n')
+            if nl == -1:
+                return completed
+            self._skip_to_newline = False
+            chunk = chunk[nl + 1:]
+
+        nl = chunk.rfind(b'\n')
+        if nl == -1:
+            # No line completed in this chunk, keep on carrying it.
+            self._partial.extend(chunk)
+            return completed + self._cut_long_partial_line()
+
+        if self._partial:
+            self._partial.extend(chunk[:nl + 1])
+            block = bytes(self._partial)
+            self._partial = bytearray(chunk[nl + 1:])
+        else:
+            block = chunk[:nl + 1]
+            self._partial = bytearray(chunk[nl + 1:])
+        # First line of block completes the line being split, if any
+        continued = self._splitting
+        self._splitting = False
+        if (self._long_line_re is not None and
+                self._long_line_re.search(block) is not None):
+            block = self._cut_long_lines(block, continued)
+        return completed + block + self._cut_long_partial_line()
+
+    def _terminate_bare_cr(self, chunk):
+        '''Replace bare \r in chunk with \n. Returns the partial line
+        completed by a bare \r that ended the previous chunk, or empty
+        bytes, and the chunk'''
+        completed = b''
+        if self._cr_pending:
+            self._cr_pending = False
+            if (not chunk.startswith(b'\n') and
+                    self._partial.endswith(b'\r')):
+                self._partial[-1:] = b'\n'
+                completed = bytes(self._partial)
+                self._partial = bytearray()
+        if chunk.endswith(b'\r'):
+            # Next chunk tells if this \r is bare
+            self._cr_pending = True
+            return completed, _bare_cr_re.sub(b'\n', chunk[:-1]) + b'\r'
+        return completed, _bare_cr_re.sub(b'\n', chunk)
+
+    def _cut_long_line(self, line):
+        '''Returns lines to hand out for line of content longer than
+        max_line_bytes, terminated or not'''
+        n = self._max_line_bytes
+        if not self._split_long_lines:
+            return line[:n] + b'\n'
+        if line.endswith(b'\n'):
+            line = line[:-1]
+        return b''.join(line[i:i + n] + b'\n'
+                        for i in range(0, len(line), n))
+
+    def _cut_long_lines(self, block, continued=False):
+        '''Cut lines of block longer than max_line_bytes. continued
+        tells the first line is the rest of a line counted already'''
+        lines = split_lines(block)
+        for i, line in enumerate(lines):
+            if len(line) > self._max_line_bytes + 1:
+                if i > 0 or not continued:
+                    self.truncated_lines += 1
+                lines[i] = self._cut_long_line(line)
+        return b''.join(lines)
+
+    def _cut_long_partial_line(self):
+        '''Hand out partial line once it is longer than max_line_bytes.
+        Rest of a truncated line is discarded till its \n. A split line
+        keeps carrying its last part'''
+        n = self._max_line_bytes
+        if not n or len(self._partial) <= n:
+            return b''
+        partial = bytes(self._partial)
+        if not self._splitting:
+            self.truncated_lines += 1
+        if not self._split_long_lines:
+            self._partial = bytearray()
+            self._skip_to_newline = True
+            self._cr_pending = False
+            return self._cut_long_line(partial)
+        # Carry the last part, up to max_line_bytes, till its \n
+        self._splitting = True
+        end = (len(partial) - 1) // n * n
+        self._partial = bytearray(partial[end:])
+        return self._cut_long_line(partial[:end])
+
+    def read_lines(self):
+        '''Read one chunk from file and return list of complete lines
+        in it, or None at end of file'''
+        block = self.read_block()
+        if block is None:
+            return None
+        return split_lines(block)
+
+    def close(self):
+        self._file.close()
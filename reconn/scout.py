@@ -1,9 +1,12 @@
 import os
 import sys
 import io
+import glob
 import time
 import threading
+import collections
 
+import six
 import watchdog
 import watchdog.events
 import watchdog.observers
@@ -14,23 +17,163 @@ from reconn import conf as reconn_conf
 from reconn import utils as reconn_utils
 from reconn import timeout as reconn_timeout
 from reconn import action as reconn_action
+from reconn import reader as reconn_reader
+from reconn import checkpoint as reconn_checkpoint
+from reconn import inotify as reconn_inotify
+from reconn import matcher as reconn_matcher
+from reconn import context as reconn_context
 
 
 CONF = reconn_conf.CONF
 LOG = logging.getLogger(__name__)
 
-file_lock = threading.Lock()
 survey_pattern_re_objs = None
-end_reconn = False
-last_line = ''
-target_file_exists = False
+# SurveyGroup of each configured survey group, in configured order
+survey_groups = ()
+# Retired survey group indexes to matcher of the rest of survey groups
+_active_matchers = {}
+# Lines before a line readers of target files keep in their window, for
+# context lines and multiline survey groups, and whether any survey
+# group has context lines
+_window_lines = 0
+_context_enabled = False
+# Encoding and error handler of target files, matched lines are decoded
+# with for survey actions
+_line_encoding = ('utf-8', 'replace')
+# Matcher searching a line for all survey patterns in one pass
+survey_matcher = None
+# Matcher of multiline survey groups, None when there are none
+multiline_matcher = None
+# Target file path to ReconnTarget obj of all files under reconn
+_targets = {}
+_targets_lock = threading.Lock()
+# Read offset checkpoints of target files, when checkpoint_file configured
+_checkpoint_store = None
+# Thread draining targets notified by observer, while reconn is running
+_reader = None
+# Set once observer is watching target files
+_ready = threading.Event()
+# Set when reconn is over on a target, wakes up main thread
+_wakeup = threading.Event()
+# Time reconn began at and time reconn was last over on a target
+_started_at = None
+_done_at = None
+# Longest main thread waits for wakeup, keeps it responsive to ctrl+c
+_MAX_WAKEUP_INTERVAL = 60
+
+
+class ReconnTarget(object):
+    '''Reconn state of a single target file.
+    Every target file has its own reader, tail state and end reconn
+    status. Survey patterns and survey actions are shared by all targets.
+    Optional timeout in seconds terminates reconn on this target alone,
+    even when nothing is written to it'''
+    def __init__(self, file_path, file_obj, timeout=None):
+        self.file_path = file_path
+        self.file = file_obj
+        self.lock = threading.Lock()
+        self.end_reconn = False
+        self.exists = True
+        self.closed = False
+        self.event_handler = None
+        self.watch = None
+        # Identity of file being read, device and inode number
+        self.dev = None
+        self.ino = None
+        # Monotonic clock time reconn on target times out at
+        self.deadline = None
+        self.timer = None
+        # Survey group index to lines acted on, of groups with max_matches
+        self.match_counts = {}
+        # Indexes of survey groups retired on target, and matcher of the
+        # rest of survey groups, None till a group retires
+        self.retired_groups = frozenset()
+        self.matcher = None
+        # Context lines of matched lines, when any survey group has them
+        self.context = None
+        if _context_enabled:
+            self.context = reconn_context.LineContext()
+        if timeout is not None:
+            self.deadline = reconn_timeout.monotonic() + timeout
+            self.timer = reconn_timeout.get_timer_service().call_later(
+                timeout, self._on_timeout)
+
+    def _on_timeout(self):
+        LOG.info("Reconn timed out on %s", self.file_path)
+        notify_reconn_done(self)
+
+    def is_timed_out(self):
+        return (self.deadline is not None and
+                reconn_timeout.monotonic() >= self.deadline)
+
+    def is_done(self):
+        '''Returns True when no more reconn is required on target'''
+        return (self.end_reconn is True or
+                self.exists is False or
+                self.is_timed_out() is True)
+
+    def close(self):
+        self.closed = True
+        if self.timer is not None:
+            self.timer.cancel()
+        self.file.close()
+
+
+class ReconnReader(threading.Thread):
+    '''Drains targets marked dirty by event handlers.
+    Event handlers only mark their target dirty and return, so observer
+    thread never waits on reading, pattern matching and survey actions.
+    Any number of events on a target before it is drained result in a
+    single drain of the target till EOF.'''
+    def __init__(self):
+        super(ReconnReader, self).__init__(name='ReconnReader')
+        self.daemon = True
+        self._cond = threading.Condition()
+        # Dirty targets in order they were marked dirty
+        self._dirty = collections.OrderedDict()
+        self._stopping = False
+        # Counters
+        self.events_received = 0
+        self.drains = 0
+
+    def mark_dirty(self, target):
+        with self._cond:
+            self.events_received += 1
+            if target not in self._dirty:
+                self._dirty[target] = True
+                self._cond.notify()
+
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+
+    def run(self):
+        while True:
+            with self._cond:
+                while not self._dirty and not self._stopping:
+                    self._cond.wait()
+                if self._stopping:
+                    break
+                # Target is clean again before it is drained. Event
+                # during drain marks it dirty to be drained once more.
+                target, _ = self._dirty.popitem(last=False)
+            if target.is_done():
+                continue
+            try:
+                lock_reconn_file(target)
+            except Exception:
+                LOG.exception("Failed to reconn %s", target.file_path)
+            self.drains += 1
+        LOG.info("Reconn reader exiting. events received: %s, "
+                 "drains: %s", self.events_received, self.drains)
 
 
 class FileEventHandler(watchdog.events.FileSystemEventHandler):
     '''Define handlers for any filesystem events for a  given file'''
-    def __init__(self, file_path, file_obj):
-        self._file_path = file_path
-        self._file = file_obj
+    def __init__(self, target):
+        self._target = target
+        self._file_path = target.file_path
         super(FileEventHandler, self).__init__()
 
     def _event_on_file_path(self, event):
@@ -40,27 +183,23 @@ class FileEventHandler(watchdog.events.FileSystemEventHandler):
             return False
 
     def on_any_event(self, event):
-        LOG.info("Event type:%s is_directory:%s src_path:%s",
-                 event.event_type,
-                 event.is_directory,
-                 event.src_path)
+        LOG.debug("Event type:%s is_directory:%s src_path:%s",
+                  event.event_type,
+                  event.is_directory,
+                  event.src_path)
 
     def on_deleted(self, event):
-        global target_file_exists
         if self._event_on_file_path(event):
-            target_file_exists = False
+            # NOTE(jay): observer is shared by all target files and
+            # must not be stopped here. Target is detached from
+            # observer by main thread.
+            self._target.exists = False
+            notify_reconn_done(self._target)
             LOG.info("RECONN on target_file is deleted. "
                      "Event type:%s is_directory:%s src_path:%s",
                      event.event_type,
                      event.is_directory,
                      event.src_path)
-            # NOTE(jay): observer can be stopped now safely.
-            # observer thread periodically checks if it has to stop
-            # and the below is a safe ask to observer to exit
-            LOG.info("Stopping observer thread. Thread %s %s exiting",
-                     threading.current_thread().ident,
-                     threading.current_thread().name)
-            threading.current_thread().stop()
 
     def on_modified(self, event):
         # LOG.debug("%s %s" % (threading.current_thread().ident,
@@ -72,135 +211,649 @@ class FileEventHandler(watchdog.events.FileSystemEventHandler):
         # time.sleep(5)
 
         if self._event_on_file_path(event):
-            if reconn_timeout.ReconnTimeout.is_timed_out() is True:
-                # NOTE(jay): observer can be stopped now safely.
-                # observer thread periodically checks if it has to stop
-                # and the below is a safe ask to observer to exit
-                LOG.info("Timeout!!! Stopping observer thread. "
-                         "Thread %s %s exiting",
-                         threading.current_thread().ident,
-                         threading.current_thread().name)
-                threading.current_thread().stop()
+            if self._target.is_done():
+                LOG.debug("Reconn done on %s. Ignoring event",
+                          self._file_path)
             else:
-                lock_reconn_file(self._file)
-
-
-def register_notification(file_path, file_obj):
-    '''Register callback for event on a file
-    descriptor'''
+                drain_target(self._target)
 
-    observer = watchdog.observers.Observer()
-    event_handler = FileEventHandler(file_path, file_obj)
-    observer.schedule(event_handler, path=os.path.dirname(file_path),
-                      recursive=False)
+    def on_created(self, event):
+        # Target file re-created after being rotated
+        if self._event_on_file_path(event) and not self._target.is_done():
+            drain_target(self._target)
 
-    return observer
-
-
-def act_on_pattern(survey_grp_name, matched_pattern, line):
-    if matched_pattern is None:
+    def on_moved(self, event):
+        if event.src_path == self._file_path:
+            # Rotated. Opened file handle still reads moved file.
+            LOG.info("RECONN target_file %s moved. Waiting for it to be "
+                     "re-created", event.src_path)
+        elif event.dest_path != self._file_path:
+            return
+        if not self._target.is_done():
+            drain_target(self._target)
+
+
+class GlobEventHandler(watchdog.events.FileSystemEventHandler):
+    '''Start reconn on files created or moved in, that match target glob.
+    Deleted files are detached by their own FileEventHandler'''
+    def __init__(self, observer, target_glob):
+        self._observer = observer
+        self._target_glob = target_glob
+        super(GlobEventHandler, self).__init__()
+
+    def _attach(self, file_path):
+        if not reconn_utils.match_target_glob(file_path, self._target_glob):
+            return
+        try:
+            target = add_target(self._observer, file_path,
+                                timeout=reconn_utils.get_reconn_timeout())
+        except (IOError, OSError) as e:
+            LOG.error("Failed to open console log file %s. Error: %s",
+                      file_path, e)
+            return
+        # File may have been written before its watch got scheduled
+        drain_target(target)
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self._attach(event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self._attach(event.dest_path)
+
+
+def create_observer():
+    '''Create observer of configured notification_engine.
+    Falls back to watchdog when inotify is not supported'''
+    if CONF.notification_engine == 'inotify':
+        if reconn_inotify.is_supported():
+            return reconn_inotify.InotifyObserver()
+        LOG.warning("inotify notification_engine is not supported on "
+                    "this platform. Using watchdog")
+    return watchdog.observers.Observer()
+
+
+def register_notification(observer, target):
+    '''Register callback for event on target file with observer.
+    Observer is shared by all target files. Watchdog observer watches
+    a directory once for all target files in it, inotify observer
+    watches the target file itself.'''
+    event_handler = FileEventHandler(target)
+    if isinstance(observer, reconn_inotify.InotifyObserver):
+        path = target.file_path
+    else:
+        path = os.path.dirname(target.file_path)
+    watch = observer.schedule(event_handler, path=path, recursive=False)
+    target.event_handler = event_handler
+    target.watch = watch
+    return watch
+
+
+def unregister_notification(observer, target):
+    '''De-register callback for events on target file'''
+    if target.watch is None:
         return
-    action_name = reconn_utils.get_survey_success_action_name(matched_pattern)
-    survey_action = reconn_action.get_survey_action(action_name)
-    survey_action.execute(survey_grp_name, matched_pattern, line)
-
-
-def reconn_file(f):
-    global end_reconn
-    global survey_pattern_re_objs
-    global last_line
-
+    try:
+        observer.remove_handler_for_watch(target.event_handler, target.watch)
+    except KeyError:
+        pass
+    target.event_handler = None
+    target.watch = None
+
+
+def get_captures(survey_group, line):
+    '''Named groups of survey group's pattern captured in line, decoded,
+    for message fields of survey actions'''
+    if not survey_group.re_obj.groupindex:
+        return {}
+    match_obj = survey_group.re_obj.search(line)
+    if match_obj is None:
+        return {}
+    return dict((name, value.decode(*_line_encoding))
+                for name, value in six.iteritems(match_obj.groupdict())
+                if value is not None)
+
+
+def act_on_survey_groups(matched_groups, line, context=None):
+    '''Execute success actions of survey groups matched in line, in
+    configured order. Returns True when any of them ends reconn.
+    Line is decoded here, only lines acted on are ever decoded.
+    context is the line with its context lines, defaults to line'''
+    text = line.decode(*_line_encoding)
+    context = text if context is None else context.decode(*_line_encoding)
+    end_reconn = False
+    for survey_group in matched_groups:
+        survey_group.action.execute(survey_group.name, survey_group.pattern,
+                                    text, context=context,
+                                    captures=get_captures(survey_group,
+                                                          line))
+        end_reconn = end_reconn or survey_group.is_end
+    return end_reconn
+
+
+def act_on_context_matches(matches):
+    for match in matches:
+        act_on_survey_groups(match.matched_groups, match.line, match.context)
+
+
+def act_on_match(target, matched_groups, line, block=None, start=None,
+                 position=None):
+    '''Act on survey groups matched in line of target, starting at start
+    in block read from position. With context lines, action is taken
+    once lines after line are read. Returns True when any of the groups
+    ends reconn'''
+    if target.context is None:
+        return act_on_survey_groups(matched_groups, line)
+    act_on_context_matches(target.context.add(line, matched_groups,
+                                              block, start,
+                                              target.file.window,
+                                              position))
+    return any(survey_group.is_end for survey_group in matched_groups)
+
+
+def flush_context(target):
+    '''Act on matches held for lines after them, as no more lines of
+    target are to be read'''
+    if target.context is not None:
+        act_on_context_matches(target.context.flush())
+
+
+def get_matcher(target):
+    '''Matcher of survey groups not retired on target'''
+    if target.matcher is not None:
+        return target.matcher
+    return survey_matcher
+
+
+def get_active_matcher(retired_groups):
+    '''Matcher of survey groups other than retired_groups, shared by
+    targets having same survey groups retired'''
+    matcher = _active_matchers.get(retired_groups)
+    if matcher is None:
+        active_groups = [survey_group for survey_group in survey_groups
+                         if survey_group.index not in retired_groups and
+                         not survey_group.multiline]
+        matcher = reconn_matcher.SurveyMatcher(
+            [(survey_group.name, survey_group.re_obj)
+             for survey_group in active_groups],
+            active_groups, match_all=CONF.match_mode == 'all')
+        _active_matchers[retired_groups] = matcher
+    return matcher
+
+
+def retire_survey_groups(target, matched_groups):
+    '''Count lines matched_groups are acted on for in target and retire
+    groups reaching their max_matches. Returns True once all survey
+    groups are retired on target'''
+    retired = False
+    for survey_group in matched_groups:
+        if not survey_group.max_matches:
+            continue
+        count = target.match_counts.get(survey_group.index, 0) + 1
+        target.match_counts[survey_group.index] = count
+        if count >= survey_group.max_matches:
+            LOG.info("Survey group %s retired on %s after %s matches",
+                     survey_group.name, target.file_path, count)
+            target.retired_groups = target.retired_groups.union(
+                [survey_group.index])
+            retired = True
+    if not retired:
+        return False
+    if len(target.retired_groups) == len(survey_groups):
+        LOG.info("All survey groups retired on %s", target.file_path)
+        return True
+    target.matcher = get_active_matcher(target.retired_groups)
+    return False
+
+
+def match_block(matcher, block):
+    '''Yields (line, list of SurveyGroup, start of line in block) of
+    lines in block matching survey patterns of matcher, in order'''
+    if CONF.scan_mode == 'block' and matcher.block_scannable:
+        for line, matched_groups, start in matcher.match_block(block):
+            yield line, matched_groups, start
+        return
+    start = 0
+    for line in reconn_reader.split_lines(block):
+        matched_groups = matcher.match_groups(line)
+        if matched_groups:
+            yield line, matched_groups, start
+        start += len(line)
+
+
+def match_window(target, block):
+    '''List of (end of line in block, SurveyGroup, matched text) of
+    multiline survey groups matched in block, not retired on target'''
+    if multiline_matcher is None:
+        return []
+    return multiline_matcher.match_block(block, target.file.window,
+                                         target.retired_groups)
+
+
+def merge_window_matches(matches, window_matches):
+    '''Yields (line, list of SurveyGroup, start of line in block) of
+    matches, and (matched text, [SurveyGroup], None) of window_matches of
+    multiline survey groups after matches of their last line, in order
+    of lines'''
+    window_matches = collections.deque(window_matches)
+    for line, matched_groups, start in matches:
+        while window_matches and window_matches[0][0] <= start:
+            end, survey_group, text = window_matches.popleft()
+            yield text, [survey_group], None
+        yield line, matched_groups, start
+    for end, survey_group, text in window_matches:
+        yield text, [survey_group], None
+
+
+def reconn_file(target):
+    '''Read target file from its current position till EOF and
+    act on survey patterns found in each line.'''
+    f = target.file
+    context = target.context
+    position = None
     eof = False
     while(not eof and
-            not end_reconn and
-            not reconn_timeout.ReconnTimeout.is_timed_out()):
-        line = f.readline()
-
-        if line == '':
+            not target.end_reconn and
+            not target.is_timed_out()):
+        if context is not None:
+            # Position to read block again from, for matches held in it
+            position = (f.offset, f.partial_line)
+        block = f.read_block()
+
+        if block is None:
             eof = True
             continue
 
-        if last_line != '':
-            line = last_line + line
-            last_line = ''
+        if not block:
+            continue
 
-        if line[-1] != '\n':
-            # readline returned due to EOF
-            # Because pattern is matched on each line, buffer
-            # read contents till \n is read
-            last_line = line
-        else:
-            # readline returned due to \n
-            survey_grp_name, matched_pattern = reconn_utils.search_patterns(
-                survey_pattern_re_objs, line)
-            act_on_pattern(survey_grp_name, matched_pattern, line)
-            if reconn_utils.is_pattern_to_end_reconn(matched_pattern):
+        if context is not None:
+            # Lines after matches of blocks read before
+            act_on_context_matches(context.feed(block))
+
+        matcher = get_matcher(target)
+        matches = None
+        if matcher.prefilter_block(block):
+            matches = match_block(matcher, block)
+        window_matches = match_window(target, block)
+        if window_matches:
+            matches = merge_window_matches(matches or (), window_matches)
+        if matches is None:
+            # No line in block can match any survey pattern
+            continue
+
+        # Pattern is matched on each complete line. Partial line
+        # read till EOF is carried by reader until its \n is read.
+        for line, matched_groups, start in matches:
+            if start is None:
+                # Matched text of a multiline survey group
+                if matched_groups[0].index in target.retired_groups:
+                    continue
+            elif get_matcher(target) is not matcher:
+                # Survey groups retired since block got matched. Lines
+                # matching none of the groups can't match fewer groups
+                matched_groups = get_matcher(target).match_groups(line)
+                if not matched_groups:
+                    continue
+            end_reconn = act_on_match(target, matched_groups, line,
+                                      block, start, position)
+            if retire_survey_groups(target, matched_groups) or end_reconn:
                 # End Reconn pattern matched
-                end_reconn = True
-                # print line.rstrip('\n')
+                flush_context(target)
+                target.end_reconn = True
+                notify_reconn_done(target)
                 return
 
-        # print line.rstrip('\n')
-
     # Reconn last line for patterns:
-    if (end_reconn is False and
-            reconn_timeout.ReconnTimeout.is_timed_out() is False and
+    last_line = f.partial_line
+    if (target.end_reconn is False and
+            target.is_timed_out() is False and
             eof is True and
-            last_line != ''):
-
-        survey_grp_name, matched_pattern = reconn_utils.search_patterns(
-            survey_pattern_re_objs, last_line)
-        act_on_pattern(survey_grp_name, matched_pattern, last_line)
-        if matched_pattern is not None:
-            # Some pattern matched. No longer to carry last_line's content.
-            last_line = ''
-
-        if reconn_utils.is_pattern_to_end_reconn(matched_pattern):
-            # End Reconn pattern matched
-            end_reconn = True
+            last_line):
+
+        last_matches = []
+        matched_groups = get_matcher(target).match_groups(last_line)
+        if matched_groups:
+            last_matches.append((last_line, matched_groups))
+        last_matches.extend((text, [survey_group]) for _, survey_group, text
+                            in match_window(target, last_line))
+        if not last_matches:
+            return
+        if context is not None:
+            position = (f.offset, last_line)
+        # Some pattern matched. No longer to carry last_line's content.
+        f.clear_partial_line()
+
+        for line, matched_groups in last_matches:
+            end_reconn = act_on_match(target, matched_groups, line,
+                                      position=position)
+            if retire_survey_groups(target, matched_groups) or end_reconn:
+                # End Reconn pattern matched
+                flush_context(target)
+                target.end_reconn = True
+                notify_reconn_done(target)
+                return
 
 
-def lock_reconn_file(f):
+def lock_reconn_file(target):
     '''Lock before reading file, avoid race between
     main thread and event handler.
     Main thread requires reading of file so that it reads existing
     content to avoid a situation of no more events on file.'''
-    file_lock.acquire()
-    reconn_file(f)
-    file_lock.release()
-
-
-def reconn_forever(console_file, observer):
-    global end_reconn
-
+    target.lock.acquire()
+    try:
+        if target.closed:
+            # Removed from reconn while waiting for lock
+            return
+        follow_truncation(target)
+        reconn_file(target)
+        if follow_rotation(target):
+            reconn_file(target)
+        checkpoint_target(target)
+    finally:
+        target.lock.release()
+
+
+def notify_reconn_done(target):
+    '''Wake up main thread to detach target, as reconn on it is over'''
+    global _done_at
+    _done_at = time.time()
+    LOG.debug("Reconn over on %s", target.file_path)
+    _wakeup.set()
+
+
+def wait_ready(timeout=None):
+    '''Wait till reconn is watching target files, so that writes to
+    them from now on are reconned. Returns False on timeout'''
+    return _ready.wait(timeout)
+
+
+def get_wakeup_timeout():
+    '''Seconds main thread can wait for a wakeup before it has to save
+    checkpoints. Timeouts wake main thread up on their own'''
+    timeouts = [_MAX_WAKEUP_INTERVAL]
+    if _checkpoint_store is not None:
+        timeouts.append(CONF.checkpoint_interval)
+    return min(timeouts)
+
+
+def drain_target(target):
+    '''Have target read till EOF. Target is marked dirty for reader
+    thread to drain while reconn is running, else read right away'''
+    reader = _reader
+    if reader is not None:
+        reader.mark_dirty(target)
+    else:
+        lock_reconn_file(target)
+
+
+def follow_truncation(target):
+    '''Read target from beginning when file shrunk below read offset,
+    like on copytruncate rotation. Returns True when truncated'''
+    if target.ino is None:
+        return False
+    size = os.fstat(target.file.fileno()).st_size
+    if size >= target.file.offset:
+        return False
+    LOG.info("RECONN target_file %s truncated from %s to %s bytes. "
+             "Reading from beginning", target.file_path,
+             target.file.offset, size)
+    # Matches held get no more lines of content before truncation
+    flush_context(target)
+    target.file.resume(0)
+    return True
+
+
+def follow_rotation(target):
+    '''Switch target over to a new file created at target's file path,
+    after the rotated file is read till its end, like on rename and
+    create rotation. Returns True when switched to new file'''
+    if target.ino is None:
+        return False
+    try:
+        stat = os.stat(target.file_path)
+    except OSError:
+        # Rotated, new file is not created yet
+        return False
+    if (stat.st_dev, stat.st_ino) == (target.dev, target.ino):
+        return False
+    try:
+        file_obj = open_target_file(target.file_path)
+    except (IOError, OSError) as e:
+        LOG.error("Failed to open rotated console log file %s. Error: %s",
+                  target.file_path, e)
+        return False
+    LOG.info("RECONN target_file %s rotated. Reading new file from "
+             "beginning", target.file_path)
+    stat = os.fstat(file_obj.fileno())
+    # Matches held get no more lines of the rotated file
+    flush_context(target)
+    old_file_obj = target.file
+    target.file = file_obj
+    target.dev, target.ino = stat.st_dev, stat.st_ino
+    log_truncated_lines(target.file_path, old_file_obj)
+    old_file_obj.close()
+    return True
+
+
+def open_target_file(file_path):
+    '''Open file_path for reading lines, as configured.
+    Raises IOError or OSError when file can't be opened'''
+    return reconn_reader.LineReader(
+        io.open(file_path, 'rb'), CONF.read_chunk_size,
+        max_line_bytes=CONF.max_line_bytes,
+        long_line_policy=CONF.long_line_policy,
+        cr_terminates=CONF.cr_line_terminator,
+        window_lines=_window_lines)
+
+
+def log_truncated_lines(file_path, file_obj):
+    if file_obj.truncated_lines:
+        LOG.warning("%s lines of %s longer than max_line_bytes %s were "
+                    "handled by long_line_policy %s",
+                    file_obj.truncated_lines, file_path,
+                    CONF.max_line_bytes, CONF.long_line_policy)
+
+
+def checkpoint_target(target):
+    '''Record read offset of target. Saved to checkpoint file
+    periodically by main thread. While matches are held for lines after
+    them, offset the oldest of them was read from is recorded instead,
+    so that they are not lost on a restart before they are acted on'''
+    if _checkpoint_store is None or target.ino is None:
+        return
+    offset, partial_line = target.file.offset, target.file.partial_line
+    if target.context is not None:
+        held_position = target.context.held_position
+        if held_position is not None:
+            offset, partial_line = held_position
+    _checkpoint_store.update(target.file_path, target.dev, target.ino,
+                             offset, partial_line)
+
+
+def resume_target(target):
+    '''Seek target to its checkpointed offset, if the checkpoint
+    belongs to the same file. Returns True when resumed'''
+    if _checkpoint_store is None or target.ino is None:
+        return False
+    checkpoint = _checkpoint_store.get(target.file_path,
+                                       target.dev, target.ino)
+    if checkpoint is None:
+        return False
+    offset, partial_line = checkpoint
+    if os.fstat(target.file.fileno()).st_size < offset:
+        LOG.info("%s is smaller than its checkpoint offset %s. "
+                 "Reading from beginning", target.file_path, offset)
+        return False
+    target.file.resume(offset, partial_line)
+    LOG.info("Resuming reconn on %s from offset %s",
+             target.file_path, offset)
+    return True
+
+
+def seek_start_position(target, start_position):
+    '''Seek target file to start_position, a tuple as returned by
+    reconn.utils.parse_start_position'''
+    kind, n = start_position
+    if kind == 'beginning':
+        return
+    size = os.fstat(target.file.fileno()).st_size
+    if kind == 'end':
+        offset = size
+    elif kind == 'offset':
+        offset = min(n, size)
+    else:
+        offset = max(0, size - n)
+    target.file.seek(offset)
+    LOG.info("Reconn on %s starts from offset %s", target.file_path, offset)
+
+
+def save_checkpoints(force=False):
+    if _checkpoint_store is not None:
+        _checkpoint_store.save(force=force)
+
+
+def add_target(observer, file_path, timeout=None, start_position=None):
+    '''Open file_path and start reconn on it.
+    Unless resumed from checkpoint, file is read from start_position
+    or beginning.
+    Returns ReconnTarget obj. Raises IOError when file can't be opened'''
+    existing_target = None
+    with _targets_lock:
+        existing_target = _targets.get(file_path)
+    if existing_target is not None:
+        if not existing_target.is_done():
+            return existing_target
+        # File re-created at same path before its old target got detached
+        remove_target(observer, file_path)
+
+    file_obj = open_target_file(file_path)
+    target = ReconnTarget(file_path, file_obj, timeout=timeout)
+    stat = os.fstat(file_obj.fileno())
+    target.dev, target.ino = stat.st_dev, stat.st_ino
+    if not resume_target(target) and start_position is not None:
+        seek_start_position(target, start_position)
+    with _targets_lock:
+        if file_path in _targets:
+            target.close()
+            return _targets[file_path]
+        _targets[file_path] = target
+    register_notification(observer, target)
+    LOG.info("Reconn target file added: %s", file_path)
+    return target
+
+
+def remove_target(observer, file_path):
+    '''Stop reconn on file_path. Other target files are not disturbed'''
+    with _targets_lock:
+        target = _targets.pop(file_path, None)
+    if target is None:
+        return
+    unregister_notification(observer, target)
+    # Wait for in progress read, if any, to finish
+    with target.lock:
+        # Held matches are acted on before offset past them is recorded
+        flush_context(target)
+        if target.exists:
+            checkpoint_target(target)
+        elif _checkpoint_store is not None:
+            _checkpoint_store.remove(file_path)
+        log_truncated_lines(file_path, target.file)
+        target.close()
+    LOG.info("Reconn target file removed: %s", file_path)
+
+
+def get_targets():
+    '''Returns list of ReconnTarget objs under reconn'''
+    with _targets_lock:
+        return list(_targets.values())
+
+
+def remove_done_targets(observer):
+    '''Remove targets that matched end reconn pattern or are deleted.
+    Returns number of targets still under reconn'''
+    for target in get_targets():
+        if target.is_done():
+            remove_target(observer, target.file_path)
+    return len(get_targets())
+
+
+def watch_target_glob(observer, target_glob):
+    '''Watch for files matching target_glob to be created.
+    Returns False when there is no directory to watch'''
+    base_dir, recursive = reconn_utils.get_target_glob_base_dir(target_glob)
+    if not os.path.isdir(base_dir):
+        LOG.error("Directory %s of target_glob %s does not exist",
+                  base_dir, target_glob)
+        return False
+    observer.schedule(GlobEventHandler(observer, target_glob),
+                      path=base_dir, recursive=recursive)
+    LOG.info("Reconn target glob: %s, watching %s recursive: %s",
+             target_glob, base_dir, recursive)
+    return True
+
+
+def attach_target_glob_files(observer, target_glob):
+    '''Start reconn on existing files matching target_glob'''
+    start_position = reconn_utils.parse_start_position(CONF.start_position)
+    for file_path in sorted(glob.glob(target_glob)):
+        if not os.path.isfile(file_path):
+            continue
+        try:
+            add_target(observer, file_path,
+                       timeout=reconn_utils.get_reconn_timeout(),
+                       start_position=start_position)
+        except (IOError, OSError) as e:
+            LOG.error("Failed to open console log file %s. Error: %s",
+                      file_path, e)
+
+
+def reconn_forever(observer, target_glob=None):
+    '''Reconn on all targets until done.
+    With target_glob, reconn is resident and keeps attaching new files
+    matching target_glob till interrupted'''
+    global _reader, _started_at
+    if _started_at is None:
+        _started_at = time.time()
+    _wakeup.clear()
+    _reader = ReconnReader()
+    _reader.start()
+    # Paths are watched by the time observer has started
     observer.start()
-    # Wait for observer thread to start. Don't want to miss any events
-    time.sleep(2)
+    _ready.set()
+    LOG.info("RECONN ready in %.3f seconds", time.time() - _started_at)
     LOG.debug("observer id:%s, is_alive %s, is_daemon: %s",
               observer.ident,
               observer.is_alive(),
               observer.isDaemon())
     reconn_utils.log_native_threads()
 
+    if target_glob is not None:
+        # Files created from now on are notified to GlobEventHandler
+        attach_target_glob_files(observer, target_glob)
+
     # Case: when log file has all data in it and no more writes will happen,
     # so main thread has to reconn once.
-    lock_reconn_file(console_file)
+    for target in get_targets():
+        lock_reconn_file(target)
 
     # Allow ctrl+c to work:
     try:
         while True:
-            time.sleep(1)
-            # reconn_utils.log_native_threads()
-
-            if (end_reconn is True or
-                    reconn_timeout.ReconnTimeout.is_timed_out() is True or
-                    target_file_exists is False):
+            # Cleared before checking targets, so that reconn getting
+            # over on a target from now on is not missed
+            _wakeup.clear()
+            remaining_targets = remove_done_targets(observer)
+            save_checkpoints()
+            if target_glob is None and remaining_targets == 0:
                 break
+            _wakeup.wait(get_wakeup_timeout())
     except KeyboardInterrupt:
-        terminate_reconn(observer, console_file)
+        terminate_reconn(observer)
         return
 
-    terminate_reconn(observer, console_file)
+    terminate_reconn(observer)
 
 
 def register_reconn():
@@ -208,7 +861,8 @@ def register_reconn():
 
 
 def init_reconn(argv):
-    global survey_pattern_re_objs
+    global survey_pattern_re_objs, survey_groups, survey_matcher
+    global multiline_matcher, _line_encoding, _window_lines, _context_enabled
 
     reconn_utils.suppress_imported_modules_logging()
 
@@ -216,46 +870,133 @@ def init_reconn(argv):
 
     reconn_utils.register_configured_reconn_survey_groups()
 
-    survey_pattern_re_objs = reconn_utils.create_re_objs()
-
     success_action_names = reconn_utils.register_reconn_survey_action_groups()
 
-    reconn_action.create_survey_actions(success_action_names)
-
+    try:
+        reconn_action.create_survey_actions(success_action_names)
+    except ValueError as e:
+        LOG.error("Invalid message format of survey action: %s", e)
+        LOG.info("Exiting")
+        sys.exit(1)
 
-def terminate_reconn(observer, target_file):
+    _line_encoding = (CONF.target_encoding, CONF.target_encoding_errors)
+    try:
+        survey_groups = reconn_utils.create_survey_groups(
+            reconn_action.get_survey_action)
+    except ValueError as e:
+        LOG.error("Invalid survey group configuration: %s", e)
+        LOG.info("Exiting")
+        sys.exit(1)
+    survey_pattern_re_objs = [(survey_group.name, survey_group.re_obj)
+                              for survey_group in survey_groups]
+    line_groups = [survey_group for survey_group in survey_groups
+                   if not survey_group.multiline]
+    multiline_groups = [survey_group for survey_group in survey_groups
+                        if survey_group.multiline]
+    survey_matcher = reconn_matcher.SurveyMatcher(
+        [(survey_group.name, survey_group.re_obj)
+         for survey_group in line_groups],
+        line_groups, match_all=CONF.match_mode == 'all')
+    multiline_matcher = None
+    if multiline_groups:
+        multiline_matcher = reconn_matcher.MultilineMatcher(multiline_groups)
+    _active_matchers.clear()
+    _window_lines = max(
+        [0] + [survey_group.context_before for survey_group in line_groups] +
+        [survey_group.window_lines - 1 for survey_group in multiline_groups])
+    if multiline_groups:
+        # Multiline matcher reads lines before a block from the window
+        _window_lines = max(_window_lines, 1)
+    _context_enabled = any(
+        survey_group.context_before or survey_group.context_after
+        for survey_group in survey_groups)
+
+
+def terminate_reconn(observer):
     '''Reconn closure activities executed here.
-    Called when timeout or end reconn pattern matched or target file deleted.
+    Called when timeout or end reconn pattern matched or target file deleted
+    on all target files.
     Discontinue any more reconn on files.'''
     LOG.info("Terminating RECONN. Safe clean up in progress.")
+    global _reader, _started_at, _done_at
+    _ready.clear()
     if observer.is_alive():
         observer.stop()
     observer.join()
+    if _reader is not None:
+        _reader.stop()
+        _reader.join()
+        _reader = None
     reconn_utils.log_native_threads()
-    target_file.close()
+    for target in get_targets():
+        remove_target(observer, target.file_path)
+    save_checkpoints(force=True)
     reconn_action.destroy_survey_actions()
+    if survey_matcher is not None:
+        survey_matcher.log_stats()
+    if multiline_matcher is not None:
+        multiline_matcher.log_stats()
+    if _done_at is not None:
+        LOG.info("RECONN terminated %.3f seconds after reconn got over",
+                 time.time() - _done_at)
+    _started_at = None
+    _done_at = None
+
+
+def init_checkpoints():
+    '''Create checkpoint store when checkpoint_file is configured'''
+    global _checkpoint_store
+    if CONF.checkpoint_file is None:
+        return
+    _checkpoint_store = reconn_checkpoint.CheckpointStore(
+        CONF.checkpoint_file,
+        reconn_checkpoint.get_patterns_hash(survey_pattern_re_objs),
+        interval=CONF.checkpoint_interval)
 
 
 def begin_reconn():
-    global target_file_exists
-    LOG.info("Reconn target file: %s", CONF.target_file)
-    try:
-        console_file = io.open(CONF.target_file, 'rb')
-    except (IOError, TypeError) as e:
-        LOG.error("Failed to open console log file. Error: %s", e)
+    global _started_at
+    _started_at = time.time()
+    target_files = reconn_utils.get_reconn_target_files()
+    target_glob = CONF.target_glob
+    if target_files == [] and target_glob is None:
+        LOG.error("target_file, target_files or target_glob not configured. "
+                  "Configure at least one target file to perform reconn on.")
         LOG.info("Exiting")
         sys.exit(1)
-    except Exception as e:
-        LOG.error("Failed to open console log file. Error: %s", e)
+
+    try:
+        start_position = reconn_utils.parse_start_position(
+            CONF.start_position)
+    except ValueError as e:
+        LOG.error("%s. Configure start_position as one of beginning, end, "
+                  "offset:N or tail_bytes:N", e)
         LOG.info("Exiting")
         sys.exit(1)
-    target_file_exists = True
-    observer = register_notification(CONF.target_file, console_file)
 
-    # Set program terminate time out
-    reconn_timeout.ReconnTimeout.set_timeout(CONF.timeout * 60)
+    init_checkpoints()
+
+    observer = create_observer()
+    for target_file in target_files:
+        LOG.info("Reconn target file: %s", target_file)
+        try:
+            add_target(observer, target_file,
+                       timeout=reconn_utils.get_reconn_timeout(),
+                       start_position=start_position)
+        except Exception as e:
+            LOG.error("Failed to open console log file %s. Error: %s",
+                      target_file, e)
+
+    # Timeout applies to each target file on its own
+    if target_glob is not None:
+        if not watch_target_glob(observer, target_glob):
+            LOG.info("Exiting")
+            sys.exit(1)
+    elif get_targets() == []:
+        LOG.info("Exiting")
+        sys.exit(1)
 
-    reconn_forever(console_file, observer)
+    reconn_forever(observer, target_glob=target_glob)
     LOG.info('RECONN exiting')
 
 
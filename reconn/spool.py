@@ -0,0 +1,357 @@
+"""Durable spool of messages to publish, in append-only segment files.
+Holds messages spilled over while RMQ server is blocked or down on disk
+rather than in memory, along with messages not published when reconn
+exits, so that they are published once RMQ server is back, or once
+reconn starts again."""
+
+import io
+import os
+import struct
+import threading
+
+from oslo_log import log as logging
+
+
+LOG = logging.getLogger(__name__)
+# Record header: time message was queued, bytes of message
+_header = struct.Struct('>dI')
+_segment_prefix = 'spool.'
+_segment_suffix = '.seg'
+_head_file = 'head'
+
+
+def _segment_name(first_seq):
+    return '%s%d%s' % (_segment_prefix, first_seq, _segment_suffix)
+
+
+def _pack(queued, msg):
+    data = msg.encode('utf-8')
+    return _header.pack(queued, len(data)) + data
+
+
+def _read_record(f):
+    '''Returns (time queued, msg) of next record in f, or None at end of
+    f or a record not fully written'''
+    header = f.read(_header.size)
+    if len(header) < _header.size:
+        return None
+    queued, length = _header.unpack(header)
+    data = f.read(length)
+    if len(data) < length:
+        return None
+    return queued, data.decode('utf-8')
+
+
+class Spool(object):
+    """Messages, as (time queued, msg), in segment files in directory.
+
+    Every message has a sequence number, in order of messages. A segment
+    file holds messages in order from the sequence number in its name.
+    Messages are appended to the last segment till it is segment_bytes,
+    and to spool till it is max_bytes. Appends are flushed to file, and
+    fsync-ed once every fsync_batch messages and by sync().
+
+    Messages are read in order, and confirmed once published. Segments
+    of confirmed messages are removed as confirms arrive. Sequence number
+    of first message not confirmed, head, is saved by sync(), so that
+    messages read but not confirmed are read again once spool is opened
+    again. A message may thus be published more than once, but is not
+    lost.
+    """
+    def __init__(self, directory, max_bytes, segment_bytes=16 * 1024 * 1024,
+                 fsync_batch=100):
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._segment_bytes = min(segment_bytes, max_bytes)
+        self._fsync_batch = fsync_batch
+        self._lock = threading.Lock()
+        # [first sequence number, path, messages, bytes] of segments,
+        # in order
+        self._segments = []
+        self._size = 0
+        # Sequence numbers of first message not confirmed, of messages
+        # confirmed after it, of next message to read and to append
+        self._head = 0
+        self._confirmed = set()
+        self._read_seq = 0
+        self._next_seq = 0
+        self._head_saved = None
+        # Segment being read, as [first sequence number, file, sequence
+        # number of next record in file]
+        self._reader = None
+        # File of last segment, appended to
+        self._writer = None
+        self._unsynced = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._load()
+
+    def _load(self):
+        segments = []
+        for name in os.listdir(self._directory):
+            if not (name.startswith(_segment_prefix) and
+                    name.endswith(_segment_suffix)):
+                continue
+            end = len(name) - len(_segment_suffix)
+            try:
+                first_seq = int(name[len(_segment_prefix):end])
+            except ValueError:
+                continue
+            segments.append((first_seq, os.path.join(self._directory, name)))
+        for first_seq, path in sorted(segments):
+            count, size = self._scan(path)
+            if not count:
+                os.remove(path)
+                continue
+            self._segments.append([first_seq, path, count, size])
+            self._size += size
+        head = self._load_head()
+        if self._segments:
+            last = self._segments[-1]
+            self._next_seq = last[0] + last[2]
+            first_seq = self._segments[0][0]
+            if head is None or head < first_seq:
+                head = first_seq
+            head = min(head, self._next_seq)
+        else:
+            self._next_seq = head = head or 0
+        self._head = self._read_seq = self._head_saved = head
+        self._remove_confirmed_segments()
+        if len(self):
+            LOG.info("Spool %s has %s messages to publish", self._directory,
+                     len(self))
+
+    @staticmethod
+    def _scan(path):
+        '''Returns (messages, bytes) of segment at path. A record not
+        fully written, like on a crash, is truncated'''
+        count = 0
+        size = 0
+        with io.open(path, 'r+b') as f:
+            file_size = os.fstat(f.fileno()).st_size
+            while True:
+                header = f.read(_header.size)
+                if len(header) < _header.size:
+                    break
+                _, length = _header.unpack(header)
+                if size + _header.size + length > file_size:
+                    break
+                f.seek(length, os.SEEK_CUR)
+                count += 1
+                size += _header.size + length
+            if size < file_size:
+                LOG.warning("Truncating partly written record of spool "
+                            "segment %s at %s", path, size)
+                f.truncate(size)
+        return count, size
+
+    def _load_head(self):
+        try:
+            with io.open(os.path.join(self._directory, _head_file),
+                         'rb') as f:
+                return int(f.read().decode('ascii'))
+        except (IOError, OSError):
+            return None
+        except ValueError as e:
+            LOG.error("Ignoring corrupt spool head in %s. Error: %s",
+                      self._directory, e)
+            return None
+
+    def __len__(self):
+        '''Number of messages not read yet'''
+        return self._next_seq - self._read_seq
+
+    @property
+    def pending(self):
+        '''Number of messages not confirmed yet'''
+        return self._next_seq - self._head
+
+    @property
+    def size(self):
+        '''Bytes of segment files'''
+        return self._size
+
+    def append(self, queued, msg):
+        '''Append msg, queued at time queued. Returns its sequence
+        number, or None when spool is full'''
+        record = _pack(queued, msg)
+        with self._lock:
+            if self._size + len(record) > self._max_bytes:
+                return None
+            if self._writer is None or \
+                    self._segments[-1][3] >= self._segment_bytes:
+                self._new_segment()
+            self._writer.write(record)
+            self._writer.flush()
+            segment = self._segments[-1]
+            segment[2] += 1
+            segment[3] += len(record)
+            self._size += len(record)
+            seq = self._next_seq
+            self._next_seq += 1
+            self._unsynced += 1
+            if self._unsynced >= self._fsync_batch:
+                self._sync()
+            return seq
+
+    def _new_segment(self):
+        self._close_writer()
+        path = os.path.join(self._directory, _segment_name(self._next_seq))
+        self._writer = io.open(path, 'ab')
+        self._segments.append([self._next_seq, path, 0, 0])
+
+    def _close_writer(self):
+        if self._writer is None:
+            return
+        if self._unsynced:
+            self._writer.flush()
+            os.fsync(self._writer.fileno())
+            self._unsynced = 0
+        self._writer.close()
+        self._writer = None
+
+    def _close_reader(self):
+        if self._reader is not None:
+            self._reader[1].close()
+            self._reader = None
+
+    def read(self):
+        '''Returns next (time queued, msg, sequence number) to publish,
+        or None when all messages are read'''
+        with self._lock:
+            if self._read_seq >= self._next_seq:
+                return None
+            segment = [s for s in self._segments
+                       if s[0] <= self._read_seq < s[0] + s[2]][0]
+            if self._reader is None or self._reader[0] != segment[0] or \
+                    self._reader[2] != self._read_seq:
+                self._close_reader()
+                self._reader = [segment[0], io.open(segment[1], 'rb'),
+                                segment[0]]
+                # Skip records before the one to read
+                while self._reader[2] < self._read_seq:
+                    _read_record(self._reader[1])
+                    self._reader[2] += 1
+            queued, msg = _read_record(self._reader[1])
+            seq = self._read_seq
+            self._reader[2] += 1
+            self._read_seq += 1
+            return queued, msg, seq
+
+    def confirm(self, seq):
+        '''Confirm message of sequence number seq is published'''
+        with self._lock:
+            if seq < self._head:
+                return
+            self._confirmed.add(seq)
+            while self._head in self._confirmed:
+                self._confirmed.discard(self._head)
+                self._head += 1
+            self._remove_confirmed_segments()
+
+    def _remove_confirmed_segments(self):
+        while self._segments:
+            first_seq, path, count, size = self._segments[0]
+            if first_seq + count > self._head:
+                return
+            if self._reader is not None and self._reader[0] == first_seq:
+                self._close_reader()
+            if len(self._segments) == 1:
+                self._close_writer()
+            try:
+                os.remove(path)
+            except OSError as e:
+                LOG.error("Failed to remove spool segment %s. Error: %s",
+                          path, e)
+            self._size -= size
+            self._segments.pop(0)
+
+    def prepend(self, items):
+        '''Spool messages, as (time queued, msg), to be read before
+        messages in spool, like messages held in memory when reconn
+        exits, older than spooled messages. Returns number of messages
+        spooled; the oldest of them are not when spool is full'''
+        records = [_pack(queued, msg) for queued, msg in items]
+        with self._lock:
+            self._trim_first_segment()
+            room = self._max_bytes - self._size
+            count = 0
+            size = 0
+            for record in reversed(records):
+                if size + len(record) > room:
+                    break
+                size += len(record)
+                count += 1
+            if not count:
+                return 0
+            first_seq = self._head - count
+            path = os.path.join(self._directory, _segment_name(first_seq))
+            with io.open(path, 'wb') as f:
+                for record in records[-count:]:
+                    f.write(record)
+                f.flush()
+                os.fsync(f.fileno())
+            self._segments.insert(0, [first_seq, path, count, size])
+            self._size += size
+            self._head = self._read_seq = first_seq
+            self._sync()
+        return count
+
+    def _trim_first_segment(self):
+        '''Rewrite first segment without its confirmed messages, so that
+        messages prepended before head take sequence numbers free of any
+        segment'''
+        if not self._segments or self._segments[0][0] >= self._head:
+            return
+        first_seq, path, count, size = self._segments[0]
+        if len(self._segments) == 1:
+            self._close_writer()
+        self._close_reader()
+        trimmed_path = os.path.join(self._directory,
+                                    _segment_name(self._head))
+        trimmed_size = 0
+        with io.open(path, 'rb') as f, io.open(trimmed_path, 'wb') as out:
+            for seq in range(first_seq, first_seq + count):
+                queued, msg = _read_record(f)
+                if seq >= self._head:
+                    record = _pack(queued, msg)
+                    out.write(record)
+                    trimmed_size += len(record)
+            out.flush()
+            os.fsync(out.fileno())
+        os.remove(path)
+        self._segments[0] = [self._head, trimmed_path,
+                             first_seq + count - self._head, trimmed_size]
+        self._size += trimmed_size - size
+
+    def sync(self):
+        '''fsync messages appended and save head'''
+        with self._lock:
+            self._sync()
+
+    def _sync(self):
+        if self._writer is not None and self._unsynced:
+            self._writer.flush()
+            os.fsync(self._writer.fileno())
+            self._unsynced = 0
+        if self._head == self._head_saved:
+            return
+        head_path = os.path.join(self._directory, _head_file)
+        tmp_head_path = head_path + '.tmp'
+        try:
+            with io.open(tmp_head_path, 'wb') as f:
+                f.write(str(self._head).encode('ascii'))
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp_head_path, head_path)
+            self._head_saved = self._head
+        except (IOError, OSError) as e:
+            LOG.error("Failed to save spool head to %s. Error: %s",
+                      head_path, e)
+
+    def close(self):
+        '''fsync messages appended, save head and close segment files'''
+        with self._lock:
+            self._sync()
+            self._close_writer()
+            self._close_reader()
@@ -1,5 +1,8 @@
+import mock
 import testtools
 
+from reconn import timeout as reconn_timeout
+
 
 class TestCase(testtools.TestCase):
     """Test case base class for all unit tests."""
@@ -7,3 +10,12 @@ class TestCase(testtools.TestCase):
     def setUp(self):
         """Run before each test method to initialize test environment."""
         super(TestCase, self).setUp()
+        # Timers of a test, like timeouts of targets, are on a timer
+        # service of its own, stopped once the test is over, so that
+        # they never fire into another test
+        timer_service = reconn_timeout.TimerService()
+        patcher = mock.patch.object(reconn_timeout, '_timer_service',
+                                    timer_service)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(timer_service.stop)
@@ -0,0 +1,178 @@
+"""A stand-in for an RMQ server, in place of pika.BlockingConnection.
+
+FakeBroker confirms every publish rtt seconds after it, with Basic.Ack
+for all publishes due by then, as RabbitMQ does with multiple set.
+Confirmed messages are kept in FakeBroker.messages, in order. Publishes
+are confirmed only while serving connection events, like
+process_data_events of a BlockingConnection, so that publishes waiting
+for confirms pile up as they would waiting for a real RMQ server.
+
+    broker = fake_rmq.FakeBroker(rtt=0.001)
+    with mock.patch('pika.BlockingConnection', broker.connection):
+        rmq_survey_obj = reconn_action.RMQSurvey(rmq_params)
+"""
+
+import time
+
+import pika
+
+
+class FakeBroker(object):
+    """Stands in for an RMQ server.
+
+    Delivery tags in nack_tags are confirmed with Basic.Nack, once, and
+    publishes of messages in nack_bodies always, as messages RMQ server
+    keeps rejecting. With lose_connection_after set, connection is lost
+    after that many publishes, and its publishes not confirmed by then
+    are lost. With confirm_on_publish, publishes due are confirmed by
+    publish too, as BlockingChannel serves connection events while
+    publishing.
+    """
+    def __init__(self, rtt=0.0, nack_tags=(), lose_connection_after=None,
+                 confirm_on_publish=False, nack_bodies=()):
+        self.rtt = rtt
+        self.nack_bodies = set(nack_bodies)
+        self.confirm_on_publish = confirm_on_publish
+        self.nack_tags = set(nack_tags)
+        self.lose_connection_after = lose_connection_after
+        # Confirmed messages, in order
+        self.messages = []
+        self.publishes = 0
+        self.connections = []
+        # Most publishes waiting for confirms, at once
+        self.max_unconfirmed = 0
+
+    def connection(self, parameters=None):
+        connection = FakeConnection(self)
+        self.connections.append(connection)
+        return connection
+
+
+class FakeConnection(object):
+    """Stands in for pika.BlockingConnection"""
+    def __init__(self, broker):
+        self.broker = broker
+        self.is_open = True
+        self.is_closed = False
+        self.is_closing = False
+        self.channels = []
+
+    def add_on_connection_blocked_callback(self, callback):
+        pass
+
+    def add_on_connection_unblocked_callback(self, callback):
+        pass
+
+    def channel(self):
+        channel = FakeChannel(self)
+        self.channels.append(channel)
+        return channel
+
+    def close(self):
+        self.lose()
+
+    def lose(self):
+        self.is_open = False
+        self.is_closed = True
+        for channel in self.channels:
+            channel.close()
+
+    def process_data_events(self, time_limit=0):
+        '''Confirm publishes due, waiting up to time_limit seconds for the
+        first of them'''
+        if not self.is_open:
+            raise pika.exceptions.ConnectionClosed(320, 'CONNECTION_FORCED')
+        pending = [channel.pending[0][0] for channel in self.channels
+                   if channel.pending]
+        wait = time_limit
+        if pending:
+            wait = min(wait, max(min(pending) - time.time(), 0))
+        if wait > 0:
+            time.sleep(wait)
+        for channel in self.channels:
+            channel.confirm_due()
+
+
+class FakeChannel(object):
+    """Stands in for pika.BlockingChannel and its underlying channel"""
+    def __init__(self, connection):
+        self.connection = connection
+        self.broker = connection.broker
+        self.is_open = True
+        self.is_closed = False
+        self.is_closing = False
+        self.delivery_tag = 0
+        self.confirm_callback = None
+        # Publishes waiting for confirms, as (time due, delivery tag, msg)
+        self.pending = []
+
+    @property
+    def _impl(self):
+        return self
+
+    def add_on_return_callback(self, callback):
+        pass
+
+    def confirm_delivery(self, callback=None, nowait=False):
+        self.confirm_callback = callback
+
+    def exchange_declare(self, *args, **kwargs):
+        pass
+
+    def queue_declare(self, *args, **kwargs):
+        pass
+
+    def queue_bind(self, *args, **kwargs):
+        pass
+
+    def close(self):
+        self.is_open = False
+        self.is_closed = True
+        self.pending = []
+
+    def publish(self, exchange, routing_key, body, properties=None,
+                mandatory=False, immediate=False):
+        if not self.is_open:
+            raise pika.exceptions.ConnectionClosed(320, 'CONNECTION_FORCED')
+        broker = self.broker
+        if broker.lose_connection_after is not None and \
+                broker.publishes >= broker.lose_connection_after:
+            broker.lose_connection_after = None
+            self.connection.lose()
+            raise pika.exceptions.ConnectionClosed(320, 'CONNECTION_FORCED')
+        broker.publishes += 1
+        self.delivery_tag += 1
+        self.pending.append((time.time() + broker.rtt, self.delivery_tag,
+                             body))
+        broker.max_unconfirmed = max(broker.max_unconfirmed,
+                                     len(self.pending))
+        if broker.confirm_on_publish:
+            self.confirm_due()
+
+    def confirm_due(self):
+        '''Confirm publishes due by now. Acks of consecutive publishes are
+        sent as one, with multiple set'''
+        now = time.time()
+        acked = None
+        while self.pending and self.pending[0][0] <= now:
+            _, tag, body = self.pending.pop(0)
+            if tag in self.broker.nack_tags or \
+                    body in self.broker.nack_bodies:
+                self.broker.nack_tags.discard(tag)
+                self._ack(acked)
+                acked = None
+                self._send_confirm(pika.spec.Basic.Nack(delivery_tag=tag))
+                continue
+            self.broker.messages.append(body)
+            acked = tag
+        self._ack(acked)
+
+    def _ack(self, tag):
+        '''Ack publishes up to delivery tag'''
+        if tag is not None:
+            self._send_confirm(pika.spec.Basic.Ack(delivery_tag=tag,
+                                                   multiple=True))
+
+    def _send_confirm(self, method):
+        if self.confirm_callback is not None:
+            self.confirm_callback(pika.frame.Method(1, method))
@@ -1,10 +1,20 @@
 import mock
 import ddt
 import copy
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
 import pika
+import six
 
 from reconn import test
 from reconn import action as reconn_action
+from reconn import pool as reconn_pool
+from reconn.tests import fake_rmq
 
 
 @ddt.ddt
@@ -54,13 +64,20 @@ class LogSurveyActionTestCase(test.TestCase):
 
     @ddt.data({'survey_grp_name': 'test_survey_grp',
                'pattern': 'some pattern',
-               'line': 'This is some pattern in line'
+               'line': u'This is some pattern in line',
+               'exp_line': b'This is some pattern in line'
+               },
+              {'survey_grp_name': 'test_survey_grp',
+               'pattern': 'some pattern',
+               'line': u'some pattern \ufffd\xe9\r\n',
+               'exp_line': b'some pattern \\ufffd\\xe9\\r\\n'
                })
     @ddt.unpack
     @mock.patch('io.open')
     def test_log_survey_execute(self,
                                 mock_io_open,
-                                survey_grp_name, pattern, line):
+                                survey_grp_name, pattern, line,
+                                exp_line):
         mock_BufferedWriter = mock.Mock()
         mock_io_open.return_value = mock_BufferedWriter
 
@@ -75,6 +92,23 @@ class LogSurveyActionTestCase(test.TestCase):
         log_survey_obj.execute(survey_grp_name, pattern, line)
 
         mock_BufferedWriter.write.assert_called_once()
+        written = mock_BufferedWriter.write.call_args[0][0]
+        self.assertIsInstance(written, bytes)
+        self.assertIn(b' { ' + exp_line + b' : some pattern : '
+                      b'test_survey_grp }', written)
+
+    @mock.patch('io.open')
+    def test_log_survey_execute_fields(self, mock_io_open):
+        log_survey_obj = reconn_action.LogSurvey(
+            '/tmp/no_file_exists.txt',
+            '{name} {uuid} {line} {context} {stage} {missing}\\n',
+            {'uuid': 'u1', 'name': 'not a computed field'})
+        log_survey_obj.execute('grp', 'pattern', u'stage\r\n',
+                               context=u'before\nstage\r\n',
+                               captures={'stage': u'net\twork'})
+
+        mock_io_open.return_value.write.assert_called_once_with(
+            b'grp u1 stage\\r\\n before\\nstage\\r\\n net\\twork \n')
 
 
 @ddt.ddt
@@ -82,10 +116,34 @@ class RMQSurveyActionTestCase(test.TestCase):
 
     def setUp(self):
         super(RMQSurveyActionTestCase, self).setUp()
+        # Connections and declares are not shared across tests
+        patcher = mock.patch.object(reconn_pool, '_connection_pool', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
 
     def tearDown(self):
         super(RMQSurveyActionTestCase, self).tearDown()
 
+    def test_confirm_delivery_pika_layout(self):
+        # Confirms are taken from the private channel of BlockingChannel,
+        # laid out so up to pika 0.13
+        mock_impl = mock.Mock()
+        channel = pika.adapters.blocking_connection.BlockingChannel(
+            mock_impl, mock.Mock())
+        callback = mock.Mock()
+
+        reconn_action._confirm_delivery(channel, callback)
+
+        mock_impl.confirm_delivery.assert_called_once_with(callback)
+        confirm_delivery = six.get_unbound_function(
+            pika.channel.Channel.confirm_delivery)
+        self.assertEqual(
+            'callback',
+            six.get_function_code(confirm_delivery).co_varnames[1])
+        self.assertTrue(callable(getattr(
+            pika.adapters.blocking_connection.BlockingChannel, 'publish',
+            None)))
+
     @mock.patch('pika.BlockingConnection')
     def test_rmq_survey_init(self,
                              mock_pika_BlockingConnection):
@@ -135,7 +193,8 @@ class RMQSurveyActionTestCase(test.TestCase):
             rmq_params['exchange_name'],
             rmq_params['routing_key'])
 
-        mock_channel.confirm_delivery.assert_called_once_with()
+        mock_channel._impl.confirm_delivery.assert_called_once_with(
+            rmq_survey_obj._delivery_confirmed_callback)
 
     @mock.patch('pika.BlockingConnection')
     def test_rmq_survey_init_conn_closed(self,
@@ -174,9 +233,9 @@ class RMQSurveyActionTestCase(test.TestCase):
 
     @mock.patch('reconn.action.RMQSurvey._setup_rmq_exchange_queue')
     @mock.patch('reconn.action.RMQSurvey._estb_rmq_connection')
-    @mock.patch('reconn.action.RMQSurvey.destructor')
+    @mock.patch('reconn.action.RMQSurvey._close_rmq_connection')
     def test_reestb_rmq_conn(self,
-                             mock_rmqsurvey_destructor,
+                             mock_rmqsurvey_close_conn,
                              mock_rmqsurvey_estb_conn,
                              mock_rmqsurvey_setup_exch_queue):
         rmq_params = dict(
@@ -201,9 +260,32 @@ class RMQSurveyActionTestCase(test.TestCase):
 
         rmq_survey_obj._reestb_rmq_connection()
 
-        mock_rmqsurvey_destructor.assert_called_once_with()
+        mock_rmqsurvey_close_conn.assert_called_once_with()
         mock_rmqsurvey_estb_conn.assert_called_once_with()
 
+    @mock.patch('reconn.action.RMQSurvey._setup_rmq_exchange_queue')
+    @mock.patch('reconn.action.RMQSurvey._estb_rmq_connection')
+    def test_construct_msg(self, mock_rmqsurvey_estb_conn,
+                           mock_rmqsurvey_setup_exch_queue):
+        renderer = reconn_action.create_message_renderer(
+            '{{"line":"{line}", "context":"{context}", "name":"{name}", '
+            '"pattern":"{matched_pattern}", "uuid":"{uuid}", '
+            '"stage":"{stage}"}}',
+            {'uuid': 'u1', 'line': 'not a computed field'},
+            json_template=True)
+        rmq_survey_obj = reconn_action.RMQSurvey({}, renderer)
+
+        msg = rmq_survey_obj._construct_msg(
+            'grp', r'"(?P<stage>\w+)"', u'stage "net"\r\n',
+            captures={'stage': u'net'})
+
+        self.assertEqual({'line': u'stage "net"\r\n',
+                          'context': u'stage "net"\r\n',
+                          'name': u'grp',
+                          'pattern': u'"(?P<stage>\\w+)"',
+                          'uuid': u'u1',
+                          'stage': u'net'}, json.loads(msg))
+
     @mock.patch('pika.BasicProperties')
     @mock.patch('reconn.action.RMQSurvey._setup_rmq_exchange_queue')
     @mock.patch('reconn.action.RMQSurvey._estb_rmq_connection')
@@ -239,48 +321,372 @@ class RMQSurveyActionTestCase(test.TestCase):
             immediate=False
         )
 
-    @mock.patch('pika.BasicProperties')
-    @mock.patch('reconn.action.RMQSurvey._setup_rmq_exchange_queue')
-    @mock.patch('reconn.action.RMQSurvey._reestb_rmq_connection')
-    @mock.patch('reconn.action.RMQSurvey._estb_rmq_connection')
-    def test_publish_retry(self,
-                           mock_rmqsurvey_estb_conn,
-                           mock_rmqsurvey_reestb_conn,
-                           mock_rmqsurvey_setup_exch_queue,
-                           mock_pika_BasicProperties):
-        msg = "{'msg': 'testmsg'}"
-        rmq_params = dict(
-            exchange_name='test_exchange',
-            routing_key='test',
-        )
 
-        rmq_survey_obj = reconn_action.RMQSurvey(rmq_params)
-        mock_rmq_channel = mock.Mock(name='mock rmq channel')
-        rmq_survey_obj._channel = mock_rmq_channel
-        mock_properties = mock.Mock(name='mock pika properties obj')
-        mock_pika_BasicProperties.return_value = mock_properties
-        mock_rmq_channel.publish.side_effect = [
-            pika.exceptions.ConnectionClosed, None]
-
-        rmq_survey_obj._publish_msg_to_rmq(msg)
-
-        mock_pika_BasicProperties.assert_called_with(
-            app_id='reconn',
-            content_type='application/json',
-            headers={})
-        self.assertEqual(2, mock_pika_BasicProperties.call_count)
-
-        mock_rmq_channel.publish.assert_called_with(
-            rmq_params['exchange_name'],
-            rmq_params['routing_key'],
-            msg,
-            properties=mock_properties,
-            mandatory=True,
-            immediate=False
-        )
-        self.assertEqual(2, mock_rmq_channel.publish.call_count)
+@ddt.ddt
+class RMQSurveyPublisherTestCase(test.TestCase):
 
-        mock_rmqsurvey_reestb_conn.assert_called_once_with()
+    def setUp(self):
+        super(RMQSurveyPublisherTestCase, self).setUp()
+        patcher = mock.patch.object(reconn_pool, '_connection_pool', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.broker = fake_rmq.FakeBroker()
+        patcher = mock.patch('pika.BlockingConnection',
+                             self.broker.connection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _rmq_survey(self, **rmq_params):
+        renderer = reconn_action.create_message_renderer(
+            '{{"line":"{line}"}}', json_template=True)
+        rmq_survey_obj = reconn_action.RMQSurvey(rmq_params, renderer)
+        rmq_survey_obj._poll_interval = 0.01
+        rmq_survey_obj._retry_interval = 0
+        self.addCleanup(rmq_survey_obj.destructor)
+        return rmq_survey_obj
+
+    def _lines(self):
+        return [json.loads(msg)['line'] for msg in self.broker.messages]
+
+    def _execute_queued(self, rmq_survey_obj, count):
+        '''Execute for count lines, queued before publisher starts'''
+        with mock.patch.object(rmq_survey_obj, '_start_publisher'):
+            for i in range(count):
+                rmq_survey_obj.execute('grp', 'line', u'line %d' % i)
+        rmq_survey_obj._start_publisher()
+
+    def _wait_published(self, rmq_survey_obj, count):
+        '''Wait for publisher, as destructor stops it on a failed publish'''
+        deadline = time.time() + 5
+        while rmq_survey_obj.published < count and time.time() < deadline:
+            time.sleep(0.01)
+
+    def test_execute_publishes_in_order(self):
+        rmq_survey_obj = self._rmq_survey(rmq_queue_size=2,
+                                          rmq_overflow_policy='block')
+
+        for i in range(10):
+            rmq_survey_obj.execute('grp', 'line', u'line %d' % i)
+        rmq_survey_obj.destructor()
+
+        self.assertEqual([u'line %d' % i for i in range(10)], self._lines())
+        stats = rmq_survey_obj.get_stats()
+        self.assertEqual(10, stats['published'])
+        self.assertEqual(0, stats['queue_depth'])
+        self.assertEqual(0, stats['dropped'])
+        self.assertGreaterEqual(stats['latency_max'], stats['latency_avg'])
+
+    @ddt.data({'policy': 'drop_oldest',
+               'exp_lines': [u'line 3', u'line 4'],
+               'exp_stats': {'dropped': 3, 'spilled': 0}},
+              {'policy': 'spill',
+               'exp_lines': [u'line %d' % i for i in range(5)],
+               'exp_stats': {'dropped': 0, 'spilled': 3}})
+    @ddt.unpack
+    def test_overflow_policy(self, policy, exp_lines, exp_stats):
+        rmq_survey_obj = self._rmq_survey(rmq_queue_size=2,
+                                          rmq_overflow_policy=policy)
+        # Publisher starts once queue is filled
+        with mock.patch.object(rmq_survey_obj, '_start_publisher'):
+            for i in range(5):
+                rmq_survey_obj.execute('grp', 'line', u'line %d' % i)
+        self.assertEqual(len(exp_lines), rmq_survey_obj.queue_depth)
+
+        rmq_survey_obj._start_publisher()
+        rmq_survey_obj.destructor()
+
+        self.assertEqual(exp_lines, self._lines())
+        stats = rmq_survey_obj.get_stats()
+        for key, value in exp_stats.items():
+            self.assertEqual(value, stats[key])
+
+    def test_overflow_block_without_publisher(self):
+        rmq_survey_obj = self._rmq_survey(rmq_queue_size=1)
+        with mock.patch.object(rmq_survey_obj, '_start_publisher'):
+            rmq_survey_obj.execute('grp', 'line', u'line 0')
+            rmq_survey_obj.execute('grp', 'line', u'line 1')
+
+        self.assertEqual(1, rmq_survey_obj.dropped)
+        self.assertEqual(1, rmq_survey_obj.queue_depth)
+
+    def test_publish_failure_retried(self):
+        self.broker.lose_connection_after = 0
+        rmq_survey_obj = self._rmq_survey()
+
+        rmq_survey_obj.execute('grp', 'line', u'line 0')
+        self._wait_published(rmq_survey_obj, 1)
+        rmq_survey_obj.destructor()
+
+        self.assertEqual([u'line 0'], self._lines())
+        self.assertEqual(2, len(self.broker.connections))
+        self.assertEqual(1, rmq_survey_obj.published)
+
+    def test_confirm_window(self):
+        self.broker.rtt = 0.005
+        rmq_survey_obj = self._rmq_survey(rmq_confirm_window=4)
+
+        self._execute_queued(rmq_survey_obj, 20)
+        rmq_survey_obj.destructor()
+
+        self.assertEqual([u'line %d' % i for i in range(20)], self._lines())
+        self.assertEqual(4, self.broker.max_unconfirmed)
+        stats = rmq_survey_obj.get_stats()
+        self.assertEqual(20, stats['published'])
+        self.assertEqual(0, stats['unconfirmed'])
+
+    def test_unconfirmed_retried_on_reconnect(self):
+        self.broker.lose_connection_after = 3
+        rmq_survey_obj = self._rmq_survey()
+
+        self._execute_queued(rmq_survey_obj, 5)
+        self._wait_published(rmq_survey_obj, 5)
+        rmq_survey_obj.destructor()
+
+        # Publishes 1 to 3 are lost with connection, and published again
+        self.assertEqual([u'line %d' % i for i in range(5)], self._lines())
+        self.assertEqual(8, self.broker.publishes)
+        self.assertEqual(5, rmq_survey_obj.published)
+
+    def test_nacked_published_again(self):
+        self.broker.nack_tags = set([2])
+        rmq_survey_obj = self._rmq_survey()
+
+        self._execute_queued(rmq_survey_obj, 4)
+        rmq_survey_obj.destructor()
+
+        self.assertEqual([u'line 0', u'line 2', u'line 3', u'line 1'],
+                         self._lines())
+        self.assertEqual(4, rmq_survey_obj.published)
+
+    def test_rejected_msg_dropped(self):
+        self.broker.nack_bodies = set(['{"line":"line 1"}'])
+        rmq_survey_obj = self._rmq_survey(rmq_publish_retries=2)
+
+        self._execute_queued(rmq_survey_obj, 3)
+        self._wait_published(rmq_survey_obj, 2)
+        rmq_survey_obj.destructor()
+
+        self.assertEqual([u'line 0', u'line 2'], self._lines())
+        # Published once, and again rmq_publish_retries times
+        self.assertEqual(5, self.broker.publishes)
+        self.assertEqual(1, rmq_survey_obj.dropped)
+        self.assertEqual(0, rmq_survey_obj.queue_depth)
+
+    def test_batch_messages(self):
+        rmq_survey_obj = self._rmq_survey(rmq_batch_messages=True,
+                                          rmq_batch_size=3)
+
+        self._execute_queued(rmq_survey_obj, 7)
+        rmq_survey_obj.destructor()
+
+        batches = [json.loads(msg) for msg in self.broker.messages]
+        self.assertEqual([3, 3, 1], [len(batch) for batch in batches])
+        self.assertEqual([u'line %d' % i for i in range(7)],
+                         [msg['line'] for batch in batches for msg in batch])
+        self.assertEqual(7, rmq_survey_obj.published)
+
+    def _spool_dir(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        return os.path.join(tmp_dir, 'spool')
+
+    def test_spill_to_spool(self):
+        spool_dir = self._spool_dir()
+        rmq_survey_obj = self._rmq_survey(rmq_queue_size=2,
+                                          rmq_overflow_policy='spill',
+                                          rmq_spool_dir=spool_dir)
+
+        with mock.patch.object(rmq_survey_obj, '_start_publisher'):
+            for i in range(5):
+                rmq_survey_obj.execute('grp', 'line', u'line %d' % i)
+        self.assertEqual(3, len(rmq_survey_obj._spool))
+        self.assertEqual(0, rmq_survey_obj.q.qsize())
+        self.assertEqual(5, rmq_survey_obj.queue_depth)
+        rmq_survey_obj._start_publisher()
+        self._wait_published(rmq_survey_obj, 5)
+        rmq_survey_obj.destructor()
+
+        self.assertEqual([u'line %d' % i for i in range(5)], self._lines())
+        self.assertEqual(3, rmq_survey_obj.spilled)
+        # Spool is truncated as publishes get confirmed
+        self.assertEqual(0, rmq_survey_obj._spool.pending)
+        self.assertEqual([], [name for name in os.listdir(spool_dir)
+                              if name.endswith('.seg')])
+
+    def test_unpublished_spooled_on_destroy(self):
+        spool_dir = self._spool_dir()
+        rmq_survey_obj = self._rmq_survey(rmq_queue_size=2,
+                                          rmq_overflow_policy='spill',
+                                          rmq_spool_dir=spool_dir)
+        rmq_survey_obj._connection_blocked_callback(None)
+        for i in range(4):
+            rmq_survey_obj.execute('grp', 'line', u'line %d' % i)
+        rmq_survey_obj.destructor()
+        self.assertEqual([], self.broker.messages)
+        self.assertEqual(0, rmq_survey_obj.dropped)
+
+        # Spooled messages are published once action is created again
+        rmq_survey_obj = self._rmq_survey(rmq_spool_dir=spool_dir)
+        rmq_survey_obj.execute('grp', 'line', u'line 4')
+        self._wait_published(rmq_survey_obj, 5)
+        rmq_survey_obj.destructor()
+
+        self.assertEqual([u'line %d' % i for i in range(5)], self._lines())
+
+    @ddt.data('block', 'drop_oldest')
+    def test_spooled_published_without_spill(self, policy):
+        spool_dir = self._spool_dir()
+        rmq_survey_obj = self._rmq_survey(rmq_overflow_policy='spill',
+                                          rmq_spool_dir=spool_dir)
+        rmq_survey_obj._connection_blocked_callback(None)
+        for i in range(2):
+            rmq_survey_obj.execute('grp', 'line', u'line %d' % i)
+        rmq_survey_obj.destructor()
+
+        with mock.patch.object(reconn_action.RMQSurvey, '_start_publisher'):
+            rmq_survey_obj = self._rmq_survey(rmq_queue_size=1,
+                                              rmq_overflow_policy=policy,
+                                              rmq_spool_dir=spool_dir)
+            rmq_survey_obj.execute('grp', 'line', u'line 2')
+        # New messages are queued as the policy says, not spooled
+        self.assertEqual(2, len(rmq_survey_obj._spool))
+        self.assertEqual(1, rmq_survey_obj._queue.qsize())
+        self.assertEqual(0, rmq_survey_obj.spilled)
+        rmq_survey_obj._start_publisher()
+        self._wait_published(rmq_survey_obj, 3)
+        rmq_survey_obj.destructor()
+
+        self.assertEqual([u'line %d' % i for i in range(3)], self._lines())
+        self.assertEqual(0, rmq_survey_obj._spool.pending)
+
+    def test_confirmed_while_publishing(self):
+        self.broker.confirm_on_publish = True
+        rmq_survey_obj = self._rmq_survey()
+
+        self._execute_queued(rmq_survey_obj, 5)
+        self._wait_published(rmq_survey_obj, 5)
+
+        self.assertEqual(5, rmq_survey_obj.published)
+        self.assertEqual(0, rmq_survey_obj.get_stats()['unconfirmed'])
+        rmq_survey_obj.destructor()
+        self.assertEqual([u'line %d' % i for i in range(5)], self._lines())
+
+    def test_destroy_without_confirms(self):
+        # Broker stops confirming publishes
+        self.broker.rtt = 600
+        spool_dir = self._spool_dir()
+        rmq_survey_obj = self._rmq_survey(rmq_confirm_window=2,
+                                          rmq_spool_dir=spool_dir)
+        rmq_survey_obj._stop_timeout = 0.1
+        for i in range(4):
+            rmq_survey_obj.execute('grp', 'line', u'line %d' % i)
+        connection, = self.broker.connections
+        # Publisher waits for confirms of a full window
+        deadline = time.time() + 5
+        while self.broker.publishes < 2 and time.time() < deadline:
+            time.sleep(0.01)
+
+        start = time.time()
+        rmq_survey_obj.destructor()
+
+        self.assertLess(time.time() - start, 2)
+        self.assertIsNone(rmq_survey_obj._publisher)
+        self.assertTrue(connection.is_closed)
+        self.assertEqual(0, len(reconn_pool.get_connection_pool()))
+        self.assertEqual(0, rmq_survey_obj.dropped)
+
+        # Messages not confirmed are published once action is created
+        # again
+        self.broker.rtt = 0
+        rmq_survey_obj = self._rmq_survey(rmq_spool_dir=spool_dir)
+        self._wait_published(rmq_survey_obj, 4)
+        rmq_survey_obj.destructor()
+
+        self.assertEqual([u'line %d' % i for i in range(4)], self._lines())
+
+    def test_declared_again_on_reconnect(self):
+        with mock.patch.object(fake_rmq.FakeChannel,
+                               'exchange_declare') as mock_declare:
+            rmq_survey_obj = self._rmq_survey(exchange_name='reconn')
+            self.broker.connections[0].lose()
+
+            rmq_survey_obj.execute('grp', 'line', u'line 0')
+            self._wait_published(rmq_survey_obj, 1)
+            rmq_survey_obj.destructor()
+
+        self.assertEqual([mock.call('reconn', 'topic', durable=True)] * 2,
+                         mock_declare.call_args_list)
+        self.assertEqual([u'line 0'], self._lines())
+
+    def test_setup_failure_releases_connection(self):
+        with mock.patch.object(
+                fake_rmq.FakeChannel, 'exchange_declare',
+                side_effect=pika.exceptions.ChannelClosed(403, 'denied')):
+            self.assertRaises(pika.exceptions.ChannelClosed,
+                              self._rmq_survey, exchange_name='amq.topic')
+
+        connection, = self.broker.connections
+        self.assertTrue(connection.is_closed)
+        self.assertEqual(0, len(reconn_pool.get_connection_pool()))
+
+    def test_shared_connection(self):
+        with mock.patch.object(fake_rmq.FakeChannel,
+                               'exchange_declare') as mock_declare:
+            rmq_survey_objs = [self._rmq_survey(exchange_name='reconn',
+                                                routing_key='key%d' % i)
+                               for i in range(2)]
+        mock_declare.assert_called_once_with('reconn', 'topic',
+                                             durable=True)
+        connection, = self.broker.connections
+        self.assertEqual(2, len(connection.channels))
+
+        for i in range(10):
+            for rmq_survey_obj in rmq_survey_objs:
+                rmq_survey_obj.execute('grp', 'line', u'line %d' % i)
+        for rmq_survey_obj in rmq_survey_objs:
+            self._wait_published(rmq_survey_obj, 10)
+            rmq_survey_obj.destructor()
+
+        self.assertEqual(sorted([u'line %d' % i for i in range(10)] * 2),
+                         sorted(self._lines()))
+        self.assertEqual([10, 10], [rmq_survey_obj.published
+                                    for rmq_survey_obj in rmq_survey_objs])
+        # Connection is closed once no action uses it
+        self.assertTrue(connection.is_closed)
+
+    def test_confirm_waits_for_owning_publisher(self):
+        rmq_survey_obj = self._rmq_survey()
+        rmq_survey_obj._unconfirmed[1] = [(time.time(), u'msg', None, 0)]
+        rmq_survey_obj._unconfirmed_msgs = 1
+        method_frame = pika.frame.Method(
+            1, pika.spec.Basic.Ack(delivery_tag=1))
+        # Confirm called back by another action serving the connection
+        confirmer = threading.Thread(
+            target=rmq_survey_obj._delivery_confirmed_callback,
+            args=(method_frame,))
+
+        with rmq_survey_obj._confirm_lock:
+            confirmer.start()
+            confirmer.join(0.05)
+            self.assertTrue(confirmer.is_alive())
+            self.assertEqual(1, len(rmq_survey_obj._unconfirmed))
+        confirmer.join()
+
+        self.assertEqual({}, dict(rmq_survey_obj._unconfirmed))
+        self.assertEqual(0, rmq_survey_obj._unconfirmed_msgs)
+        self.assertEqual(1, rmq_survey_obj.published)
+
+    def test_blocked_connection_holds_publish(self):
+        rmq_survey_obj = self._rmq_survey()
+        rmq_survey_obj._connection_blocked_callback(None)
+        rmq_survey_obj.execute('grp', 'line', u'line 0')
+        time.sleep(0.05)
+        self.assertEqual([], self.broker.messages)
+
+        rmq_survey_obj._connection_unblocked_callback(None)
+        rmq_survey_obj.destructor()
+
+        self.assertEqual([u'line 0'], self._lines())
 
 
 class SurveyActionTestCase(test.TestCase):
@@ -295,10 +701,12 @@ class SurveyActionTestCase(test.TestCase):
         reconn_action.LOG = self._LOG
         super(SurveyActionTestCase, self).tearDown()
 
+    @mock.patch('reconn.action.create_rmq_message_renderer')
     @mock.patch('reconn.action.LogSurvey')
     @mock.patch('reconn.action.RMQSurvey')
     def test_create_survey_actions(self, mock_RMQSurvey,
-                                   mock_LogSurvey):
+                                   mock_LogSurvey,
+                                   mock_create_rmq_message_renderer):
         CONF = mock.Mock()
         CONF.rmq_survey = {}
         CONF.log_survey.log_survey_action_log_file = ''
@@ -316,10 +724,12 @@ class SurveyActionTestCase(test.TestCase):
 
         action_names = ['rmq_survey', 'log_survey', 'unsupported_action_name']
         reconn_action.create_survey_actions(action_names)
-        mock_RMQSurvey.assert_called_once_with(CONF.rmq_survey)
+        mock_RMQSurvey.assert_called_once_with(
+            CONF.rmq_survey, mock_create_rmq_message_renderer.return_value)
         mock_LogSurvey.assert_called_once_with(
             CONF.log_survey.log_survey_action_log_file,
-            CONF.log_survey.log_survey_action_log_format)
+            CONF.log_survey.log_survey_action_log_format,
+            CONF.msg_user_data)
         error_str = "action name %s not found. Supported actions: %s" % (
             'unsupported_action_name', reconn_action.supported_actions)
         log.error.assert_called_once_with(error_str)
@@ -0,0 +1,114 @@
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+
+import mock
+
+from reconn import test
+from reconn import checkpoint as reconn_checkpoint
+
+
+class CheckpointStoreTestCase(test.TestCase):
+
+    def setUp(self):
+        super(CheckpointStoreTestCase, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.checkpoint_file = os.path.join(self.tmp_dir, 'checkpoints.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        super(CheckpointStoreTestCase, self).tearDown()
+
+    def test_patterns_hash(self):
+        re_objs = [('grp1', re.compile('pattern1')),
+                   ('grp2', re.compile('pattern2'))]
+        patterns_hash = reconn_checkpoint.get_patterns_hash(re_objs)
+        self.assertEqual(patterns_hash,
+                         reconn_checkpoint.get_patterns_hash(list(re_objs)))
+        self.assertNotEqual(
+            patterns_hash,
+            reconn_checkpoint.get_patterns_hash(re_objs[:1]))
+        self.assertNotEqual(
+            patterns_hash,
+            reconn_checkpoint.get_patterns_hash(
+                [('grp1', re.compile('pattern1')),
+                 ('grp2', re.compile('pattern3'))]))
+
+    def test_save_and_load(self):
+        store = reconn_checkpoint.CheckpointStore(self.checkpoint_file,
+                                                  'hash1')
+        store.update('/tmp/a.log', 10, 20, 1024, b'partial \xff')
+        store.save(force=True)
+        self.assertFalse(os.path.exists(self.checkpoint_file + '.tmp'))
+
+        store = reconn_checkpoint.CheckpointStore(self.checkpoint_file,
+                                                  'hash1')
+        self.assertEqual((1024, b'partial \xff'),
+                         store.get('/tmp/a.log', 10, 20))
+
+    def test_get_stale_checkpoint(self):
+        store = reconn_checkpoint.CheckpointStore(self.checkpoint_file,
+                                                  'hash1')
+        store.update('/tmp/a.log', 10, 20, 1024, b'')
+        store.save(force=True)
+
+        self.assertIsNone(store.get('/tmp/b.log', 10, 20))
+        # Different inode, file is replaced
+        self.assertIsNone(store.get('/tmp/a.log', 10, 21))
+        self.assertIsNone(store.get('/tmp/a.log', 11, 20))
+        # Survey patterns changed
+        store = reconn_checkpoint.CheckpointStore(self.checkpoint_file,
+                                                  'hash2')
+        self.assertIsNone(store.get('/tmp/a.log', 10, 20))
+
+    @mock.patch('time.time')
+    def test_save_interval(self, mock_time):
+        mock_time.return_value = 100
+        store = reconn_checkpoint.CheckpointStore(self.checkpoint_file,
+                                                  'hash1', interval=5)
+        store.update('/tmp/a.log', 10, 20, 1, b'')
+        store.save()
+        with io.open(self.checkpoint_file, 'rb') as f:
+            self.assertEqual(1, json.loads(
+                f.read().decode('utf-8'))['/tmp/a.log']['offset'])
+
+        # Within interval, not written
+        mock_time.return_value = 102
+        store.update('/tmp/a.log', 10, 20, 2, b'')
+        store.save()
+        with io.open(self.checkpoint_file, 'rb') as f:
+            self.assertEqual(1, json.loads(
+                f.read().decode('utf-8'))['/tmp/a.log']['offset'])
+
+        mock_time.return_value = 105
+        store.save()
+        with io.open(self.checkpoint_file, 'rb') as f:
+            self.assertEqual(2, json.loads(
+                f.read().decode('utf-8'))['/tmp/a.log']['offset'])
+
+    @mock.patch('os.rename')
+    def test_save_not_dirty(self, mock_rename):
+        store = reconn_checkpoint.CheckpointStore(self.checkpoint_file,
+                                                  'hash1')
+        store.save(force=True)
+        mock_rename.assert_not_called()
+
+    def test_remove(self):
+        store = reconn_checkpoint.CheckpointStore(self.checkpoint_file,
+                                                  'hash1')
+        store.update('/tmp/a.log', 10, 20, 1024, b'')
+        store.remove('/tmp/a.log')
+        store.save(force=True)
+        store = reconn_checkpoint.CheckpointStore(self.checkpoint_file,
+                                                  'hash1')
+        self.assertIsNone(store.get('/tmp/a.log', 10, 20))
+
+    def test_load_corrupt_file(self):
+        with io.open(self.checkpoint_file, 'wb') as f:
+            f.write(b'{not json')
+        store = reconn_checkpoint.CheckpointStore(self.checkpoint_file,
+                                                  'hash1')
+        self.assertIsNone(store.get('/tmp/a.log', 10, 20))
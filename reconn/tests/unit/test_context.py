@@ -0,0 +1,116 @@
+import re
+
+from reconn import context as reconn_context
+from reconn import reader as reconn_reader
+from reconn import test
+from reconn import utils as reconn_utils
+
+
+def _survey_group(context_before=0, context_after=0):
+    return reconn_utils.SurveyGroup('group', re.compile(b'x'), None, False,
+                                    0, context_before=context_before,
+                                    context_after=context_after)
+
+
+class LineContextTestCase(test.TestCase):
+
+    def test_before_from_block(self):
+        line_context = reconn_context.LineContext()
+        block = b'line 1\nline 2\nline 3\nx\n'
+        line_context.feed(block)
+
+        ready = line_context.add(b'x\n', [_survey_group(2)], block, 21)
+
+        self.assertEqual(1, len(ready))
+        self.assertEqual(b'line 2\nline 3\nx\n', ready[0].context)
+
+    def test_before_from_window(self):
+        line_context = reconn_context.LineContext()
+        window = reconn_reader.LineWindow(3)
+        for block in (b'line 1\nline 2\n', b'line 3\n'):
+            line_context.feed(block)
+            window.add_block(block)
+        block = b'line 4\nx\n'
+        line_context.feed(block)
+
+        ready = line_context.add(b'x\n', [_survey_group(3)], block, 7,
+                                 window)
+
+        self.assertEqual(b'line 2\nline 3\nline 4\nx\n', ready[0].context)
+
+    def test_before_at_start_of_file(self):
+        line_context = reconn_context.LineContext()
+        block = b'x\nline 2\n'
+        line_context.feed(block)
+
+        ready = line_context.add(b'x\n', [_survey_group(2)], block, 0,
+                                 reconn_reader.LineWindow(2))
+
+        self.assertEqual(b'x\n', ready[0].context)
+
+    def test_after_across_blocks(self):
+        line_context = reconn_context.LineContext()
+        block = b'x\nline 2\n'
+        line_context.feed(block)
+
+        self.assertEqual([], line_context.add(b'x\n', [_survey_group(0, 3)],
+                                              block, 0))
+        self.assertEqual([], line_context.feed(b'line 3\n'))
+        ready = line_context.feed(b'line 4\nline 5\n')
+
+        self.assertEqual(1, len(ready))
+        self.assertEqual(b'x\nline 2\nline 3\nline 4\n', ready[0].context)
+
+    def test_matches_in_order(self):
+        line_context = reconn_context.LineContext()
+        block = b'x 1\ny 2\nline 3\n'
+        line_context.feed(block)
+        group_x = _survey_group(0, 3)
+        group_y = _survey_group()
+
+        self.assertEqual([], line_context.add(b'x 1\n', [group_x], block, 0))
+        self.assertEqual([], line_context.add(b'y 2\n', [group_y], block, 4))
+        ready = line_context.feed(b'line 4\n')
+
+        self.assertEqual([b'x 1\n', b'y 2\n'],
+                         [match.line for match in ready])
+        self.assertEqual(b'x 1\ny 2\nline 3\nline 4\n', ready[0].context)
+
+    def test_most_context_of_groups(self):
+        line_context = reconn_context.LineContext()
+        block = b'line 1\nline 2\nx\nline 4\n'
+        line_context.feed(block)
+
+        ready = line_context.add(b'x\n', [_survey_group(1, 1),
+                                          _survey_group(2)], block, 14)
+
+        self.assertEqual(block, ready[0].context)
+
+    def test_flush(self):
+        line_context = reconn_context.LineContext()
+        block = b'x\nline 2\n'
+        line_context.feed(block)
+        line_context.add(b'x\n', [_survey_group(0, 5)], block, 0)
+
+        held = line_context.flush()
+
+        self.assertEqual(1, len(held))
+        self.assertEqual(b'x\nline 2\n', held[0].context)
+        self.assertEqual([], line_context.flush())
+
+    def test_held_position(self):
+        line_context = reconn_context.LineContext()
+        block = b'x 1\nx 2\n'
+        line_context.feed(block)
+        self.assertIsNone(line_context.held_position)
+
+        line_context.add(b'x 1\n', [_survey_group(0, 2)], block, 0,
+                         position=(10, b'li'))
+        line_context.add(b'x 2\n', [_survey_group(0, 2)], block, 4,
+                         position=(10, b'li'))
+        self.assertEqual((10, b'li'), line_context.held_position)
+        line_context.feed(b'line 3\n')
+        self.assertEqual((10, b'li'), line_context.held_position)
+
+        line_context.feed(b'line 4\n')
+        self.assertIsNone(line_context.held_position)
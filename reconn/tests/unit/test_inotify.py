@@ -0,0 +1,161 @@
+import os
+import shutil
+import tempfile
+import threading
+
+import mock
+import testtools
+
+from reconn import test
+from reconn import inotify as reconn_inotify
+
+
+class RecordingHandler(object):
+    """Event handler recording events it is dispatched"""
+    def __init__(self):
+        self.events = []
+        self.received = threading.Condition()
+
+    def dispatch(self, event):
+        with self.received:
+            self.events.append(event)
+            self.received.notify_all()
+
+    def wait_for(self, event_type, src_path, timeout=5):
+        def found():
+            return any(e.event_type == event_type and
+                       e.src_path == src_path for e in self.events)
+        with self.received:
+            if not found():
+                self.received.wait(timeout)
+                # Events of a batch arrive together, wait once more
+                if not found():
+                    self.received.wait(timeout)
+            return found()
+
+
+@testtools.skipUnless(reconn_inotify.is_supported(),
+                      'inotify is not supported')
+class InotifyObserverTestCase(test.TestCase):
+
+    def setUp(self):
+        super(InotifyObserverTestCase, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.file_path = os.path.join(self.tmp_dir, 'test_file.log')
+        with open(self.file_path, 'wb'):
+            pass
+        self.observer = reconn_inotify.InotifyObserver()
+
+    def _start(self):
+        self.observer.start()
+        self.addCleanup(self._stop)
+
+    def _stop(self):
+        if self.observer.is_alive():
+            self.observer.stop()
+            self.observer.join(5)
+
+    def test_modified_events_coalesced(self):
+        handler = RecordingHandler()
+        self.observer.schedule(handler, self.file_path)
+
+        # Queue up writes before observer starts reading them
+        with open(self.file_path, 'ab') as f:
+            for i in range(100):
+                f.write(b'line\n')
+                f.flush()
+        self._start()
+
+        self.assertTrue(handler.wait_for('modified', self.file_path))
+        modified = [e for e in handler.events if e.event_type == 'modified']
+        self.assertEqual(1, len(modified))
+
+    def test_sibling_file_writes_not_delivered(self):
+        handler = RecordingHandler()
+        self.observer.schedule(handler, self.file_path)
+        self._start()
+
+        with open(os.path.join(self.tmp_dir, 'other.log'), 'ab') as f:
+            f.write(b'line\n')
+        with open(self.file_path, 'ab') as f:
+            f.write(b'line\n')
+
+        self.assertTrue(handler.wait_for('modified', self.file_path))
+        self.assertEqual([self.file_path],
+                         list(set(e.src_path for e in handler.events)))
+
+    def test_deleted(self):
+        handler = RecordingHandler()
+        self.observer.schedule(handler, self.file_path)
+        self._start()
+
+        os.remove(self.file_path)
+
+        self.assertTrue(handler.wait_for('deleted', self.file_path))
+
+    def test_rotation(self):
+        handler = RecordingHandler()
+        self.observer.schedule(handler, self.file_path)
+        self._start()
+
+        os.rename(self.file_path, self.file_path + '.1')
+        self.assertTrue(handler.wait_for('moved', self.file_path))
+
+        with open(self.file_path, 'ab') as f:
+            f.write(b'line\n')
+        self.assertTrue(handler.wait_for('created', self.file_path))
+
+        # Writes to re-created file are watched
+        del handler.events[:]
+        with open(self.file_path, 'ab') as f:
+            f.write(b'line\n')
+        self.assertTrue(handler.wait_for('modified', self.file_path))
+
+    def test_directory_created_files(self):
+        handler = RecordingHandler()
+        self.observer.schedule(handler, self.tmp_dir, recursive=True)
+        self._start()
+
+        sub_dir = os.path.join(self.tmp_dir, 'sub_dir')
+        os.mkdir(sub_dir)
+        self.assertTrue(handler.wait_for('created', sub_dir))
+
+        new_file_path = os.path.join(sub_dir, 'console.log')
+        with open(new_file_path, 'wb'):
+            pass
+        self.assertTrue(handler.wait_for('created', new_file_path))
+
+    def test_remove_handler_for_watch(self):
+        handler1 = RecordingHandler()
+        handler2 = RecordingHandler()
+        watch = self.observer.schedule(handler1, self.file_path)
+        self.assertIs(watch, self.observer.schedule(handler2,
+                                                    self.file_path))
+
+        self.observer.remove_handler_for_watch(handler1, watch)
+        self.assertTrue(watch.wds)
+
+        self.observer.remove_handler_for_watch(handler2, watch)
+        self.assertFalse(watch.wds)
+        self.assertEqual({}, self.observer._wd_watches)
+
+    def test_stop(self):
+        self._start()
+        self.observer.stop()
+        self.observer.join(5)
+        self.assertFalse(self.observer.is_alive())
+
+    def test_handler_failure_does_not_stop_observer(self):
+        failing_handler = mock.Mock()
+        failing_handler.dispatch.side_effect = Exception('failed')
+        handler = RecordingHandler()
+        self.observer.schedule(failing_handler, self.file_path)
+        self.observer.schedule(handler, self.file_path)
+        self._start()
+
+        with open(self.file_path, 'ab') as f:
+            f.write(b'line\n')
+
+        self.assertTrue(handler.wait_for('modified', self.file_path))
+        self.assertTrue(self.observer.is_alive())
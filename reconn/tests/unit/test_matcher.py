@@ -0,0 +1,294 @@
+import re
+
+import ddt
+
+from reconn import test
+from reconn import matcher as reconn_matcher
+from reconn import utils as reconn_utils
+
+
+def _re_objs(patterns):
+    return [('group%d' % i, re.compile(pattern))
+            for i, pattern in enumerate(patterns)]
+
+
+def _search_patterns(re_objs, line):
+    # Searches every pattern in turn, first configured found wins
+    for survey_grp_name, re_obj in re_objs:
+        if re_obj.search(line) is not None:
+            return survey_grp_name, re_obj.pattern
+    return None, None
+
+
+@ddt.ddt
+class SurveyMatcherTestCase(test.TestCase):
+
+    @ddt.data({'patterns': ['login:', 'Starting network', 'error'],
+               'line': 'Starting network ... login:',
+               'exp_return': ('group0', 'login:')},
+              {'patterns': ['login:', 'Starting network', 'error'],
+               'line': 'no survey pattern in this line',
+               'exp_return': (None, None)},
+              {'patterns': ['b', 'a'],
+               'line': 'ab',
+               'exp_return': ('group0', 'b')},
+              {'patterns': ['ab', 'a'],
+               'line': 'xab',
+               'exp_return': ('group0', 'ab')},
+              {'patterns': ['a', 'ab'],
+               'line': 'xab',
+               'exp_return': ('group0', 'a')},
+              {'patterns': ['c$', 'b', 'a'],
+               'line': 'abc',
+               'exp_return': ('group0', 'c$')},
+              {'patterns': ['^b', 'a'],
+               'line': 'ab',
+               'exp_return': ('group1', 'a')},
+              {'patterns': [r'(\w)\1', 'x', 'aa'],
+               'line': 'x aa',
+               'exp_return': ('group0', r'(\w)\1')},
+              {'patterns': ['x', '(?i)ERROR', 'error'],
+               'line': 'an error',
+               'exp_return': ('group1', '(?i)ERROR')},
+              {'patterns': ['(?P<id>[0-9]+)s', '(?P<id>[0-9]+)', 'y'],
+               'line': 'y 42',
+               'exp_return': ('group1', '(?P<id>[0-9]+)')})
+    @ddt.unpack
+    def test_search(self, patterns, line, exp_return):
+        re_objs = _re_objs(patterns)
+        matcher = reconn_matcher.SurveyMatcher(re_objs)
+
+        self.assertEqual(exp_return, matcher.search(line))
+        self.assertEqual(_search_patterns(re_objs, line),
+                         matcher.search(line))
+
+    @ddt.data({'patterns': ['a', 'b', 'c'], 'exp_combined_count': 3},
+              {'patterns': ['a', r'(b)\1', 'c'], 'exp_combined_count': 2},
+              {'patterns': ['a', '(?i)b', 'c'], 'exp_combined_count': 2},
+              {'patterns': ['a', '(x)?(?(1)b|c)'], 'exp_combined_count': 0},
+              {'patterns': ['(?P<x>a)', '(?P<x>b)', 'c'],
+               'exp_combined_count': 2},
+              {'patterns': ['a'], 'exp_combined_count': 0})
+    @ddt.unpack
+    def test_combined_count(self, patterns, exp_combined_count):
+        matcher = reconn_matcher.SurveyMatcher(_re_objs(patterns))
+        self.assertEqual(exp_combined_count, matcher.combined_count)
+
+    def test_match(self):
+        re_objs = _re_objs(['login:', 'error'])
+        survey_groups = [reconn_utils.SurveyGroup(name, re_obj, None,
+                                                  False, i)
+                         for i, (name, re_obj) in enumerate(re_objs)]
+        matcher = reconn_matcher.SurveyMatcher(re_objs, survey_groups)
+
+        self.assertIs(survey_groups[1], matcher.match('an error'))
+        self.assertIs(survey_groups[0], matcher.match('error login:'))
+        self.assertIsNone(matcher.match('none'))
+
+    @ddt.data({'patterns': ['login:', r'\d+ x', '^ab', 'c$', r'a\sb'],
+               'exp_block_scannable': True},
+              {'patterns': ['login:', '(?!a)b'],
+               'exp_block_scannable': False},
+              {'patterns': ['login:', r'\Aab'],
+               'exp_block_scannable': False},
+              {'patterns': ['login:', '(?i)ab'],
+               'exp_block_scannable': False})
+    @ddt.unpack
+    def test_block_scannable(self, patterns, exp_block_scannable):
+        matcher = reconn_matcher.SurveyMatcher(_re_objs(patterns))
+        self.assertEqual(exp_block_scannable, matcher.block_scannable)
+
+    @ddt.data('line 1\nab\nxa\nb c\n 12 x\n', b'xc\nline 2\nlogin: c\n')
+    def test_scan_block(self, block):
+        patterns = ['login:', r'\d+ x', '^ab', 'c$', r'a\sb']
+        if isinstance(block, bytes):
+            patterns = [pattern.encode('ascii') for pattern in patterns]
+        re_objs = _re_objs(patterns)
+        matcher = reconn_matcher.SurveyMatcher(re_objs)
+        lines = block.splitlines(True)
+        exp_return = []
+        start = 0
+        for line in lines:
+            survey_grp_name, pattern = _search_patterns(re_objs, line)
+            if survey_grp_name is not None:
+                exp_return.append((line, [patterns.index(pattern)], start))
+            start += len(line)
+
+        self.assertEqual(exp_return, list(matcher.scan_block(block)))
+        self.assertEqual(len(lines), matcher.lines)
+
+    @ddt.data(['login:', 'login', r'\d+ x', 'c$', '(?i)C', 'x', r'(a)\1'],
+              ['a', 'b', 'c', 'x'])
+    def test_search_all(self, patterns):
+        re_objs = _re_objs(patterns)
+        matcher = reconn_matcher.SurveyMatcher(re_objs, match_all=True)
+
+        for line in ('none', 'login: 12 x\n', 'aa c', 'abc', 'C x'):
+            exp_return = [i for i, (_, re_obj) in enumerate(re_objs)
+                          if re_obj.search(line) is not None]
+            self.assertEqual(exp_return, matcher.search_all(line))
+            self.assertEqual(exp_return, matcher.search_indexes(line))
+
+    def test_match_groups(self):
+        re_objs = _re_objs(['login:', 'error', 'login'])
+        survey_groups = [reconn_utils.SurveyGroup(name, re_obj, None,
+                                                  False, i)
+                         for i, (name, re_obj) in enumerate(re_objs)]
+        first_matcher = reconn_matcher.SurveyMatcher(re_objs, survey_groups)
+        all_matcher = reconn_matcher.SurveyMatcher(re_objs, survey_groups,
+                                                   match_all=True)
+
+        self.assertEqual([survey_groups[0]],
+                         first_matcher.match_groups('error login:'))
+        self.assertEqual(survey_groups,
+                         all_matcher.match_groups('error login:'))
+        self.assertEqual([], all_matcher.match_groups('none'))
+        self.assertEqual([('error login:\n', survey_groups, 2)],
+                         list(all_matcher.match_block('x\nerror login:\n')))
+
+    def test_search_bytes(self):
+        re_objs = [('group0', re.compile(b'login:')),
+                   ('group1', re.compile(b'error'))]
+        matcher = reconn_matcher.SurveyMatcher(re_objs)
+        self.assertEqual(('group1', b'error'),
+                         matcher.search(b'error only'))
+        self.assertEqual(('group0', b'login:'),
+                         matcher.search(b'error before login:'))
+
+    def test_search_many_patterns(self):
+        patterns = ['pattern %d' % i for i in range(500)]
+        re_objs = _re_objs(patterns)
+        matcher = reconn_matcher.SurveyMatcher(re_objs)
+
+        self.assertEqual(500, matcher.prefiltered_count)
+        for line in ('pattern 499 pattern 12', 'pattern 7', 'none'):
+            self.assertEqual(_search_patterns(re_objs, line),
+                             matcher.search(line))
+
+    @ddt.data({'pattern': 'login:', 'exp_return': ('login:', '')},
+              {'pattern': r'Started (\w+)', 'exp_return': ('Started ',
+                                                           r'(\w+)')},
+              {'pattern': 'ab*', 'exp_return': ('a', 'b*')},
+              {'pattern': 'a{2}', 'exp_return': ('', 'a{2}')},
+              {'pattern': 'ab|cd', 'exp_return': ('', 'ab|cd')},
+              {'pattern': 'a(b|c)', 'exp_return': ('a', '(b|c)')},
+              {'pattern': '[|]a', 'exp_return': ('', '[|]a')},
+              {'pattern': r'\.x', 'exp_return': ('', r'\.x')})
+    @ddt.unpack
+    def test_split_literal_prefix(self, pattern, exp_return):
+        self.assertEqual(exp_return,
+                         reconn_matcher.split_literal_prefix(pattern))
+
+    @ddt.data({'pattern': 'login:', 'exp_literals': ['login:']},
+              {'pattern': r'\[\s*\d+\.\d+\] POSTINSTALL SCRIPT END',
+               'exp_literals': ['] POSTINSTALL SCRIPT END']},
+              {'pattern': '(paas|iaas)_postinstall',
+               'exp_literals': ['_postinstall']},
+              {'pattern': 'fail(ed|ure)', 'exp_literals': ['fail']},
+              {'pattern': '(?:Started|Reached) target',
+               'exp_literals': ['Started', 'Reached']},
+              {'pattern': '(?i)login:', 'exp_literals': None},
+              {'pattern': r'\d+ x', 'exp_literals': [' x']},
+              {'pattern': '(ab)?cd', 'exp_literals': ['cd']},
+              {'pattern': 'ab|c', 'exp_literals': None})
+    @ddt.unpack
+    def test_required_literals(self, pattern, exp_literals):
+        self.assertEqual(exp_literals, reconn_matcher.required_literals(
+            re.compile(pattern)))
+
+    def test_required_literals_bytes(self):
+        self.assertEqual([b' login:'], reconn_matcher.required_literals(
+            re.compile(b'ubuntu(-\\d+)? login:')))
+
+    def test_prefilter(self):
+        re_objs = _re_objs(['login:', 'Starting (network|ssh)'])
+        matcher = reconn_matcher.SurveyMatcher(re_objs)
+
+        self.assertFalse(matcher.prefilter_block('line 1\nline 2\n'))
+        self.assertTrue(matcher.prefilter_block('line 1\nlogin:\n'))
+        for line in ('line 3\n', 'Starting nothing\n', 'Starting ssh\n',
+                     'ubuntu login:\n'):
+            matcher.search(line)
+
+        self.assertEqual(6, matcher.lines)
+        self.assertEqual(3, matcher.lines_rejected)
+        self.assertEqual([('group0', 'login:', 1, 1),
+                          ('group1', 'Starting (network|ssh)', 2, 1)],
+                         matcher.get_stats())
+
+    def test_stats_pattern_text(self):
+        survey_groups = [
+            reconn_utils.SurveyGroup('group0', re.compile(b'login:'), None,
+                                     False, 0, pattern=u'login:'),
+            reconn_utils.SurveyGroup('group1',
+                                     re.compile(u'r\xe9seau up'.encode(
+                                         'utf-8')),
+                                     None, False, 1)]
+        matcher = reconn_matcher.SurveyMatcher(
+            [(g.name, g.re_obj) for g in survey_groups], survey_groups)
+
+        self.assertEqual([('group0', u'login:', 0, 0),
+                          ('group1', u'r\xe9seau up', 0, 0)],
+                         matcher.get_stats())
+
+    @ddt.data({'pattern': r'Traceback\n(  .*\n)+\w+Error: .*',
+               'exp_anchor': 'Error: '},
+              {'pattern': r'panic\nend panic\n', 'exp_anchor': 'end panic'},
+              {'pattern': r'panic\n\w+', 'exp_anchor': None},
+              {'pattern': r'panic\n\w+ xy', 'exp_anchor': ' xy'},
+              {'pattern': r'(?i)login:', 'exp_anchor': None},
+              {'pattern': r'a\d+', 'exp_anchor': None})
+    @ddt.unpack
+    def test_anchor_literal(self, pattern, exp_anchor):
+        self.assertEqual(exp_anchor, reconn_matcher.anchor_literal(
+            re.compile(pattern)))
+
+    def test_prefilter_block_unfiltered_patterns(self):
+        matcher = reconn_matcher.SurveyMatcher(_re_objs(['login:', r'\d']))
+        self.assertTrue(matcher.prefilter_block('line\n'))
+
+
+class _Window(object):
+
+    def __init__(self, tail):
+        self.tail = tail
+
+    def lines_before(self, count, block=None, start=None):
+        lines = (self.tail + block[:start]).splitlines(True)
+        return b''.join(lines[len(lines) - count:]) if count else b''
+
+
+class MultilineMatcherTestCase(test.TestCase):
+
+    def setUp(self):
+        super(MultilineMatcherTestCase, self).setUp()
+        self.survey_groups = [
+            reconn_utils.SurveyGroup(
+                'group0', re.compile(b'^begin\n(?:.*\n)*?end$', re.M), None,
+                False, 0, multiline=True, window_lines=3, anchor=b'end'),
+            reconn_utils.SurveyGroup(
+                'group1', re.compile(b'^x\nend', re.M), None, False, 1,
+                multiline=True, window_lines=2, anchor=b'end')]
+        self.matcher = reconn_matcher.MultilineMatcher(self.survey_groups)
+
+    def test_match_block(self):
+        block = b'x\nend\nbegin\nend\nbegin\na\nb\nend\n'
+
+        self.assertEqual(
+            [(6, self.survey_groups[0], b'begin\nx\nend'),
+             (6, self.survey_groups[1], b'x\nend'),
+             (16, self.survey_groups[0], b'begin\nend')],
+            self.matcher.match_block(block, _Window(b'begin\n')))
+        self.assertEqual(6, self.matcher.windows)
+        self.assertEqual(3, self.matcher.matches)
+
+    def test_match_block_retired_groups(self):
+        self.assertEqual(
+            [(4, self.survey_groups[1], b'x\nend')],
+            self.matcher.match_block(b'end\n', _Window(b'begin\nx\n'),
+                                     frozenset([0])))
+
+    def test_match_block_no_anchor(self):
+        self.assertEqual([], self.matcher.match_block(b'begin\nx\n',
+                                                      _Window(b'')))
+        self.assertEqual(0, self.matcher.windows)
@@ -0,0 +1,46 @@
+import json
+
+import ddt
+
+from reconn import message as reconn_message
+from reconn import test
+
+
+@ddt.ddt
+class MessageRendererTestCase(test.TestCase):
+
+    @ddt.data(u'plain line', u'quote " and \\ backslash',
+              u'control \r\n\t\x01 chars', u'caf\xe9 \ufffd')
+    def test_render_json(self, line):
+        renderer = reconn_message.MessageRenderer(
+            '{{"line":"{line}", "uuid":"{uuid}", "id": {id} }}',
+            {'uuid': u'6e64"ff56'}, json_template=True)
+
+        msg = renderer.render({'line': line, 'id': 'req-1'})
+
+        self.assertEqual({'line': line, 'uuid': u'6e64"ff56',
+                          'id': u'req-1'}, json.loads(msg))
+        self.assertEqual(['line', 'id'], renderer.field_names)
+
+    def test_render_json_template_control_chars(self):
+        renderer = reconn_message.MessageRenderer(
+            '{{"line":"{line}\n", "tab":"a\tb" }}', json_template=True)
+
+        self.assertEqual({'line': u'x\n', 'tab': u'a\tb'},
+                         json.loads(renderer.render({'line': u'x'})))
+
+    def test_render(self):
+        renderer = reconn_message.MessageRenderer(
+            '{timestamp} {{ {line} : {name} }} {uuid} {count:>3}',
+            {'uuid': 'u1'})
+
+        self.assertEqual(u' { a "b" :  } u1   7',
+                         renderer.render({'line': u'a "b"', 'count': 7}))
+
+    @ddt.data({'template': '{line', 'json_template': False},
+              {'template': '{{"line": "{line}"', 'json_template': True},
+              {'template': "{{'line': '{line}'}}", 'json_template': True})
+    @ddt.unpack
+    def test_invalid_template(self, template, json_template):
+        self.assertRaises(ValueError, reconn_message.MessageRenderer,
+                          template, json_template=json_template)
@@ -0,0 +1,127 @@
+import mock
+import pika
+
+from reconn import test
+from reconn import pool as reconn_pool
+from reconn.tests import fake_rmq
+
+
+class ConnectionPoolTestCase(test.TestCase):
+
+    def setUp(self):
+        super(ConnectionPoolTestCase, self).setUp()
+        self.broker = fake_rmq.FakeBroker()
+        patcher = mock.patch('pika.BlockingConnection',
+                             self.broker.connection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pool = reconn_pool.ConnectionPool()
+
+    def _parameters(self, username='guest', host='127.0.0.1'):
+        return pika.ConnectionParameters(
+            host=host,
+            credentials=pika.credentials.PlainCredentials(username, 'pwd'))
+
+    def test_acquire_shares_connection(self):
+        pooled = self.pool.acquire(self._parameters())
+
+        self.assertIs(pooled, self.pool.acquire(self._parameters()))
+        self.assertEqual(2, pooled.users)
+        self.assertIsNot(pooled,
+                         self.pool.acquire(self._parameters('other')))
+        self.assertIsNot(pooled,
+                         self.pool.acquire(self._parameters(host='10.0.0.1')))
+        self.assertEqual(3, len(self.broker.connections))
+        self.assertEqual(3, len(self.pool))
+
+    def test_release_closes_last(self):
+        pooled = self.pool.acquire(self._parameters())
+        self.pool.acquire(self._parameters())
+        connection = pooled.connection
+
+        self.pool.release(pooled)
+        self.assertTrue(connection.is_open)
+        self.pool.release(pooled)
+        self.assertTrue(connection.is_closed)
+        self.assertEqual(0, len(self.pool))
+
+        self.assertIsNot(pooled, self.pool.acquire(self._parameters()))
+        self.assertEqual(2, len(self.broker.connections))
+
+    def test_acquire_failure_released(self):
+        with mock.patch('pika.BlockingConnection',
+                        side_effect=pika.exceptions.ConnectionClosed):
+            self.assertRaises(pika.exceptions.ConnectionClosed,
+                              self.pool.acquire, self._parameters())
+        self.assertEqual(0, len(self.pool))
+
+    def test_declare_once(self):
+        pooled = self.pool.acquire(self._parameters())
+        declare = mock.Mock()
+
+        self.assertTrue(pooled.declare_once(('queue', 'q'), declare))
+        self.assertFalse(pooled.declare_once(('queue', 'q'), declare))
+        self.assertTrue(pooled.declare_once(('queue', 'q2'), declare))
+        self.assertEqual(2, declare.call_count)
+
+        other = self.pool.acquire(self._parameters('other'))
+        self.assertTrue(other.declare_once(('queue', 'q'), declare))
+        # Declared again over a new connection
+        self.pool.release(pooled)
+        pooled = self.pool.acquire(self._parameters())
+        self.assertTrue(pooled.declare_once(('queue', 'q'), declare))
+
+    def test_declare_failure_not_remembered(self):
+        pooled = self.pool.acquire(self._parameters())
+        declare = mock.Mock(side_effect=[pika.exceptions.ChannelClosed,
+                                         None])
+
+        self.assertRaises(pika.exceptions.ChannelClosed,
+                          pooled.declare_once, ('queue', 'q'), declare)
+        self.assertTrue(pooled.declare_once(('queue', 'q'), declare))
+
+    def test_channel_reconnects(self):
+        pooled = self.pool.acquire(self._parameters())
+        channel = pooled.channel()
+        pooled.connection.lose()
+        self.assertFalse(channel.is_open)
+
+        channel = pooled.channel()
+
+        self.assertTrue(channel.is_open)
+        self.assertEqual(2, len(self.broker.connections))
+
+    def test_declared_again_on_reconnect(self):
+        pooled = self.pool.acquire(self._parameters())
+        declare = mock.Mock()
+        pooled.declare_once(('queue', 'q'), declare)
+        pooled.connection.lose()
+
+        pooled.channel()
+
+        self.assertTrue(pooled.declare_once(('queue', 'q'), declare))
+        self.assertEqual(2, declare.call_count)
+
+    def test_connection_callbacks(self):
+        pooled = self.pool.acquire(self._parameters())
+        callbacks = [(mock.Mock(), mock.Mock()) for i in range(2)]
+        for blocked_callback, unblocked_callback in callbacks:
+            pooled.add_connection_callbacks(blocked_callback,
+                                            unblocked_callback)
+        pooled.remove_connection_callbacks(*callbacks[1])
+
+        pooled._connection_blocked_callback('blocked')
+        callbacks[0][0].assert_called_once_with('blocked')
+        callbacks[1][0].assert_not_called()
+        # Connection blocked already
+        pooled.add_connection_callbacks(*callbacks[1])
+        callbacks[1][0].assert_called_once_with(None)
+
+        pooled._connection_unblocked_callback('unblocked')
+        for blocked_callback, unblocked_callback in callbacks:
+            unblocked_callback.assert_called_once_with('unblocked')
+
+    def test_get_connection_pool(self):
+        with mock.patch.object(reconn_pool, '_connection_pool', None):
+            pool = reconn_pool.get_connection_pool()
+            self.assertIs(pool, reconn_pool.get_connection_pool())
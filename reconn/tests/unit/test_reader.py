@@ -0,0 +1,206 @@
+import io
+import ddt
+
+from reconn import test
+from reconn import reader as reconn_reader
+
+
+@ddt.ddt
+class LineReaderTestCase(test.TestCase):
+
+    @ddt.data({'content': b'',
+               'chunk_size': 4,
+               'exp_lines': [],
+               'exp_partial_line': b''},
+              {'content': b'line 1\nline 2\n',
+               'chunk_size': 1024,
+               'exp_lines': [b'line 1\n', b'line 2\n'],
+               'exp_partial_line': b''},
+              {'content': b'line 1\nline 2\nline 3',
+               'chunk_size': 3,
+               'exp_lines': [b'line 1\n', b'line 2\n'],
+               'exp_partial_line': b'line 3'},
+              {'content': b'a long line without newline',
+               'chunk_size': 5,
+               'exp_lines': [],
+               'exp_partial_line': b'a long line without newline'},
+              {'content': b'\n\nx\n',
+               'chunk_size': 1,
+               'exp_lines': [b'\n', b'\n', b'x\n'],
+               'exp_partial_line': b''},
+              )
+    @ddt.unpack
+    def test_read_lines(self, content, chunk_size,
+                        exp_lines, exp_partial_line):
+        f = reconn_reader.LineReader(io.BytesIO(content), chunk_size)
+        lines = []
+        while True:
+            batch = f.read_lines()
+            if batch is None:
+                break
+            lines.extend(batch)
+
+        self.assertEqual(exp_lines, lines)
+        self.assertEqual(exp_partial_line, f.partial_line)
+
+    def test_partial_line_completed_by_later_write(self):
+        file_obj = io.BytesIO()
+        file_obj.write(b'first half ')
+        file_obj.seek(0)
+        f = reconn_reader.LineReader(file_obj, 4)
+
+        self.assertEqual([], f.read_lines())
+        self.assertEqual([], f.read_lines())
+        self.assertEqual([], f.read_lines())
+        self.assertIsNone(f.read_lines())
+        self.assertEqual(b'first half ', f.partial_line)
+
+        # Writer appends rest of the line
+        pos = file_obj.tell()
+        file_obj.write(b'second half\n')
+        file_obj.seek(pos)
+        lines = []
+        while True:
+            batch = f.read_lines()
+            if batch is None:
+                break
+            lines.extend(batch)
+
+        self.assertEqual([b'first half second half\n'], lines)
+        self.assertEqual(b'', f.partial_line)
+
+    def test_clear_partial_line(self):
+        f = reconn_reader.LineReader(io.BytesIO(b'line 1\nline'), 1024)
+        self.assertEqual([b'line 1\n'], f.read_lines())
+        self.assertEqual(b'line', f.partial_line)
+        f.clear_partial_line()
+        self.assertEqual(b'', f.partial_line)
+
+    def test_close(self):
+        file_obj = io.BytesIO(b'')
+        f = reconn_reader.LineReader(file_obj)
+        f.close()
+        self.assertTrue(file_obj.closed)
+
+    def test_offset(self):
+        f = reconn_reader.LineReader(io.BytesIO(b'line 1\nline 2'), 4)
+        self.assertEqual(0, f.offset)
+        while f.read_lines() is not None:
+            pass
+        self.assertEqual(13, f.offset)
+
+    def test_resume(self):
+        f = reconn_reader.LineReader(io.BytesIO(b'line 1\nline 2\nline 3'),
+                                     1024)
+        f.resume(9, b'line 2 and ')
+
+        self.assertEqual([b'line 2 and ne 2\n'], f.read_lines())
+        self.assertEqual(b'line 3', f.partial_line)
+        self.assertEqual(20, f.offset)
+
+    @ddt.data({'offset': 0, 'exp_lines': [b'line 1\n', b'line 2\n']},
+              {'offset': 7, 'exp_lines': [b'line 2\n']},
+              {'offset': 3, 'exp_lines': [b'line 2\n']},
+              {'offset': 10, 'exp_lines': []},
+              {'offset': 14, 'exp_lines': []})
+    @ddt.unpack
+    def test_seek(self, offset, exp_lines):
+        f = reconn_reader.LineReader(io.BytesIO(b'line 1\nline 2\nline'), 2)
+        f.seek(offset)
+        lines = []
+        while True:
+            batch = f.read_lines()
+            if batch is None:
+                break
+            lines.extend(batch)
+
+        self.assertEqual(exp_lines, lines)
+        self.assertEqual(b'line', f.partial_line)
+
+    @ddt.data({'content': b'short\n0123456789abc\nab',
+               'chunk_size': 1024, 'policy': 'truncate',
+               'exp_lines': [b'short\n', b'01234\n'],
+               'exp_partial_line': b'ab', 'exp_truncated_lines': 1},
+              {'content': b'short\n0123456789abc\nab',
+               'chunk_size': 1024, 'policy': 'split',
+               'exp_lines': [b'short\n', b'01234\n', b'56789\n',
+                             b'abc\n'],
+               'exp_partial_line': b'ab', 'exp_truncated_lines': 1},
+              {'content': b'0123456789abc\nx\n0123456789',
+               'chunk_size': 3, 'policy': 'truncate',
+               'exp_lines': [b'01234\n', b'x\n', b'01234\n'],
+               'exp_partial_line': b'', 'exp_truncated_lines': 2},
+              {'content': b'0123456789abc\nx\n0123456789',
+               'chunk_size': 3, 'policy': 'split',
+               'exp_lines': [b'01234\n', b'56789\n', b'abc\n', b'x\n',
+                             b'01234\n'],
+               'exp_partial_line': b'56789', 'exp_truncated_lines': 2},
+              {'content': b'01234\n012345\n',
+               'chunk_size': 4, 'policy': 'truncate',
+               'exp_lines': [b'01234\n', b'01234\n'],
+               'exp_partial_line': b'', 'exp_truncated_lines': 1})
+    @ddt.unpack
+    def test_max_line_bytes(self, content, chunk_size, policy, exp_lines,
+                            exp_partial_line, exp_truncated_lines):
+        f = reconn_reader.LineReader(io.BytesIO(content), chunk_size,
+                                     max_line_bytes=5,
+                                     long_line_policy=policy)
+        lines = []
+        while True:
+            batch = f.read_lines()
+            if batch is None:
+                break
+            lines.extend(batch)
+
+        self.assertEqual(exp_lines, lines)
+        self.assertEqual(exp_partial_line, f.partial_line)
+        self.assertEqual(exp_truncated_lines, f.truncated_lines)
+        self.assertEqual(len(content), f.offset)
+
+    @ddt.data({'content': b'10%\r20%\r\nline\r\n100%\rdone',
+               'chunk_size': 1024,
+               'exp_lines': [b'10%\n', b'20%\r\n', b'line\r\n', b'100%\n'],
+               'exp_partial_line': b'done'},
+              {'content': b'10%\r20%\r\nline\r\n100%\rdone',
+               'chunk_size': 4,
+               'exp_lines': [b'10%\n', b'20%\r\n', b'line\r\n', b'100%\n'],
+               'exp_partial_line': b'done'},
+              {'content': b'a\r\rb\r',
+               'chunk_size': 2,
+               'exp_lines': [b'a\n', b'\n'],
+               'exp_partial_line': b'b\r'})
+    @ddt.unpack
+    def test_cr_terminates(self, content, chunk_size, exp_lines,
+                           exp_partial_line):
+        f = reconn_reader.LineReader(io.BytesIO(content), chunk_size,
+                                     cr_terminates=True)
+        lines = []
+        while True:
+            batch = f.read_lines()
+            if batch is None:
+                break
+            lines.extend(batch)
+
+        self.assertEqual(exp_lines, lines)
+        self.assertEqual(exp_partial_line, f.partial_line)
+
+    @ddt.data(1, 3, 7, 1024)
+    def test_window(self, chunk_size):
+        f = reconn_reader.LineReader(
+            io.BytesIO(b'line 1\nline 2\nline 3\nline 4\nlast'), chunk_size,
+            window_lines=2)
+        read = b''
+        while True:
+            block = f.read_block()
+            if block is None:
+                break
+            # Window holds lines read before block
+            self.assertEqual(read[-14:] if len(read) > 14 else read,
+                             f.window.lines_before(2, block, 0))
+            read += block
+
+        self.assertEqual(b'line 3\nline 4\n', f.window.lines_before(5))
+        self.assertEqual(b'line 4\n', f.window.lines_before(1))
+
+        f.resume(0)
+        self.assertEqual(b'', f.window.lines_before(2))
@@ -1,8 +1,19 @@
+import io
+import os
+import re
+import shutil
+import tempfile
+import threading
+
 import mock
 import ddt
 
 from reconn import test
 from reconn import scout as reconn_scout
+from reconn import matcher as reconn_matcher
+from reconn import reader as reconn_reader
+from reconn import timeout as reconn_timeout
+from reconn import utils as reconn_utils
 
 
 @ddt.ddt
@@ -24,36 +35,54 @@ class FileEventHandlerTestCase(test.TestCase):
     @ddt.unpack
     @mock.patch('time.sleep')
     @mock.patch('watchdog.events.FileSystemEventHandler')
-    @mock.patch('reconn.timeout.ReconnTimeout.is_timed_out')
     @mock.patch('reconn.scout.lock_reconn_file')
     def test_file_event_handler(self,
                                 mock_reconn_lock_reconn_file,
-                                mock_reconn_timeout_is_timed_out,
                                 mock_watchdog_fseventhandler,
                                 mock_time_sleep,
                                 event_src_path, event_is_dir,
                                 exp_reconn):
         file_path = '/tmp/test_path/test_file.txt'
         file_obj = mock.Mock()
+        target = reconn_scout.ReconnTarget(file_path, file_obj)
 
-        mock_reconn_timeout_is_timed_out.return_value = False
         event = mock.Mock()
         event.src_path = event_src_path
         event.is_directory = event_is_dir
         event.event_type = 'modified'
 
-        event_handler = reconn_scout.FileEventHandler(file_path, file_obj)
+        event_handler = reconn_scout.FileEventHandler(target)
         event_handler.on_modified(event)
 
         if exp_reconn:
-            mock_reconn_lock_reconn_file.assert_called_once_with(file_obj)
+            mock_reconn_lock_reconn_file.assert_called_once_with(target)
         else:
             mock_reconn_lock_reconn_file.assert_not_called()
 
+    @mock.patch('reconn.scout.lock_reconn_file')
+    def test_file_event_handler_when_target_done(
+            self,
+            mock_reconn_lock_reconn_file):
+        file_path = '/tmp/test_path/test_file.txt'
+        target = reconn_scout.ReconnTarget(file_path, mock.Mock())
+        target.end_reconn = True
+        event = mock.Mock()
+        event.src_path = file_path
+
+        event_handler = reconn_scout.FileEventHandler(target)
+        event_handler.on_modified(event)
+
+        mock_reconn_lock_reconn_file.assert_not_called()
+
     @ddt.data({'event_dict': {'src_path': '/tmp/test_path/test_file.txt',
                               'is_directory': False, 'event_type': 'deleted'},
                'target_file': '/tmp/test_path/test_file.txt',
                'exp_file_exists': False
+               },
+              {'event_dict': {'src_path': '/tmp/test_path/other_file.txt',
+                              'is_directory': False, 'event_type': 'deleted'},
+               'target_file': '/tmp/test_path/test_file.txt',
+               'exp_file_exists': True
                }
               )
     @ddt.unpack
@@ -61,13 +90,10 @@ class FileEventHandlerTestCase(test.TestCase):
     def test_on_deleted(self,
                         mock_threading_current_thread,
                         event_dict, target_file, exp_file_exists):
-        _target_file_exists = reconn_scout.target_file_exists
-        reconn_scout.target_file_exists = True
         mock_thread = mock.Mock(name='observer_thread')
         mock_threading_current_thread.return_value = mock_thread
-        file_path = target_file
-        file_obj = mock.Mock()
-        event_handler = reconn_scout.FileEventHandler(file_path, file_obj)
+        target = reconn_scout.ReconnTarget(target_file, mock.Mock())
+        event_handler = reconn_scout.FileEventHandler(target)
 
         event = mock.Mock()
         for k, v in event_dict.items():
@@ -75,197 +101,1083 @@ class FileEventHandlerTestCase(test.TestCase):
 
         event_handler.on_deleted(event)
 
-        self.assertEqual(exp_file_exists, reconn_scout.target_file_exists)
-        mock_thread.stop.assert_called_once_with()
+        self.assertEqual(exp_file_exists, target.exists)
+        # Observer is shared by other target files
+        mock_thread.stop.assert_not_called()
+
+    @ddt.data({'event_type': 'moved',
+               'src_path': '/tmp/test_path/test_file.txt',
+               'dest_path': '/tmp/test_path/test_file.txt.1',
+               'exp_reconn': True},
+              {'event_type': 'moved',
+               'src_path': '/tmp/test_path/test_file.txt.tmp',
+               'dest_path': '/tmp/test_path/test_file.txt',
+               'exp_reconn': True},
+              {'event_type': 'moved',
+               'src_path': '/tmp/test_path/test_file.txt.1',
+               'dest_path': '/tmp/test_path/test_file.txt.2',
+               'exp_reconn': False},
+              {'event_type': 'created',
+               'src_path': '/tmp/test_path/test_file.txt',
+               'dest_path': None,
+               'exp_reconn': True},
+              {'event_type': 'created',
+               'src_path': '/tmp/test_path/other_file.txt',
+               'dest_path': None,
+               'exp_reconn': False})
+    @ddt.unpack
+    @mock.patch('reconn.scout.lock_reconn_file')
+    def test_rotation_events(self,
+                             mock_reconn_lock_reconn_file,
+                             event_type, src_path, dest_path,
+                             exp_reconn):
+        target = reconn_scout.ReconnTarget('/tmp/test_path/test_file.txt',
+                                           mock.Mock())
+        event = mock.Mock()
+        event.event_type = event_type
+        event.src_path = src_path
+        event.dest_path = dest_path
+        event_handler = reconn_scout.FileEventHandler(target)
 
-        reconn_scout.target_file_exists = _target_file_exists
+        if event_type == 'moved':
+            event_handler.on_moved(event)
+        else:
+            event_handler.on_created(event)
+
+        self.assertTrue(target.exists)
+        if exp_reconn:
+            mock_reconn_lock_reconn_file.assert_called_once_with(target)
+        else:
+            mock_reconn_lock_reconn_file.assert_not_called()
 
     @mock.patch('reconn.scout.FileEventHandler')
-    @mock.patch('watchdog.observers.Observer')
     def test_register_notification(self,
-                                   mock_watchdog_observer,
                                    mock_reconn_fileeventhandler):
         file_path = '/tmp/test_path/test_file.txt'
-        file_obj = mock.Mock()
+        target = reconn_scout.ReconnTarget(file_path, mock.Mock())
 
         mock_watchdog_observer_obj = mock.Mock(
             name='mock_watchdog_observer_obj')
-        mock_watchdog_observer.return_value = mock_watchdog_observer_obj
+        mock_watch = mock.Mock(name='mock_watch')
+        mock_watchdog_observer_obj.schedule.return_value = mock_watch
 
         mock_event_handler = mock.Mock()
         mock_reconn_fileeventhandler.return_value = mock_event_handler
 
-        reconn_scout.register_notification(file_path, file_obj)
+        reconn_scout.register_notification(mock_watchdog_observer_obj, target)
 
         mock_watchdog_observer_obj.schedule.assert_called_once_with(
             mock_event_handler,
             path='/tmp/test_path',
             recursive=False)
-        mock_reconn_fileeventhandler.assert_called_once_with(
-            file_path, file_obj)
+        mock_reconn_fileeventhandler.assert_called_once_with(target)
+        self.assertEqual(mock_watch, target.watch)
+        self.assertEqual(mock_event_handler, target.event_handler)
+
+    @mock.patch('reconn.scout.FileEventHandler')
+    def test_register_notification_inotify(self,
+                                           mock_reconn_fileeventhandler):
+        file_path = '/tmp/test_path/test_file.txt'
+        target = reconn_scout.ReconnTarget(file_path, mock.Mock())
+        mock_observer = mock.Mock(
+            spec=reconn_scout.reconn_inotify.InotifyObserver)
+
+        reconn_scout.register_notification(mock_observer, target)
+
+        mock_observer.schedule.assert_called_once_with(
+            mock_reconn_fileeventhandler.return_value,
+            path=file_path,
+            recursive=False)
+
+    @ddt.data({'engine': 'watchdog', 'supported': True,
+               'exp_inotify': False},
+              {'engine': 'inotify', 'supported': True,
+               'exp_inotify': True},
+              {'engine': 'inotify', 'supported': False,
+               'exp_inotify': False})
+    @ddt.unpack
+    @mock.patch('reconn.inotify.is_supported')
+    @mock.patch('reconn.inotify.InotifyObserver')
+    @mock.patch('watchdog.observers.Observer')
+    def test_create_observer(self, mock_watchdog_observer,
+                             mock_inotify_observer, mock_is_supported,
+                             engine, supported, exp_inotify):
+        reconn_scout.register_reconn()
+        reconn_scout.CONF.set_override('notification_engine', engine)
+        self.addCleanup(reconn_scout.CONF.clear_override,
+                        'notification_engine')
+        mock_is_supported.return_value = supported
+
+        observer = reconn_scout.create_observer()
+
+        if exp_inotify:
+            self.assertEqual(mock_inotify_observer.return_value, observer)
+        else:
+            self.assertEqual(mock_watchdog_observer.return_value, observer)
+
+    def test_unregister_notification(self):
+        target = reconn_scout.ReconnTarget('/tmp/test_path/test_file.txt',
+                                           mock.Mock())
+        mock_observer = mock.Mock()
+        mock_handler = mock.Mock()
+        mock_watch = mock.Mock()
+        target.event_handler = mock_handler
+        target.watch = mock_watch
+
+        reconn_scout.unregister_notification(mock_observer, target)
+
+        mock_observer.remove_handler_for_watch.assert_called_once_with(
+            mock_handler, mock_watch)
+        mock_observer.unschedule.assert_not_called()
+        self.assertIsNone(target.watch)
 
 
 @ddt.ddt
-class ReconnTestCase(test.TestCase):
+class ReconnTargetsTestCase(test.TestCase):
 
-    @mock.patch('reconn.scout.reconn_file')
-    def test_lock_reconn_file(self, mock_reconn_file):
-        file_obj = mock.Mock()
+    def setUp(self):
+        super(ReconnTargetsTestCase, self).setUp()
+        reconn_scout.register_reconn()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.file_paths = []
+        for name in ('a_console.log', 'b_console.log'):
+            file_path = os.path.join(self.tmp_dir, name)
+            with io.open(file_path, 'wb') as f:
+                f.write(b'line\n')
+            self.file_paths.append(file_path)
+        self.observer = mock.Mock(name='observer')
+        self._targets = reconn_scout._targets
+        reconn_scout._targets = {}
 
-        mock_file_lock = mock.Mock()
-        _reconn_file_lock = reconn_scout.file_lock
-        reconn_scout.file_lock = mock_file_lock
+    def tearDown(self):
+        for target in reconn_scout.get_targets():
+            target.close()
+        reconn_scout._targets = self._targets
+        shutil.rmtree(self.tmp_dir)
+        super(ReconnTargetsTestCase, self).tearDown()
 
-        reconn_scout.lock_reconn_file(file_obj)
+    def test_add_targets(self):
+        for file_path in self.file_paths:
+            reconn_scout.add_target(self.observer, file_path)
 
-        mock_file_lock.acquire.assert_called_once_with()
-        mock_reconn_file.assert_called_once_with(file_obj)
-        mock_file_lock.release.assert_called_once_with()
+        self.assertEqual(2, len(reconn_scout.get_targets()))
+        self.assertEqual(2, self.observer.schedule.call_count)
+        for call in self.observer.schedule.call_args_list:
+            self.assertEqual(self.tmp_dir, call[1]['path'])
 
-        reconn_scout.file_lock = _reconn_file_lock
+    def test_add_target_long_lines(self):
+        reconn_scout.CONF.set_override('max_line_bytes', 4)
+        reconn_scout.CONF.set_override('long_line_policy', 'split')
+        reconn_scout.CONF.set_override('cr_line_terminator', True)
+        for opt in ('max_line_bytes', 'long_line_policy',
+                    'cr_line_terminator'):
+            self.addCleanup(reconn_scout.CONF.clear_override, opt)
+        file_path = self.file_paths[0]
+        with io.open(file_path, 'wb') as f:
+            f.write(b'50%\r100%\rlong line\n')
 
-    @mock.patch('time.sleep')
-    @mock.patch('reconn.timeout.ReconnTimeout.is_timed_out')
+        target = reconn_scout.add_target(self.observer, file_path)
+
+        self.assertEqual([b'50%\n', b'100%\n', b'long\n', b' lin\n',
+                          b'e\n'], target.file.read_lines())
+        self.assertEqual(1, target.file.truncated_lines)
+
+    def test_add_same_target_twice(self):
+        target = reconn_scout.add_target(self.observer, self.file_paths[0])
+        self.assertIs(target, reconn_scout.add_target(self.observer,
+                                                      self.file_paths[0]))
+        self.assertEqual(1, len(reconn_scout.get_targets()))
+        self.observer.schedule.assert_called_once()
+
+    def test_add_target_missing_file(self):
+        self.assertRaises(IOError,
+                          reconn_scout.add_target,
+                          self.observer,
+                          os.path.join(self.tmp_dir, 'no_file.log'))
+        self.assertEqual([], reconn_scout.get_targets())
+
+    @ddt.data({'start_position': None, 'exp_lines': [b'line 1\n',
+                                                     b'line 2\n']},
+              {'start_position': ('beginning', 0),
+               'exp_lines': [b'line 1\n', b'line 2\n']},
+              {'start_position': ('end', 0), 'exp_lines': []},
+              {'start_position': ('offset', 7), 'exp_lines': [b'line 2\n']},
+              {'start_position': ('offset', 1024), 'exp_lines': []},
+              {'start_position': ('tail_bytes', 4), 'exp_lines': []},
+              {'start_position': ('tail_bytes', 7),
+               'exp_lines': [b'line 2\n']},
+              {'start_position': ('tail_bytes', 1024),
+               'exp_lines': [b'line 1\n', b'line 2\n']})
+    @ddt.unpack
+    def test_add_target_start_position(self, start_position, exp_lines):
+        file_path = self.file_paths[0]
+        with io.open(file_path, 'wb') as f:
+            f.write(b'line 1\nline 2\n')
+
+        target = reconn_scout.add_target(self.observer, file_path,
+                                         start_position=start_position)
+
+        self.assertEqual(exp_lines, self._read_all_lines(target))
+
+    def test_add_target_checkpoint_over_start_position(self):
+        mock_store = mock.Mock()
+        mock_store.get.return_value = (0, b'')
+        self._set_checkpoint_store(mock_store)
+
+        target = reconn_scout.add_target(self.observer, self.file_paths[0],
+                                         start_position=('end', 0))
+
+        self.assertEqual([b'line\n'], self._read_all_lines(target))
+
+    def test_add_target_resume_from_checkpoint(self):
+        file_path = self.file_paths[0]
+        stat = os.stat(file_path)
+        mock_store = mock.Mock()
+        mock_store.get.return_value = (2, b'li')
+        self._set_checkpoint_store(mock_store)
+
+        target = reconn_scout.add_target(self.observer, file_path)
+
+        mock_store.get.assert_called_once_with(file_path, stat.st_dev,
+                                               stat.st_ino)
+        self.assertEqual([b'line\n'], target.file.read_lines())
+
+    def test_add_target_checkpoint_beyond_file_size(self):
+        mock_store = mock.Mock()
+        mock_store.get.return_value = (1024, b'')
+        self._set_checkpoint_store(mock_store)
+
+        target = reconn_scout.add_target(self.observer, self.file_paths[0])
+
+        self.assertEqual(0, target.file.offset)
+
+    def test_remove_target_checkpoint(self):
+        mock_store = mock.Mock()
+        mock_store.get.return_value = None
+        self._set_checkpoint_store(mock_store)
+        target_a = reconn_scout.add_target(self.observer, self.file_paths[0])
+        target_b = reconn_scout.add_target(self.observer, self.file_paths[1])
+        target_a.file.read_lines()
+        target_b.exists = False
+
+        reconn_scout.remove_target(self.observer, target_a.file_path)
+        reconn_scout.remove_target(self.observer, target_b.file_path)
+
+        mock_store.update.assert_called_once_with(
+            target_a.file_path, target_a.dev, target_a.ino, 5, b'')
+        mock_store.remove.assert_called_once_with(target_b.file_path)
+
+    def _read_all_lines(self, target):
+        lines = []
+        while True:
+            batch = target.file.read_lines()
+            if batch is None:
+                return lines
+            lines.extend(batch)
+
+    def test_follow_truncation(self):
+        file_path = self.file_paths[0]
+        target = reconn_scout.add_target(self.observer, file_path)
+        self.assertEqual([b'line\n'], self._read_all_lines(target))
+        self.assertFalse(reconn_scout.follow_truncation(target))
+
+        # copytruncate
+        with io.open(file_path, 'wb') as f:
+            f.write(b'new\n')
+
+        self.assertTrue(reconn_scout.follow_truncation(target))
+        self.assertEqual([b'new\n'], self._read_all_lines(target))
+
+    def test_follow_rotation(self):
+        file_path = self.file_paths[0]
+        target = reconn_scout.add_target(self.observer, file_path)
+        old_file_obj = target.file
+        old_ino = target.ino
+        self.assertFalse(reconn_scout.follow_rotation(target))
+
+        os.rename(file_path, file_path + '.1')
+        with io.open(file_path + '.1', 'ab') as f:
+            f.write(b'written after rotation\n')
+        self.assertFalse(reconn_scout.follow_rotation(target))
+        self.assertEqual([b'line\n', b'written after rotation\n'],
+                         self._read_all_lines(target))
+
+        with io.open(file_path, 'wb') as f:
+            f.write(b'new\n')
+
+        self.assertTrue(reconn_scout.follow_rotation(target))
+        self.assertTrue(old_file_obj.file.closed)
+        self.assertNotEqual(old_ino, target.ino)
+        self.assertEqual([b'new\n'], self._read_all_lines(target))
+        self.assertFalse(reconn_scout.follow_rotation(target))
+
+    def _set_checkpoint_store(self, store):
+        _checkpoint_store = reconn_scout._checkpoint_store
+        reconn_scout._checkpoint_store = store
+
+        def _restore():
+            reconn_scout._checkpoint_store = _checkpoint_store
+        self.addCleanup(_restore)
+
+    def test_remove_done_targets(self):
+        target_a = reconn_scout.add_target(self.observer, self.file_paths[0])
+        target_b = reconn_scout.add_target(self.observer, self.file_paths[1])
+        target_a.end_reconn = True
+
+        self.assertEqual(1, reconn_scout.remove_done_targets(self.observer))
+
+        self.assertEqual([target_b], reconn_scout.get_targets())
+        self.assertTrue(target_a.file.file.closed)
+        self.assertFalse(target_b.file.file.closed)
+        self.observer.remove_handler_for_watch.assert_called_once()
+        self.observer.unschedule.assert_not_called()
+
+
+@ddt.ddt
+class GlobEventHandlerTestCase(test.TestCase):
+
+    def setUp(self):
+        super(GlobEventHandlerTestCase, self).setUp()
+        reconn_scout.register_reconn()
+        self.observer = mock.Mock(name='observer')
+        self.target_glob = '/tmp/instances/*/console.log'
+
+    @ddt.data({'event_type': 'created',
+               'src_path': '/tmp/instances/uuid1/console.log',
+               'dest_path': None,
+               'is_directory': False,
+               'exp_attach': '/tmp/instances/uuid1/console.log'},
+              {'event_type': 'created',
+               'src_path': '/tmp/instances/uuid1/disk.info',
+               'dest_path': None,
+               'is_directory': False,
+               'exp_attach': None},
+              {'event_type': 'created',
+               'src_path': '/tmp/instances/uuid1',
+               'dest_path': None,
+               'is_directory': True,
+               'exp_attach': None},
+              {'event_type': 'moved',
+               'src_path': '/tmp/instances/uuid1/console.log.tmp',
+               'dest_path': '/tmp/instances/uuid1/console.log',
+               'is_directory': False,
+               'exp_attach': '/tmp/instances/uuid1/console.log'})
+    @ddt.unpack
     @mock.patch('reconn.scout.lock_reconn_file')
-    def test_reconn_forever_when_end_reconn(self,
-                                            mock_lock_reconn_file,
-                                            mock_reconn_timeout_is_timed_out,
-                                            mock_time_sleep):
-        mock_watchdog_observer_obj = mock.Mock(
-            name='mock_watchdog_observer_obj')
+    @mock.patch('reconn.scout.add_target')
+    def test_attach_on_event(self, mock_add_target,
+                             mock_lock_reconn_file,
+                             event_type, src_path, dest_path,
+                             is_directory, exp_attach):
+        mock_target = mock.Mock()
+        mock_add_target.return_value = mock_target
+        event = mock.Mock()
+        event.event_type = event_type
+        event.src_path = src_path
+        event.dest_path = dest_path
+        event.is_directory = is_directory
+
+        handler = reconn_scout.GlobEventHandler(self.observer,
+                                                self.target_glob)
+        if event_type == 'created':
+            handler.on_created(event)
+        else:
+            handler.on_moved(event)
+
+        if exp_attach is None:
+            mock_add_target.assert_not_called()
+            mock_lock_reconn_file.assert_not_called()
+        else:
+            mock_add_target.assert_called_once_with(
+                self.observer, exp_attach,
+                timeout=reconn_scout.CONF.timeout * 60)
+            mock_lock_reconn_file.assert_called_once_with(mock_target)
+
+    @mock.patch('reconn.scout.lock_reconn_file')
+    @mock.patch('reconn.scout.add_target')
+    def test_attach_open_failure(self, mock_add_target,
+                                 mock_lock_reconn_file):
+        mock_add_target.side_effect = IOError
+        event = mock.Mock()
+        event.src_path = '/tmp/instances/uuid1/console.log'
+        event.is_directory = False
+
+        handler = reconn_scout.GlobEventHandler(self.observer,
+                                                self.target_glob)
+        handler.on_created(event)
+
+        mock_lock_reconn_file.assert_not_called()
+
+    @mock.patch('os.path.isdir')
+    def test_watch_target_glob(self, mock_isdir):
+        mock_isdir.return_value = True
+        self.assertTrue(reconn_scout.watch_target_glob(self.observer,
+                                                       self.target_glob))
+        args, kwargs = self.observer.schedule.call_args
+        self.assertIsInstance(args[0], reconn_scout.GlobEventHandler)
+        self.assertEqual('/tmp/instances', kwargs['path'])
+        self.assertTrue(kwargs['recursive'])
+
+    @mock.patch('os.path.isdir')
+    def test_watch_target_glob_no_dir(self, mock_isdir):
+        mock_isdir.return_value = False
+        self.assertFalse(reconn_scout.watch_target_glob(self.observer,
+                                                        self.target_glob))
+        self.observer.schedule.assert_not_called()
+
+
+@ddt.ddt
+class ReconnTestCase(test.TestCase):
+
+    def setUp(self):
+        super(ReconnTestCase, self).setUp()
+        reconn_scout.register_reconn()
+        self._targets = reconn_scout._targets
+        reconn_scout._targets = {}
+
+    def tearDown(self):
+        reconn_scout._targets = self._targets
+        super(ReconnTestCase, self).tearDown()
+
+    def _add_mock_target(self, file_path='/tmp/test_path/test_file.txt'):
         file_obj = mock.Mock()
+        target = reconn_scout.ReconnTarget(file_path, file_obj)
+        reconn_scout._targets[file_path] = target
+        return target
 
-        _end_reconn = reconn_scout.end_reconn
-        reconn_scout.end_reconn = True
-        _target_file_exists = reconn_scout.target_file_exists
-        reconn_scout.target_file_exists = True
+    @mock.patch('reconn.scout.LOG')
+    @mock.patch('reconn.action.create_survey_actions')
+    @mock.patch('reconn.utils.register_reconn_survey_action_groups')
+    @mock.patch('reconn.utils.register_configured_reconn_survey_groups')
+    @mock.patch('reconn.utils.oslo_logger_config_setup')
+    def test_init_reconn_invalid_message_format(self, mock_logger_setup,
+                                                mock_register_groups,
+                                                mock_register_actions,
+                                                mock_create_actions,
+                                                mock_log):
+        mock_register_actions.return_value = ['rmq_survey']
+        mock_create_actions.side_effect = ValueError(
+            "Message template {line does not render valid JSON")
 
-        mock_reconn_timeout_is_timed_out.return_value(False)
-        reconn_scout.reconn_forever(file_obj, mock_watchdog_observer_obj)
+        self.assertRaises(SystemExit, reconn_scout.init_reconn, [])
 
-        mock_watchdog_observer_obj.start.assert_called_once_with()
-        mock_lock_reconn_file.assert_called_once_with(file_obj)
-        mock_watchdog_observer_obj.stop.assert_called_once_with()
-        mock_watchdog_observer_obj.join.assert_called_once_with()
-        file_obj.close.assert_called_once_with()
+        mock_log.error.assert_called_once_with(
+            "Invalid message format of survey action: %s",
+            mock_create_actions.side_effect)
 
-        reconn_scout.end_reconn = _end_reconn
-        reconn_scout.target_file_exists = _target_file_exists
+    @mock.patch('reconn.scout.LOG')
+    @mock.patch('reconn.utils.create_survey_groups')
+    @mock.patch('reconn.action.create_survey_actions')
+    @mock.patch('reconn.utils.register_reconn_survey_action_groups')
+    @mock.patch('reconn.utils.register_configured_reconn_survey_groups')
+    @mock.patch('reconn.utils.oslo_logger_config_setup')
+    def test_init_reconn_invalid_survey_group(self, mock_logger_setup,
+                                              mock_register_groups,
+                                              mock_register_actions,
+                                              mock_create_actions,
+                                              mock_create_groups,
+                                              mock_log):
+        mock_register_actions.return_value = ['log_survey']
+        mock_create_groups.side_effect = ValueError(
+            "Multiline survey group test_survey_group requires an anchor")
 
-    @mock.patch('time.sleep')
-    @mock.patch('reconn.timeout.ReconnTimeout.is_timed_out')
+        self.assertRaises(SystemExit, reconn_scout.init_reconn, [])
+
+        mock_log.error.assert_called_once_with(
+            "Invalid survey group configuration: %s",
+            mock_create_groups.side_effect)
+
+    @mock.patch('reconn.scout.follow_rotation')
+    @mock.patch('reconn.scout.follow_truncation')
+    @mock.patch('reconn.scout.reconn_file')
+    def test_lock_reconn_file_rotated(self, mock_reconn_file,
+                                      mock_follow_truncation,
+                                      mock_follow_rotation):
+        target = reconn_scout.ReconnTarget('/tmp/test_path/test_file.txt',
+                                           mock.Mock())
+        mock_follow_rotation.return_value = True
+
+        reconn_scout.lock_reconn_file(target)
+
+        mock_follow_truncation.assert_called_once_with(target)
+        mock_follow_rotation.assert_called_once_with(target)
+        # Read rotated file till end and then new file
+        self.assertEqual(2, mock_reconn_file.call_count)
+
+    @mock.patch('reconn.scout.reconn_file')
+    def test_lock_reconn_file(self, mock_reconn_file):
+        target = reconn_scout.ReconnTarget('/tmp/test_path/test_file.txt',
+                                           mock.Mock())
+        mock_file_lock = mock.Mock()
+        target.lock = mock_file_lock
+
+        reconn_scout.lock_reconn_file(target)
+
+        mock_file_lock.acquire.assert_called_once_with()
+        mock_reconn_file.assert_called_once_with(target)
+        mock_file_lock.release.assert_called_once_with()
+
+    @ddt.data({'end_reconn': True, 'exists': True, 'timed_out': False},
+              {'end_reconn': False, 'exists': True, 'timed_out': True},
+              {'end_reconn': False, 'exists': False, 'timed_out': False})
+    @ddt.unpack
+    @mock.patch('reconn.scout._wakeup')
     @mock.patch('reconn.scout.lock_reconn_file')
-    def test_reconn_forever_when_reconn_timeout(
-            self,
-            mock_lock_reconn_file,
-            mock_reconn_timeout_is_timed_out,
-            mock_time_sleep):
+    def test_reconn_forever(self,
+                            mock_lock_reconn_file,
+                            mock_wakeup,
+                            end_reconn, exists, timed_out):
         mock_watchdog_observer_obj = mock.Mock(
             name='mock_watchdog_observer_obj')
-        file_obj = mock.Mock()
+        target = self._add_mock_target()
+        target.end_reconn = end_reconn
+        target.exists = exists
+        if timed_out:
+            target.deadline = reconn_timeout.monotonic() - 1
 
-        _end_reconn = reconn_scout.end_reconn
-        reconn_scout.end_reconn = False
-        _target_file_exists = reconn_scout.target_file_exists
-        reconn_scout.target_file_exists = True
-        mock_reconn_timeout_is_timed_out.return_value = True
-
-        reconn_scout.reconn_forever(file_obj, mock_watchdog_observer_obj)
+        reconn_scout.reconn_forever(mock_watchdog_observer_obj)
 
         mock_watchdog_observer_obj.start.assert_called_once_with()
-        mock_lock_reconn_file.assert_called_once_with(file_obj)
+        mock_lock_reconn_file.assert_called_once_with(target)
         mock_watchdog_observer_obj.stop.assert_called_once_with()
         mock_watchdog_observer_obj.join.assert_called_once_with()
-        file_obj.close.assert_called_once_with()
-
-        reconn_scout.end_reconn = _end_reconn
-        reconn_scout.target_file_exists = _target_file_exists
+        target.file.close.assert_called_once_with()
+        self.assertEqual([], reconn_scout.get_targets())
+        # Reconn over before any wait
+        mock_wakeup.wait.assert_not_called()
 
-    @mock.patch('time.sleep')
-    @mock.patch('reconn.timeout.ReconnTimeout.is_timed_out')
+    @mock.patch('reconn.scout._wakeup')
     @mock.patch('reconn.scout.lock_reconn_file')
-    def test_reconn_forever_when_target_file_exists(
-            self,
-            mock_lock_reconn_file,
-            mock_reconn_timeout_is_timed_out,
-            mock_time_sleep):
+    def test_reconn_forever_multiple_targets(self,
+                                             mock_lock_reconn_file,
+                                             mock_wakeup):
         mock_watchdog_observer_obj = mock.Mock(
             name='mock_watchdog_observer_obj')
-        file_obj = mock.Mock()
+        target_a = self._add_mock_target('/tmp/test_path/a.log')
+        target_b = self._add_mock_target('/tmp/test_path/b.log')
+        target_a.end_reconn = True
 
-        _end_reconn = reconn_scout.end_reconn
-        reconn_scout.end_reconn = False
-        _target_file_exists = reconn_scout.target_file_exists
-        reconn_scout.target_file_exists = False
+        def _wait(timeout):
+            # Target b ends while main thread is waiting
+            target_b.exists = False
+            return True
+        mock_wakeup.wait.side_effect = _wait
 
-        mock_reconn_timeout_is_timed_out.return_value = False
+        reconn_scout.reconn_forever(mock_watchdog_observer_obj)
 
-        reconn_scout.reconn_forever(file_obj, mock_watchdog_observer_obj)
-
-        mock_watchdog_observer_obj.start.assert_called_once_with()
-        mock_lock_reconn_file.assert_called_once_with(file_obj)
+        self.assertEqual(2, mock_lock_reconn_file.call_count)
+        target_a.file.close.assert_called_once_with()
+        target_b.file.close.assert_called_once_with()
         mock_watchdog_observer_obj.stop.assert_called_once_with()
-        mock_watchdog_observer_obj.join.assert_called_once_with()
-        file_obj.close.assert_called_once_with()
-
-        reconn_scout.end_reconn = _end_reconn
-        reconn_scout.target_file_exists = _target_file_exists
+        self.assertEqual(1, mock_wakeup.wait.call_count)
 
-    @ddt.data({'readline_side_effect': [''],
-               'exp_readline_count': 1,
-               'search_pattern_side_effect': [(None, None)],
-               'exp_search_pattern_count': 0,
+    @ddt.data({'read_block_side_effect': [None],
+               'partial_line': b'',
+               'exp_read_block_count': 1,
+               'match_side_effect': [[]],
+               'exp_match_count': 0,
+               'act_side_effect': [],
                'end_reconn_val': False
                },
-              {'readline_side_effect': ['line 1', ''],
-               'exp_readline_count': 2,
-               'search_pattern_side_effect': [(None, None)],
-               'exp_search_pattern_count': 1,
+              {'read_block_side_effect': [b'', None],
+               'partial_line': b'line 1',
+               'exp_read_block_count': 2,
+               'match_side_effect': [[]],
+               'exp_match_count': 1,
+               'act_side_effect': [],
                'end_reconn_val': False
                },
-              {'readline_side_effect': ['line 1', ''],
-               'exp_readline_count': 2,
-               'search_pattern_side_effect': [('test_survey_grp',
-                                               'line')],
-               'exp_search_pattern_count': 1,
+              {'read_block_side_effect': [b'', None],
+               'partial_line': b'line 1',
+               'exp_read_block_count': 2,
+               'match_side_effect': [[mock.Mock(max_matches=0)]],
+               'exp_match_count': 1,
+               'act_side_effect': [False],
                'end_reconn_val': False
                },
-              {'readline_side_effect': ['line with end reconn \n',
-                                        'line not read'],
-               'exp_readline_count': 1,
-               'search_pattern_side_effect': [('test_end_survey_grp',
-                                               'end')],
-               'exp_search_pattern_count': 1,
+              {'read_block_side_effect': [b'line 1\nline 2\n', None],
+               'partial_line': b'',
+               'exp_read_block_count': 2,
+               'match_side_effect': [[], [mock.Mock(max_matches=0),
+                                          mock.Mock(max_matches=0)]],
+               'exp_match_count': 2,
+               'act_side_effect': [False],
+               'end_reconn_val': False
+               },
+              {'read_block_side_effect': [b'line with end reconn \n'
+                                          b'line not read\n',
+                                          b'chunk not read\n'],
+               'partial_line': b'',
+               'exp_read_block_count': 1,
+               'match_side_effect': [[mock.Mock(max_matches=0)]],
+               'exp_match_count': 1,
+               'act_side_effect': [True],
                'end_reconn_val': True
                },
               )
     @ddt.unpack
-    @mock.patch('reconn.timeout.ReconnTimeout.is_timed_out')
-    @mock.patch('reconn.utils.is_pattern_to_end_reconn')
-    @mock.patch('reconn.utils.search_patterns')
-    @mock.patch('reconn.scout.act_on_pattern')
+    @mock.patch('reconn.scout.survey_matcher')
+    @mock.patch('reconn.scout.act_on_survey_groups')
     def test_reconn_file(self,
-                         mock_reconn_act_on_pattern,
-                         mock_reconn_search_patterns,
-                         mock_reconn_is_pattern_to_end_reconn,
-                         mock_reconn_timeout_is_timed_out,
-                         readline_side_effect,
-                         exp_readline_count,
-                         search_pattern_side_effect,
-                         exp_search_pattern_count,
+                         mock_act_on_survey_groups,
+                         mock_survey_matcher,
+                         read_block_side_effect,
+                         partial_line,
+                         exp_read_block_count,
+                         match_side_effect,
+                         exp_match_count,
+                         act_side_effect,
                          end_reconn_val):
         file_obj = mock.Mock()
+        target = reconn_scout.ReconnTarget('/tmp/test_path/test_file.txt',
+                                           file_obj)
+
+        file_obj.read_block.side_effect = read_block_side_effect
+        file_obj.partial_line = partial_line
+        mock_survey_matcher.prefilter_block.return_value = True
+        mock_survey_matcher.match_groups.side_effect = match_side_effect
+        mock_act_on_survey_groups.side_effect = act_side_effect
+
+        reconn_scout.reconn_file(target)
+
+        self.assertEqual(exp_read_block_count,
+                         file_obj.read_block.call_count)
+        self.assertEqual(len(act_side_effect),
+                         mock_act_on_survey_groups.call_count)
+        self.assertEqual(exp_match_count,
+                         mock_survey_matcher.match_groups.call_count)
+        self.assertEqual(end_reconn_val, target.end_reconn)
+
+    @mock.patch('reconn.scout.survey_matcher')
+    @mock.patch('reconn.scout.act_on_survey_groups')
+    def test_reconn_file_block_prefiltered(self,
+                                           mock_act_on_survey_groups,
+                                           mock_survey_matcher):
+        file_obj = mock.Mock()
+        file_obj.read_block.side_effect = [b'line 1\nline 2\n', None]
+        file_obj.partial_line = b''
+        target = reconn_scout.ReconnTarget('/tmp/test_path/test_file.txt',
+                                           file_obj)
+        mock_survey_matcher.prefilter_block.return_value = False
+
+        reconn_scout.reconn_file(target)
+
+        mock_survey_matcher.prefilter_block.assert_called_once_with(
+            b'line 1\nline 2\n')
+        mock_survey_matcher.match_groups.assert_not_called()
+        mock_act_on_survey_groups.assert_not_called()
+
+    @ddt.data('line', 'block')
+    def test_reconn_file_retire_survey_groups(
+            self, scan_mode):
+        reconn_scout.CONF.set_override('scan_mode', scan_mode)
+        self.addCleanup(reconn_scout.CONF.clear_override, 'scan_mode')
+        actions = [mock.Mock(), mock.Mock(), mock.Mock()]
+        survey_groups = tuple(
+            reconn_utils.SurveyGroup('group%d' % i, re.compile(pattern),
+                                     actions[i], False, i,
+                                     max_matches=max_matches)
+            for i, (pattern, max_matches) in enumerate(
+                [(b'stage 1', 1), (b'stage', 2), (b'login:', 1)]))
+        matcher = reconn_matcher.SurveyMatcher(
+            [(g.name, g.re_obj) for g in survey_groups], survey_groups)
+        for name, value in (('survey_groups', survey_groups),
+                            ('survey_matcher', matcher),
+                            ('_active_matchers', {})):
+            patcher = mock.patch.object(reconn_scout, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        file_obj = mock.Mock()
+        file_obj.read_block.side_effect = [
+            b'stage 1\nstage 1\nstage 2\nstage 3\nlogin:\n'
+            b'login:\n', None]
+        file_obj.partial_line = b''
+        target = reconn_scout.ReconnTarget('/tmp/test_path/test_file.txt',
+                                           file_obj)
+
+        reconn_scout.reconn_file(target)
+
+        self.assertEqual(1, actions[0].execute.call_count)
+        self.assertEqual([mock.call('group1', b'stage', u'stage 1\n',
+                                    context=u'stage 1\n', captures={}),
+                          mock.call('group1', b'stage', u'stage 2\n',
+                                    context=u'stage 2\n', captures={})],
+                         actions[1].execute.call_args_list)
+        actions[2].execute.assert_called_once_with(
+            'group2', b'login:', u'login:\n', context=u'login:\n',
+            captures={})
+        self.assertEqual(frozenset([0, 1, 2]), target.retired_groups)
+        self.assertTrue(target.end_reconn)
+
+    @ddt.data('line', 'block')
+    def test_reconn_file_context(self, scan_mode):
+        reconn_scout.CONF.set_override('scan_mode', scan_mode)
+        self.addCleanup(reconn_scout.CONF.clear_override, 'scan_mode')
+        actions = [mock.Mock(), mock.Mock()]
+        survey_groups = (
+            reconn_utils.SurveyGroup('group0', re.compile(b'error'),
+                                     actions[0], False, 0,
+                                     context_before=1, context_after=2),
+            reconn_utils.SurveyGroup('group1', re.compile(b'login:'),
+                                     actions[1], False, 1))
+        matcher = reconn_matcher.SurveyMatcher(
+            [(g.name, g.re_obj) for g in survey_groups], survey_groups)
+        for name, value in (('survey_groups', survey_groups),
+                            ('survey_matcher', matcher),
+                            ('_active_matchers', {}),
+                            ('_context_enabled', True)):
+            patcher = mock.patch.object(reconn_scout, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        file_obj = reconn_reader.LineReader(
+            io.BytesIO(b'line 1\nerror\nlogin:\nline 4\nerror\n'), 13,
+            window_lines=1)
+        target = reconn_scout.ReconnTarget('/tmp/test_path/test_file.txt',
+                                           file_obj)
+        calls = []
+        for action in actions:
+            action.execute.side_effect = (
+                lambda *args, **kwargs: calls.append((args[0],
+                                                      kwargs['context'])))
+
+        reconn_scout.reconn_file(target)
+        self.assertEqual([('group0', u'line 1\nerror\nlogin:\nline 4\n'),
+                          ('group1', u'login:\n')], calls)
+
+        reconn_scout.flush_context(target)
+        self.assertEqual(('group0', u'line 4\nerror\n'), calls[-1])
+
+    def test_checkpoint_held_context_match(self):
+        action = mock.Mock()
+        survey_groups = (
+            reconn_utils.SurveyGroup('group0', re.compile(b'error'),
+                                     action, False, 0, context_after=2),)
+        matcher = reconn_matcher.SurveyMatcher(
+            [(g.name, g.re_obj) for g in survey_groups], survey_groups)
+        mock_store = mock.Mock()
+        for name, value in (('survey_groups', survey_groups),
+                            ('survey_matcher', matcher),
+                            ('_active_matchers', {}),
+                            ('_context_enabled', True),
+                            ('_checkpoint_store', mock_store)):
+            patcher = mock.patch.object(reconn_scout, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        file_obj = reconn_reader.LineReader(
+            io.BytesIO(b'line 1\nline 2\nerror\nline 4\nli'), 14)
+        target = reconn_scout.ReconnTarget('/tmp/test_path/test_file.txt',
+                                           file_obj)
+        target.dev, target.ino = 1, 2
+
+        reconn_scout.reconn_file(target)
+        reconn_scout.checkpoint_target(target)
+
+        # Match of error is held for a line after it, read again on resume
+        action.execute.assert_not_called()
+        mock_store.update.assert_called_once_with(
+            target.file_path, 1, 2, 14, b'')
+
+        reconn_scout.flush_context(target)
+        reconn_scout.checkpoint_target(target)
+
+        action.execute.assert_called_once_with(
+            'group0', b'error', u'error\n', context=u'error\nline 4\n',
+            captures={})
+        mock_store.update.assert_called_with(
+            target.file_path, 1, 2, 29, b'li')
+
+    @ddt.data({'scan_mode': 'line', 'chunk_size': 1024},
+              {'scan_mode': 'block', 'chunk_size': 1024},
+              {'scan_mode': 'line', 'chunk_size': 16},
+              {'scan_mode': 'block', 'chunk_size': 5})
+    @ddt.unpack
+    def test_reconn_file_multiline(self,
+                                   scan_mode, chunk_size):
+        reconn_scout.CONF.set_override('scan_mode', scan_mode)
+        self.addCleanup(reconn_scout.CONF.clear_override, 'scan_mode')
+        actions = [mock.Mock(), mock.Mock()]
+        survey_groups = (
+            reconn_utils.SurveyGroup(
+                'traceback',
+                re.compile(b'^Traceback:\n(?:  .*\n)+\\w+Error: .*$',
+                           re.MULTILINE),
+                actions[0], False, 0, multiline=True, window_lines=4,
+                anchor=b'Error: '),
+            reconn_utils.SurveyGroup('error', re.compile(b'Error'),
+                                     actions[1], False, 1))
+        matcher = reconn_matcher.SurveyMatcher(
+            [(g.name, g.re_obj) for g in survey_groups[1:]],
+            survey_groups[1:])
+        for name, value in (
+                ('survey_groups', survey_groups),
+                ('survey_matcher', matcher),
+                ('multiline_matcher',
+                 reconn_matcher.MultilineMatcher(survey_groups[:1])),
+                ('_active_matchers', {})):
+            patcher = mock.patch.object(reconn_scout, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        file_obj = reconn_reader.LineReader(io.BytesIO(
+            b'Traceback:\n  line 1\n  line 2\nValueError: x\n'
+            b'Traceback:\n  a\n  b\n  c\n  d\nKeyError: y\n'
+            b'line\nTraceback:\n  e\nTypeError: z'), chunk_size,
+            window_lines=3)
+        target = reconn_scout.ReconnTarget('/tmp/test_path/test_file.txt',
+                                           file_obj)
+        calls = []
+        for action in actions:
+            action.execute.side_effect = (
+                lambda *args, **kwargs: calls.append((args[0], args[2])))
+
+        reconn_scout.reconn_file(target)
+
+        self.assertEqual(
+            [('error', u'ValueError: x\n'),
+             ('traceback', u'Traceback:\n  line 1\n  line 2\nValueError: x'),
+             ('error', u'KeyError: y\n'),
+             ('error', u'TypeError: z'),
+             ('traceback', u'Traceback:\n  e\nTypeError: z')], calls)
+
+    @ddt.data({'scan_mode': 'line', 'block_scannable': True,
+               'exp_block_scan': False},
+              {'scan_mode': 'block', 'block_scannable': True,
+               'exp_block_scan': True},
+              {'scan_mode': 'block', 'block_scannable': False,
+               'exp_block_scan': False})
+    @ddt.unpack
+    def test_match_block(self, scan_mode, block_scannable, exp_block_scan):
+        mock_survey_matcher = mock.Mock()
+        reconn_scout.CONF.set_override('scan_mode', scan_mode)
+        self.addCleanup(reconn_scout.CONF.clear_override, 'scan_mode')
+        survey_group = mock.Mock()
+        mock_survey_matcher.block_scannable = block_scannable
+        mock_survey_matcher.match_block.return_value = iter(
+            [(b'line 2\n', [survey_group], 7)])
+        mock_survey_matcher.match_groups.side_effect = [[], [survey_group]]
+
+        ret = list(reconn_scout.match_block(mock_survey_matcher,
+                                            b'line 1\nline 2\n'))
 
-        mock_reconn_is_pattern_to_end_reconn.return_value = end_reconn_val
-        mock_reconn_timeout_is_timed_out.return_value = False
-        file_obj.readline.side_effect = readline_side_effect
-        mock_reconn_search_patterns.side_effect = search_pattern_side_effect
+        self.assertEqual([(b'line 2\n', [survey_group], 7)], ret)
+        self.assertEqual(exp_block_scan,
+                         mock_survey_matcher.match_block.called)
+        self.assertEqual(not exp_block_scan,
+                         mock_survey_matcher.match_groups.called)
+
+    @ddt.data({'line': b'ubuntu login:\n',
+               'exp_line': u'ubuntu login:\n'},
+              {'line': b'\xc3\xa9\xff login:\n',
+               'exp_line': u'\xe9\ufffd login:\n'})
+    @ddt.unpack
+    def test_act_on_survey_groups(self, line, exp_line):
+        survey_group = mock.Mock(is_end=False, re_obj=re.compile(b'login:'))
+        survey_group.name = 'test_survey_grp'
+        survey_group.pattern = 'login:'
+
+        self.assertFalse(reconn_scout.act_on_survey_groups([survey_group],
+                                                           line))
+
+        survey_group.action.execute.assert_called_once_with(
+            'test_survey_grp', 'login:', exp_line, context=exp_line,
+            captures={})
+
+    def test_act_on_survey_groups_end_reconn(self):
+        end_survey_group = mock.Mock(is_end=True,
+                                     re_obj=re.compile(b'login:'))
+        survey_group = mock.Mock(
+            is_end=False, re_obj=re.compile(b'(?P<prompt>\\w+):(?P<x>x)?'))
+
+        self.assertTrue(reconn_scout.act_on_survey_groups(
+            [end_survey_group, survey_group], b'login:\n'))
+
+        end_survey_group.action.execute.assert_called_once_with(
+            end_survey_group.name, end_survey_group.pattern, u'login:\n',
+            context=u'login:\n', captures={})
+        survey_group.action.execute.assert_called_once_with(
+            survey_group.name, survey_group.pattern, u'login:\n',
+            context=u'login:\n', captures={'prompt': u'login'})
+
+    @mock.patch('reconn.scout._wakeup')
+    @mock.patch('reconn.scout.attach_target_glob_files')
+    @mock.patch('reconn.scout.lock_reconn_file')
+    def test_reconn_forever_target_glob(self,
+                                        mock_lock_reconn_file,
+                                        mock_attach_target_glob_files,
+                                        mock_wakeup):
+        mock_watchdog_observer_obj = mock.Mock(
+            name='mock_watchdog_observer_obj')
+        target_glob = '/tmp/test_path/*.log'
+        # No target files to begin with. Reconn stays till interrupted.
+        mock_wakeup.wait.side_effect = [False, False, False,
+                                        KeyboardInterrupt]
+
+        reconn_scout.reconn_forever(mock_watchdog_observer_obj,
+                                    target_glob=target_glob)
+
+        mock_attach_target_glob_files.assert_called_once_with(
+            mock_watchdog_observer_obj, target_glob)
+        self.assertEqual(4, mock_wakeup.wait.call_count)
+        mock_watchdog_observer_obj.stop.assert_called_once_with()
+
+    @mock.patch('reconn.scout._wakeup')
+    @mock.patch('reconn.scout.lock_reconn_file')
+    def test_reconn_forever_ready(self, mock_lock_reconn_file,
+                                  mock_wakeup):
+        mock_observer = mock.Mock()
+        target = self._add_mock_target()
+        target.end_reconn = True
+        ready = []
+
+        def _lock_reconn_file(target):
+            # Initial read happens once observer is watching
+            ready.append(reconn_scout.wait_ready(0))
+        mock_lock_reconn_file.side_effect = _lock_reconn_file
+
+        reconn_scout.reconn_forever(mock_observer)
+
+        self.assertEqual([True], ready)
+        self.assertFalse(reconn_scout.wait_ready(0))
+
+    def test_notify_reconn_done(self):
+        target = self._add_mock_target()
+        reconn_scout._wakeup.clear()
+
+        reconn_scout.notify_reconn_done(target)
+
+        self.assertTrue(reconn_scout._wakeup.is_set())
+        self.assertIsNotNone(reconn_scout._done_at)
+        reconn_scout._wakeup.clear()
+        reconn_scout._done_at = None
+
+    def test_get_wakeup_timeout(self):
+        self.assertEqual(reconn_scout._MAX_WAKEUP_INTERVAL,
+                         reconn_scout.get_wakeup_timeout())
+        reconn_scout.register_reconn()
+        with mock.patch('reconn.scout._checkpoint_store', mock.Mock()):
+            self.assertEqual(reconn_scout.CONF.checkpoint_interval,
+                             reconn_scout.get_wakeup_timeout())
+
+    def test_reconn_target_timer(self):
+        reconn_scout._wakeup.clear()
+        target = reconn_scout.ReconnTarget('/tmp/test_path/test_file.txt',
+                                           mock.Mock(), timeout=0.05)
+        self.assertFalse(target.is_done())
+
+        # Main thread is woken up, without any event on target file
+        self.assertTrue(reconn_scout._wakeup.wait(5))
+        self.assertTrue(target.is_timed_out())
+        reconn_scout._wakeup.clear()
+
+    def test_reconn_target_close_cancels_timer(self):
+        target = reconn_scout.ReconnTarget('/tmp/test_path/test_file.txt',
+                                           mock.Mock(), timeout=600)
+        target.close()
+        self.assertTrue(target.timer.cancelled)
+
+    def test_reconn_target_timeout(self):
+        target = reconn_scout.ReconnTarget('/tmp/test_path/test_file.txt',
+                                           mock.Mock(), timeout=0)
+        self.assertTrue(target.is_timed_out())
+        self.assertTrue(target.is_done())
+        target = reconn_scout.ReconnTarget('/tmp/test_path/test_file.txt',
+                                           mock.Mock(), timeout=600)
+        self.assertFalse(target.is_done())
+
+    @mock.patch('reconn.scout.reconn_file')
+    def test_lock_reconn_file_closed_target(self, mock_reconn_file):
+        target = reconn_scout.ReconnTarget('/tmp/test_path/test_file.txt',
+                                           mock.Mock())
+        target.close()
+
+        reconn_scout.lock_reconn_file(target)
+
+        mock_reconn_file.assert_not_called()
+
+
+class ReconnReaderTestCase(test.TestCase):
+
+    def setUp(self):
+        super(ReconnReaderTestCase, self).setUp()
+        self.reader = reconn_scout.ReconnReader()
+        self.target = reconn_scout.ReconnTarget(
+            '/tmp/test_path/test_file.txt', mock.Mock())
+
+    def _run_reader(self, drained):
+        self.reader.start()
+        self.assertTrue(drained.wait(5))
+        self.reader.stop()
+        self.reader.join(5)
+        self.assertFalse(self.reader.is_alive())
+
+    @mock.patch('reconn.scout.lock_reconn_file')
+    def test_events_coalesced(self, mock_lock_reconn_file):
+        drained = threading.Event()
+        mock_lock_reconn_file.side_effect = lambda target: drained.set()
+        for i in range(10):
+            self.reader.mark_dirty(self.target)
+
+        self._run_reader(drained)
+
+        mock_lock_reconn_file.assert_called_once_with(self.target)
+        self.assertEqual(10, self.reader.events_received)
+        self.assertEqual(1, self.reader.drains)
+
+    @mock.patch('reconn.scout.lock_reconn_file')
+    def test_event_during_drain(self, mock_lock_reconn_file):
+        drained = threading.Event()
+
+        def _lock_reconn_file(target):
+            if mock_lock_reconn_file.call_count == 1:
+                # Write while target is being drained
+                self.reader.mark_dirty(target)
+            else:
+                drained.set()
+        mock_lock_reconn_file.side_effect = _lock_reconn_file
+        self.reader.mark_dirty(self.target)
+
+        self._run_reader(drained)
+
+        self.assertEqual(2, mock_lock_reconn_file.call_count)
+        self.assertEqual(2, self.reader.drains)
+
+    @mock.patch('reconn.scout.lock_reconn_file')
+    def test_drain_failure(self, mock_lock_reconn_file):
+        other_target = reconn_scout.ReconnTarget(
+            '/tmp/test_path/other_file.txt', mock.Mock())
+        drained = threading.Event()
+
+        def _lock_reconn_file(target):
+            if target is self.target:
+                raise IOError('read failed')
+            drained.set()
+        mock_lock_reconn_file.side_effect = _lock_reconn_file
+        self.reader.mark_dirty(self.target)
+        self.reader.mark_dirty(other_target)
+
+        self._run_reader(drained)
+
+        self.assertEqual(2, self.reader.drains)
+
+    @mock.patch('reconn.scout.lock_reconn_file')
+    def test_done_target_not_drained(self, mock_lock_reconn_file):
+        self.target.end_reconn = True
+        self.reader.mark_dirty(self.target)
+        self.reader.start()
+        self.reader.stop()
+        self.reader.join(5)
+
+        mock_lock_reconn_file.assert_not_called()
+        self.assertEqual(0, self.reader.drains)
+
+    @mock.patch('reconn.scout.lock_reconn_file')
+    def test_drain_target(self, mock_lock_reconn_file):
+        reconn_scout.drain_target(self.target)
+        mock_lock_reconn_file.assert_called_once_with(self.target)
 
-        reconn_scout.reconn_file(file_obj)
+        mock_lock_reconn_file.reset_mock()
+        mock_reader = mock.Mock()
+        with mock.patch('reconn.scout._reader', mock_reader):
+            reconn_scout.drain_target(self.target)
 
-        self.assertEqual(exp_readline_count,
-                         file_obj.readline.call_count)
-        self.assertEqual(exp_search_pattern_count,
-                         mock_reconn_act_on_pattern.call_count)
-        self.assertEqual(exp_search_pattern_count,
-                         mock_reconn_search_patterns.call_count)
+        mock_reader.mark_dirty.assert_called_once_with(self.target)
+        mock_lock_reconn_file.assert_not_called()
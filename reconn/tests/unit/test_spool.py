@@ -0,0 +1,134 @@
+import io
+import os
+import shutil
+import tempfile
+
+import mock
+
+from reconn import test
+from reconn import spool as reconn_spool
+
+
+class SpoolTestCase(test.TestCase):
+
+    def setUp(self):
+        super(SpoolTestCase, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.spool_dir = os.path.join(self.tmp_dir, 'spool')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        super(SpoolTestCase, self).tearDown()
+
+    def _spool(self, max_bytes=1024 * 1024, **kwargs):
+        spool = reconn_spool.Spool(self.spool_dir, max_bytes, **kwargs)
+        self.addCleanup(spool.close)
+        return spool
+
+    def _segments(self):
+        return sorted(name for name in os.listdir(self.spool_dir)
+                      if name.endswith('.seg'))
+
+    def _read_all(self, spool):
+        items = []
+        while True:
+            item = spool.read()
+            if item is None:
+                return items
+            items.append(item)
+
+    def test_append_read_confirm(self):
+        spool = self._spool(segment_bytes=40)
+        for i in range(5):
+            self.assertEqual(i, spool.append(float(i), u'msg %d \xe9' % i))
+        self.assertEqual(5, len(spool))
+        self.assertEqual(['spool.0.seg', 'spool.2.seg', 'spool.4.seg'],
+                         self._segments())
+
+        items = self._read_all(spool)
+
+        self.assertEqual([(float(i), u'msg %d \xe9' % i, i)
+                          for i in range(5)], items)
+        self.assertEqual(0, len(spool))
+        self.assertEqual(5, spool.pending)
+        # Segments are removed once all their messages are confirmed
+        for seq in (1, 2, 0):
+            spool.confirm(seq)
+        self.assertEqual(['spool.2.seg', 'spool.4.seg'], self._segments())
+        for seq in (3, 4):
+            spool.confirm(seq)
+        self.assertEqual([], self._segments())
+        self.assertEqual(0, spool.pending)
+        self.assertEqual(0, spool.size)
+
+    def test_max_bytes(self):
+        spool = self._spool(max_bytes=50)
+
+        self.assertEqual(0, spool.append(0.0, u'a' * 20))
+        self.assertIsNone(spool.append(0.0, u'b' * 20))
+        self.assertEqual(1, len(spool))
+
+    def test_reopen(self):
+        spool = self._spool()
+        for i in range(4):
+            spool.append(0.0, u'msg %d' % i)
+        spool.read()
+        spool.read()
+        spool.confirm(0)
+        spool.close()
+
+        spool = self._spool()
+
+        # Message read but not confirmed is read again
+        self.assertEqual([u'msg 1', u'msg 2', u'msg 3'],
+                         [msg for _, msg, _ in self._read_all(spool)])
+        self.assertEqual(4, spool.append(0.0, u'msg 4'))
+
+    def test_reopen_truncates_partial_record(self):
+        spool = self._spool()
+        spool.append(0.0, u'msg 0')
+        spool.close()
+        with io.open(os.path.join(self.spool_dir, 'spool.0.seg'),
+                     'ab') as f:
+            f.write(b'\0\0\0')
+
+        spool = self._spool()
+
+        self.assertEqual([u'msg 0'],
+                         [msg for _, msg, _ in self._read_all(spool)])
+        self.assertEqual(1, spool.append(0.0, u'msg 1'))
+
+    def test_fsync_batch(self):
+        spool = self._spool(fsync_batch=3)
+        with mock.patch.object(reconn_spool.os, 'fsync') as mock_fsync:
+            for i in range(7):
+                spool.append(0.0, u'msg')
+            self.assertEqual(2, mock_fsync.call_count)
+            spool.sync()
+            self.assertEqual(3, mock_fsync.call_count)
+
+    def test_prepend(self):
+        spool = self._spool()
+        for i in range(3):
+            spool.append(0.0, u'spooled %d' % i)
+        spool.read()
+        spool.confirm(0)
+
+        self.assertEqual(2, spool.prepend([(0.0, u'held 0'),
+                                           (0.0, u'held 1')]))
+        spool.close()
+
+        spool = self._spool()
+        self.assertEqual([u'held 0', u'held 1', u'spooled 1', u'spooled 2'],
+                         [msg for _, msg, _ in self._read_all(spool)])
+        self.assertEqual(['spool.-1.seg', 'spool.1.seg'], self._segments())
+
+    def test_prepend_max_bytes(self):
+        spool = self._spool(max_bytes=60)
+        spool.append(0.0, u'spooled')
+
+        # Oldest messages are not spooled when spool is full
+        self.assertEqual(1, spool.prepend([(0.0, u'held 0' * 4),
+                                           (0.0, u'held 1')]))
+        self.assertEqual([u'held 1', u'spooled'],
+                         [msg for _, msg, _ in self._read_all(spool)])
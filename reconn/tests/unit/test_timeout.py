@@ -0,0 +1,70 @@
+import threading
+
+import mock
+
+from reconn import test
+from reconn import timeout as reconn_timeout
+
+
+class TimerServiceTestCase(test.TestCase):
+
+    def setUp(self):
+        super(TimerServiceTestCase, self).setUp()
+        self.service = reconn_timeout.TimerService()
+        self.addCleanup(self.service.stop)
+
+    def test_timers_fire_in_deadline_order(self):
+        fired = []
+        done = threading.Event()
+        self.service.call_later(0.3, done.set)
+        self.service.call_later(0.2, fired.append, 'b')
+        self.service.call_later(0.1, fired.append, 'a')
+        # Earlier deadline scheduled after service thread is waiting
+        self.service.call_later(0, fired.append, 'first')
+
+        self.assertTrue(done.wait(5))
+        self.assertEqual(['first', 'a', 'b'], fired)
+        self.assertEqual(0, len(self.service))
+
+    def test_cancel(self):
+        fired = []
+        done = threading.Event()
+        timer = self.service.call_later(0.05, fired.append, 'cancelled')
+        self.service.call_later(0.1, done.set)
+        timer.cancel()
+
+        self.assertTrue(done.wait(5))
+        self.assertEqual([], fired)
+        self.assertTrue(timer.cancelled)
+
+    def test_cancel_compacts_heap(self):
+        timers = [self.service.call_later(600, mock.Mock())
+                  for i in range(10)]
+        for timer in timers[:6]:
+            timer.cancel()
+
+        self.assertEqual(4, len(self.service))
+        self.assertEqual(4, len(self.service._heap))
+
+    def test_cancel_fired_timer(self):
+        done = threading.Event()
+        timer = self.service.call_later(0, done.set)
+        self.assertTrue(done.wait(5))
+
+        timer.cancel()
+
+        self.assertFalse(timer.cancelled)
+        self.assertEqual(0, len(self.service))
+
+    def test_callback_failure(self):
+        done = threading.Event()
+        self.service.call_later(0, mock.Mock(side_effect=Exception('fail')))
+        self.service.call_later(0.05, done.set)
+
+        self.assertTrue(done.wait(5))
+
+    def test_remaining(self):
+        timer = self.service.call_later(600, mock.Mock())
+        self.assertGreater(timer.remaining(), 590)
+        timer = self.service.call_later(-1, mock.Mock())
+        self.assertEqual(0, timer.remaining())
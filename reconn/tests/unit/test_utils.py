@@ -2,6 +2,7 @@ import mock
 import ddt
 import copy
 import logging as py_logging
+import re
 
 from reconn import test
 from reconn import utils as reconn_utils
@@ -30,21 +31,40 @@ class ReconnUtilTestCase(test.TestCase):
     def test_reconn_opts_registration(self, oslo_log_register_options):
         CONF = reconn_utils.CONF
         reconn_utils.register_reconn_opts()
-        valid_reconn_opts = ['target_file', 'timeout',
+        valid_reconn_opts = ['target_file', 'target_files',
+                             'target_glob', 'timeout', 'timeout_seconds',
                              'survey_action_message_format',
-                             'msg_user_data', 'end_reconn',
-                             'survey_group']
+                             'msg_user_data', 'read_chunk_size',
+                             'max_line_bytes', 'long_line_policy',
+                             'cr_line_terminator',
+                             'target_encoding', 'target_encoding_errors',
+                             'match_mode', 'scan_mode',
+                             'notification_engine',
+                             'start_position',
+                             'checkpoint_file', 'checkpoint_interval',
+                             'end_reconn', 'survey_group']
         for opt in valid_reconn_opts:
             self.assertIn(opt, CONF)
 
         oslo_log_register_options.assert_called_once_with(CONF)
 
+    def test_checkpoint_interval_min(self):
+        CONF = reconn_utils.CONF
+        reconn_utils.register_reconn_opts()
+
+        # Main thread would wake up to save checkpoints without waiting
+        self.assertRaises(ValueError, CONF.set_override,
+                          'checkpoint_interval', 0)
+
     def test_configured_reconn_survey_groups_opts_registration(self):
         CONF = reconn_utils.CONF
         reconn_utils.register_reconn_opts()
         CONF.survey_group = 'test_survey_group'
         reconn_utils.register_configured_reconn_survey_groups()
-        valid_survey_group_opts = ['pattern', 'name', 'success', 'failure']
+        valid_survey_group_opts = ['pattern', 'name', 'success', 'failure',
+                                   'max_matches', 'context_before',
+                                   'context_after', 'multiline',
+                                   'window_lines', 'anchor']
         for opt in CONF.test_survey_group:
             self.assertIn(opt, valid_survey_group_opts)
 
@@ -99,43 +119,96 @@ class ReconnUtilTestCase(test.TestCase):
                                         'queue_name',
                                         'routing_key',
                                         'rmq_message_format',
-                                        'rmq_msg_user_data']
+                                        'rmq_msg_user_data',
+                                        'rmq_queue_size',
+                                        'rmq_overflow_policy',
+                                        'rmq_confirm_window',
+                                        'rmq_publish_retries',
+                                        'rmq_batch_messages',
+                                        'rmq_batch_size',
+                                        'rmq_batch_linger_ms',
+                                        'rmq_spool_dir',
+                                        'rmq_spool_max_mb',
+                                        'rmq_spool_fsync_batch']
         reconn_utils.register_reconn_survey_action_groups()
         for opt in CONF.rmq_survey:
             self.assertIn(opt, valid_rmq_survey_action_opts)
 
-    def test_re_patterns_obj_creation(self):
+    def test_create_survey_groups(self):
         CONF = reconn_utils.CONF
         reconn_utils.register_reconn_opts()
-        CONF.survey_group = 'test_survey_group1, test_survey_group2'
+        CONF.survey_group = 'test_survey_group1, end_reconn_survey_group'
+        CONF.end_reconn = 'end_reconn_survey_group'
         reconn_utils.register_configured_reconn_survey_groups()
         CONF.test_survey_group1.pattern = 'pattern1'
-        CONF.test_survey_group2.pattern = 'pattern2'
-        re_objs = reconn_utils.create_re_objs()
-        self.assertEqual(2, len(re_objs))
-        for survey_grp_name, re_obj in re_objs:
-            self.assertIn(survey_grp_name, ['test_survey_group1',
-                                            'test_survey_group2'])
-            if survey_grp_name == 'test_survey_group1':
-                self.assertEqual('pattern1', re_obj.pattern)
-            else:
-                self.assertEqual('pattern2', re_obj.pattern)
-
-    @ddt.data({'line': 'Line with matching pattern',
-               'exp_return': ('test_survey_group', 'matching pattern')},
-              {'line': 'Line without matching any pattern',
-               'exp_return': (None, None)})
+        CONF.test_survey_group1.success = 'rmq_survey'
+        CONF.end_reconn_survey_group.pattern = 'end pattern'
+        CONF.end_reconn_survey_group.max_matches = 1
+        survey_actions = {'log_survey': mock.Mock(), 'rmq_survey': mock.Mock()}
+
+        survey_groups = reconn_utils.create_survey_groups(survey_actions.get)
+
+        self.assertEqual(2, len(survey_groups))
+        survey_group, end_survey_group = survey_groups
+        self.assertEqual('test_survey_group1', survey_group.name)
+        self.assertEqual('pattern1', survey_group.pattern)
+        self.assertEqual(b'pattern1', survey_group.re_obj.pattern)
+        self.assertIs(survey_actions['rmq_survey'], survey_group.action)
+        self.assertFalse(survey_group.is_end)
+        self.assertEqual(0, survey_group.index)
+        self.assertEqual(0, survey_group.max_matches)
+        self.assertEqual('end_reconn_survey_group', end_survey_group.name)
+        self.assertIs(survey_actions['log_survey'], end_survey_group.action)
+        self.assertTrue(end_survey_group.is_end)
+        self.assertEqual(1, end_survey_group.index)
+        self.assertEqual(1, end_survey_group.max_matches)
+        self.assertRaises(AttributeError, setattr, survey_group, 'is_end',
+                          True)
+
+    @ddt.data({'pattern': r'Traceback.*\n(  .*\n)+\w+Error: .*',
+               'anchor': None, 'exp_anchor': b'Error: '},
+              {'pattern': r'Traceback.*\n(  .*\n)+\w+Error: .*',
+               'anchor': 'Error', 'exp_anchor': b'Error'},
+              {'pattern': r'panic\n\w+', 'anchor': None,
+               'exp_anchor': None})
     @ddt.unpack
-    def test_search_patterns(self, line, exp_return):
+    def test_create_multiline_survey_group(self, pattern, anchor,
+                                           exp_anchor):
         CONF = reconn_utils.CONF
         reconn_utils.register_reconn_opts()
-        CONF.survey_group = 'test_survey_group'
+        CONF.survey_group = 'multiline_survey_group'
+        CONF.end_reconn = None
         reconn_utils.register_configured_reconn_survey_groups()
-        CONF.test_survey_group.pattern = 'matching pattern'
-        re_objs = reconn_utils.create_re_objs()
+        CONF.multiline_survey_group.pattern = pattern
+        CONF.multiline_survey_group.multiline = True
+        CONF.multiline_survey_group.window_lines = 10
+        CONF.multiline_survey_group.anchor = anchor
 
-        ret_value = reconn_utils.search_patterns(re_objs, line)
-        self.assertEqual(exp_return, ret_value)
+        if exp_anchor is None:
+            self.assertRaises(ValueError, reconn_utils.create_survey_groups,
+                              mock.Mock())
+            return
+        survey_group, = reconn_utils.create_survey_groups(mock.Mock())
+
+        self.assertTrue(survey_group.multiline)
+        self.assertEqual(10, survey_group.window_lines)
+        self.assertEqual(exp_anchor, survey_group.anchor)
+        self.assertTrue(survey_group.re_obj.flags & re.MULTILINE)
+
+    @ddt.data({'pattern': u'caf\xe9', 'encoding': 'utf-8',
+               'exp_pattern': b'caf\xc3\xa9'},
+              {'pattern': u'caf\xe9', 'encoding': 'latin-1',
+               'exp_pattern': b'caf\xe9'},
+              {'pattern': b'login:', 'encoding': 'utf-8',
+               'exp_pattern': b'login:'})
+    @ddt.unpack
+    def test_encode_pattern(self, pattern, encoding, exp_pattern):
+        CONF = reconn_utils.CONF
+        reconn_utils.register_reconn_opts()
+        CONF.set_override('target_encoding', encoding)
+        self.addCleanup(CONF.clear_override, 'target_encoding')
+
+        self.assertEqual(exp_pattern, reconn_utils.encode_pattern(pattern))
 
     @ddt.data({'line': 'Matching reconn end pattern',
                'exp_return': 'end pattern'},
@@ -152,46 +225,82 @@ class ReconnUtilTestCase(test.TestCase):
         ret_value = reconn_utils.search_end_reconn_pattern(line)
         self.assertEqual(exp_return, ret_value)
 
-    @ddt.data({'pattern': 'pattern1', 'exp_return': False},
-              {'pattern': 'end pattern', 'exp_return': True})
+    @ddt.data({'target_file': '/tmp/a.log', 'target_files': [],
+               'exp_target_files': ['/tmp/a.log']},
+              {'target_file': None, 'target_files': ['/tmp/a.log',
+                                                     ' /tmp/b.log'],
+               'exp_target_files': ['/tmp/a.log', '/tmp/b.log']},
+              {'target_file': '/tmp/a.log', 'target_files': ['/tmp/a.log',
+                                                             '/tmp/b.log'],
+               'exp_target_files': ['/tmp/a.log', '/tmp/b.log']},
+              {'target_file': None, 'target_files': [],
+               'exp_target_files': []})
     @ddt.unpack
-    def test_is_pattern_to_end_reconn(self, pattern, exp_return):
+    def test_get_reconn_target_files(self, target_file, target_files,
+                                     exp_target_files):
         CONF = reconn_utils.CONF
         reconn_utils.register_reconn_opts()
-        CONF.survey_group = 'test_survey_group, end_reconn_survey_group'
-        CONF.end_reconn = 'end_reconn_survey_group'
-        reconn_utils.register_configured_reconn_survey_groups()
-        CONF.end_reconn_survey_group.pattern = 'end pattern'
+        CONF.set_override('target_file', target_file)
+        CONF.set_override('target_files', target_files)
+        self.assertEqual(exp_target_files,
+                         reconn_utils.get_reconn_target_files())
+        CONF.clear_override('target_file')
+        CONF.clear_override('target_files')
 
-        ret_val = reconn_utils.is_pattern_to_end_reconn(pattern)
-        self.assertEqual(exp_return, ret_val)
-
-    @ddt.data({'pattern': 'pattern1', 'exp_return': False})
+    @ddt.data({'target_glob': '/var/lib/nova/instances/*/console.log',
+               'exp_return': ('/var/lib/nova/instances', True)},
+              {'target_glob': '/var/log/reconn/*.log',
+               'exp_return': ('/var/log/reconn', False)},
+              {'target_glob': '/var/log/reconn/console.log',
+               'exp_return': ('/var/log/reconn', False)},
+              {'target_glob': '/*/console.log',
+               'exp_return': ('/', True)})
     @ddt.unpack
-    def test_is_pattern_to_end_reconn_when_end_reconn_is_none(self,
-                                                              pattern,
-                                                              exp_return):
-        """test is_pattern_to_end_reconn when end_reconn is None"""
-        CONF = reconn_utils.CONF
-        reconn_utils.register_reconn_opts()
-        CONF.survey_group = 'test_survey_group'
-        CONF.end_reconn = None
-        reconn_utils.register_configured_reconn_survey_groups()
+    def test_get_target_glob_base_dir(self, target_glob, exp_return):
+        self.assertEqual(exp_return,
+                         reconn_utils.get_target_glob_base_dir(target_glob))
 
-        ret_val = reconn_utils.is_pattern_to_end_reconn(pattern)
-        self.assertEqual(exp_return, ret_val)
+    @ddt.data({'file_path': '/var/lib/nova/instances/uuid1/console.log',
+               'exp_return': True},
+              {'file_path': '/var/lib/nova/instances/uuid1/disk',
+               'exp_return': False},
+              {'file_path': '/var/lib/nova/instances/a/b/console.log',
+               'exp_return': False},
+              {'file_path': '/var/lib/nova/instances/console.log',
+               'exp_return': False})
+    @ddt.unpack
+    def test_match_target_glob(self, file_path, exp_return):
+        target_glob = '/var/lib/nova/instances/*/console.log'
+        self.assertEqual(exp_return,
+                         reconn_utils.match_target_glob(file_path,
+                                                        target_glob))
 
-    @ddt.data({'pattern': 'pattern1', 'exp_act_name': 'log_survey'},
-              {'pattern': 'patternxyz', 'exp_act_name': None})
+    @ddt.data({'timeout': 20, 'timeout_seconds': None, 'exp_return': 1200},
+              {'timeout': 20, 'timeout_seconds': 0.5, 'exp_return': 0.5})
     @ddt.unpack
-    def test_get_survey_success_action_name(self, pattern, exp_act_name):
+    def test_get_reconn_timeout(self, timeout, timeout_seconds, exp_return):
         CONF = reconn_utils.CONF
         reconn_utils.register_reconn_opts()
-        CONF.survey_group = 'test_survey_group1, test_survey_group2'
-        reconn_utils.register_configured_reconn_survey_groups()
-        CONF.test_survey_group1.pattern = 'pattern1'
-        CONF.test_survey_group2.pattern = 'pattern2'
-        CONF.test_survey_group1.success = 'log_survey'
-        CONF.test_survey_group2.success = 'rmq_survey'
-        ret_action_name = reconn_utils.get_survey_success_action_name(pattern)
-        self.assertEqual(exp_act_name, ret_action_name)
+        CONF.set_override('timeout', timeout)
+        CONF.set_override('timeout_seconds', timeout_seconds)
+        self.assertEqual(exp_return, reconn_utils.get_reconn_timeout())
+        CONF.clear_override('timeout')
+        CONF.clear_override('timeout_seconds')
+
+    @ddt.data({'start_position': 'beginning', 'exp_return': ('beginning', 0)},
+              {'start_position': 'end', 'exp_return': ('end', 0)},
+              {'start_position': 'offset:1024',
+               'exp_return': ('offset', 1024)},
+              {'start_position': ' tail_bytes:10 ',
+               'exp_return': ('tail_bytes', 10)})
+    @ddt.unpack
+    def test_parse_start_position(self, start_position, exp_return):
+        self.assertEqual(exp_return,
+                         reconn_utils.parse_start_position(start_position))
+
+    @ddt.data('middle', 'offset', 'offset:', 'offset:x', 'offset:-1',
+              'head_bytes:10')
+    def test_parse_start_position_invalid(self, start_position):
+        self.assertRaises(ValueError,
+                          reconn_utils.parse_start_position,
+                          start_position)
@@ -1,36 +1,137 @@
-import signal
+import heapq
+import itertools
+import threading
+import time
 
 from oslo_log import log as logging
 
 LOG = logging.getLogger(__name__)
 
+# Clock for deadlines, not affected by wall clock changes
+monotonic = getattr(time, 'monotonic', time.time)
 
-class ReconnTimeout(object):
-    '''Only main thread can set SIGALRM alarm for timeout.
-    Any thread can monitor timed out, to terminate.
-    Application multi-processing, can create a new daemonic
-    type process to call reconn with timeout.
-    '''
-    reconn_timedout = False
 
-    @staticmethod
-    def clear_timeout():
-        '''De-register to receive SIGALRM for timeouts'''
-        signal.alarm(0)
+class Timer(object):
+    '''Callback scheduled with TimerService to be called at deadline,
+    a monotonic clock time'''
+    def __init__(self, service, deadline, callback, args):
+        self._service = service
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+        self.fired = False
 
-    @staticmethod
-    def set_timeout(timeout):
-        '''Register to receive SIGALRM for timeout'''
-        signal.signal(signal.SIGALRM, ReconnTimeout.reconn_timeout_handler)
-        signal.alarm(timeout)
+    def remaining(self):
+        '''Seconds left till deadline'''
+        return max(0, self.deadline - monotonic())
 
-    @staticmethod
-    def reconn_timeout_handler(signum, stack_frame):
+    def cancel(self):
+        self._service.cancel(self)
 
-        ReconnTimeout.reconn_timedout = True
-        ReconnTimeout.clear_timeout()
-        LOG.info("Reconn timed out")
 
-    @staticmethod
-    def is_timed_out():
-        return ReconnTimeout.reconn_timedout
+class TimerService(object):
+    '''Calls back timers at their deadlines from its own thread.
+    Timers are kept in a heap ordered by deadline, so any number of
+    timers cost one thread sleeping till the earliest deadline.
+    Timers can be scheduled and cancelled from any thread.
+    Callbacks run on timer service thread and must not block.'''
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._heap = []
+        # Tie breaker of timers with same deadline, keeps them in order
+        self._seq = itertools.count()
+        self._cancelled = 0
+        self._stopping = False
+        self._thread = None
+
+    def call_later(self, delay, callback, *args):
+        '''Call callback(*args) after delay seconds.
+        Returns Timer, to be cancelled if no longer required'''
+        timer = Timer(self, monotonic() + delay, callback, args)
+        with self._cond:
+            heapq.heappush(self._heap, (timer.deadline, next(self._seq),
+                                        timer))
+            if self._thread is None:
+                self._stopping = False
+                self._thread = threading.Thread(target=self._run,
+                                                name='ReconnTimerService')
+                self._thread.daemon = True
+                self._thread.start()
+            elif self._heap[0][2] is timer:
+                # New earliest deadline, wake up to wait till it instead
+                self._cond.notify()
+        return timer
+
+    def cancel(self, timer):
+        with self._cond:
+            if timer.cancelled or timer.fired:
+                return
+            timer.cancelled = True
+            self._cancelled += 1
+            # Drop cancelled timers once they are most of the heap
+            if self._cancelled > len(self._heap) // 2:
+                self._heap = [e for e in self._heap if not e[2].cancelled]
+                heapq.heapify(self._heap)
+                self._cancelled = 0
+
+    def __len__(self):
+        with self._cond:
+            return len(self._heap) - self._cancelled
+
+    def stop(self):
+        '''Stop timer service thread. Pending timers are not called'''
+        with self._cond:
+            thread = self._thread
+            self._stopping = True
+            self._thread = None
+            self._heap = []
+            self._cancelled = 0
+            self._cond.notify()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def _next_due_timer(self):
+        '''Wait till earliest timer is due and pop it.
+        Returns None when stopped'''
+        with self._cond:
+            while not self._stopping:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                deadline, _, timer = self._heap[0]
+                if timer.cancelled:
+                    heapq.heappop(self._heap)
+                    self._cancelled -= 1
+                    continue
+                delay = deadline - monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+                timer.fired = True
+                return timer
+            return None
+
+    def _run(self):
+        while True:
+            timer = self._next_due_timer()
+            if timer is None:
+                break
+            try:
+                timer.callback(*timer.args)
+            except Exception:
+                LOG.exception("Timer callback %s failed", timer.callback)
+
+
+_timer_service = None
+_timer_service_lock = threading.Lock()
+
+
+def get_timer_service():
+    '''Timer service shared by all reconn sessions of the process'''
+    global _timer_service
+    with _timer_service_lock:
+        if _timer_service is None:
+            _timer_service = TimerService()
+        return _timer_service
@@ -1,5 +1,7 @@
+import os
 import threading
 import re
+import fnmatch
 import logging as py_logging
 
 from oslo_config import cfg
@@ -8,11 +10,14 @@ from oslo_log import log as logging
 from reconn import version
 from reconn import action as reconn_action
 from reconn import conf as reconn_conf
+from reconn import matcher as reconn_matcher
 
 
 CONF = reconn_conf.CONF
 LOG = logging.getLogger(__name__)
 
+_glob_magic_re = re.compile('[*?[]')
+
 _default_action_message_format = '{{"name": "{name}", "line":"{line}", ' \
                                  '"matched_pattern":"{matched_pattern}", ' \
                                  '"timestamp":"{timestamp}" }}'
@@ -47,10 +52,14 @@ def register_reconn_opts():
         "Variables within {} will be substituted " \
         "with its value. These variables should " \
         "be part of msg_user_data option. Fields " \
-        "{timestamp}, {line} and {matched_pattern} " \
-        "are computed. Field {name} is substituted " \
+        "{timestamp}, {line}, {context} and " \
+        "{matched_pattern} are computed. {context} is " \
+        "the matched line with context lines of its " \
+        "survey group. Field {name} is substituted " \
         "by the value defined for parameter name " \
-        "of matching survey config group. " \
+        "of matching survey config group. Named groups " \
+        "of the matched survey pattern, like " \
+        "(?P<stage>\\w+), are fields too. " \
         "Rest all characters will be sent as it is in message. " \
         "Logging { or } requires escape by doubling " \
         "{{, }}. Defaults to :" + _default_action_message_format
@@ -59,18 +68,41 @@ def register_reconn_opts():
 
     reconn_opts = [
         cfg.StrOpt('target_file',
-                   required=True,
                    default=None,
                    help='Absolute file path of console.log '
                         'of a VM instance, RECONN is supposed '
                         'to stream read and look out for VM '
                         'boot up stage'),
 
+        cfg.ListOpt('target_files',
+                    default=[],
+                    help='Comma separated list of absolute file paths '
+                         'to reconn in one RECONN process. Every file is '
+                         'surveyed independently for all survey groups '
+                         'and RECONN exits when reconn is over on all '
+                         'files. Used together with target_file'),
+
+        cfg.StrOpt('target_glob',
+                   default=None,
+                   help='Shell style glob of files to reconn, like '
+                        '/var/lib/nova/instances/*/console.log. RECONN '
+                        'stays resident and starts reconn on every '
+                        'existing and newly created file matching the '
+                        'glob, and stops reconn on a file once it is '
+                        'deleted. timeout applies to each file on its '
+                        'own'),
+
         cfg.IntOpt('timeout',
                    default=20,
                    help='terminate reconn after timeout minutes. '
                         'Defaults to 20 minutes'),
 
+        cfg.FloatOpt('timeout_seconds',
+                     min=0,
+                     help='terminate reconn on a target file after '
+                          'timeout_seconds, which can be a fraction. '
+                          'Takes precedence over timeout when set'),
+
         cfg.StrOpt('survey_action_message_format',
                    default=_default_action_message_format,
                    help=_default_message_format_help),
@@ -83,6 +115,116 @@ def register_reconn_opts():
                          "value. This helps in forming "
                          "custom message to be sent to RMQ"),
 
+        cfg.IntOpt('read_chunk_size',
+                   default=256 * 1024,
+                   min=1,
+                   help='Number of bytes read from target file at a time. '
+                        'Complete lines within the read chunk are surveyed '
+                        'in a batch. Defaults to 256 KiB'),
+
+        cfg.IntOpt('max_line_bytes',
+                   default=1024 * 1024,
+                   min=0,
+                   help='Longest line, in bytes, surveyed as it is. Longer '
+                        'lines, like binary garbage on a console without '
+                        'any newline, are handled as per long_line_policy. '
+                        'Bounds memory held for a line being written. '
+                        '0 for no limit. Defaults to 1 MiB'),
+
+        cfg.StrOpt('long_line_policy',
+                   default='truncate',
+                   choices=('truncate', 'split'),
+                   help='What to do with lines longer than max_line_bytes. '
+                        'truncate surveys first max_line_bytes of the line '
+                        'and discards the rest. split surveys the line as '
+                        'lines of max_line_bytes each. Defaults to '
+                        'truncate'),
+
+        cfg.BoolOpt('cr_line_terminator',
+                    default=False,
+                    help='Treat a bare carriage return, not followed by '
+                         'a newline, as end of line. Serial consoles redraw '
+                         'progress bars with bare carriage returns, making '
+                         'a never ending line otherwise. Defaults to '
+                         'False'),
+
+        cfg.StrOpt('target_encoding',
+                   default='utf-8',
+                   help='Encoding of target files. Survey patterns are '
+                        'encoded with it and matched against raw bytes '
+                        'of lines. Only lines matching a survey pattern '
+                        'are decoded, for survey actions. '
+                        'Defaults to utf-8'),
+
+        cfg.StrOpt('target_encoding_errors',
+                   default='replace',
+                   help='Error handler for bytes of matched lines invalid '
+                        'in target_encoding, like console output mangled '
+                        'on a serial port. One of python codecs error '
+                        'handlers, like: "replace", "ignore", "strict". '
+                        'Defaults to replace'),
+
+        cfg.StrOpt('match_mode',
+                   default='first',
+                   choices=('first', 'all'),
+                   help='Survey groups acted on for a line. first acts on '
+                        'the first configured survey group matching the '
+                        'line. all acts on every survey group matching the '
+                        'line, in configured order, so that a line matching '
+                        'both a survey group and end_reconn group is acted '
+                        'on by both. Defaults to first'),
+
+        cfg.StrOpt('scan_mode',
+                   default='line',
+                   choices=('line', 'block'),
+                   help='How complete lines read in a chunk are surveyed. '
+                        'line searches every line for survey patterns. '
+                        'block scans the whole chunk for all survey '
+                        'patterns at once and searches only lines having '
+                        'a match, cutting per line cost when catching up '
+                        'with a large file or a burst of writes. Falls '
+                        'back to line when survey patterns can not be '
+                        'scanned in blocks, like patterns with negative '
+                        'lookarounds. Defaults to line'),
+
+        cfg.StrOpt('notification_engine',
+                   default='watchdog',
+                   choices=('watchdog', 'inotify'),
+                   help='Engine notifying writes to target files. '
+                        'watchdog watches directory of target files and '
+                        'receives events of all files in the directory. '
+                        'inotify, available on Linux only, watches target '
+                        'files themselves and coalesces their events. '
+                        'Falls back to watchdog when inotify is not '
+                        'available. Defaults to watchdog'),
+
+        cfg.StrOpt('start_position',
+                   default='beginning',
+                   help='Position in target file to start reconn from. '
+                        'One of: "beginning", "end" to survey only '
+                        'content written from now on, "offset:N" to '
+                        'start at byte offset N, or "tail_bytes:N" to '
+                        'start N bytes before end of file. When the '
+                        'position is in middle of a line, reconn starts '
+                        'from the next line. A file resumed from its '
+                        'checkpoint or created after reconn began is read '
+                        'from its checkpoint or beginning respectively. '
+                        'Defaults to beginning'),
+
+        cfg.StrOpt('checkpoint_file',
+                   default=None,
+                   help='File to save read offset of every target file '
+                        'in. On restart, RECONN resumes reading a target '
+                        'file from its saved offset, if it is the same '
+                        'file (device and inode) and survey patterns are '
+                        'unchanged. Checkpointing is disabled by default'),
+
+        cfg.IntOpt('checkpoint_interval',
+                   default=5,
+                   min=1,
+                   help='Seconds between writes of checkpoint_file, at '
+                        'least 1. Defaults to 5 seconds'),
+
         cfg.StrOpt('end_reconn',
                    default=None,
                    help='A [CONFIG] group name that defines a '
@@ -120,6 +262,50 @@ def _register_survey_opts(survey_pattern_group):
         cfg.StrOpt('failure',
                    default=None,
                    help=''),
+        cfg.IntOpt('max_matches',
+                   default=0,
+                   min=0,
+                   help='Number of lines of a target file the survey group '
+                        'is acted on for, after which the group is retired '
+                        'and no longer searched for in the file. Like 1, '
+                        'for a boot stage logged once. Reconn on a target '
+                        'file ends once all survey groups are retired. '
+                        '0 for no limit. Defaults to 0'),
+        cfg.IntOpt('context_before',
+                   default=0,
+                   min=0,
+                   max=1000,
+                   help='Number of lines before a matched line given to '
+                        'survey action in {context} of its message, along '
+                        'with the matched line. Defaults to 0'),
+        cfg.IntOpt('context_after',
+                   default=0,
+                   min=0,
+                   max=1000,
+                   help='Number of lines after a matched line given to '
+                        'survey action in {context} of its message. '
+                        'Action is taken once these lines are read, or '
+                        'reconn on the target file ends. Defaults to 0'),
+        cfg.BoolOpt('multiline',
+                    default=False,
+                    help='Match pattern over a window of lines, like a '
+                         'traceback, with ^ and $ matching at every line. '
+                         'Survey action is given the matched lines. '
+                         'context_before and context_after do not apply. '
+                         'Defaults to False'),
+        cfg.IntOpt('window_lines',
+                   default=20,
+                   min=1,
+                   max=1000,
+                   help='Number of lines a multiline pattern is matched '
+                        'over, ending at a line having its anchor. '
+                        'Defaults to 20'),
+        cfg.StrOpt('anchor',
+                   default=None,
+                   help='Literal text in the last line of any match of a '
+                        'multiline pattern. The window of lines is matched '
+                        'only when a line has the anchor. Defaults to the '
+                        'last literal text of the pattern'),
     ]
 
     reconn_survey_opt_group = cfg.OptGroup(name=survey_pattern_group,
@@ -149,8 +335,9 @@ def _register_log_survey_action_group_opts():
         cfg.StrOpt('log_survey_action_log_format',
                    default=CONF.survey_action_message_format,
                    help='Format to log matched pattern. Supported replacement '
-                        'fields are {name}, {timestamp}, {line} '
-                        'and {matched_pattern}. Rest all characters '
+                        'fields are {name}, {timestamp}, {line}, {context}, '
+                        '{matched_pattern}, keys of msg_user_data and named '
+                        'groups of matched pattern. Rest all characters '
                         'will be sent to log file as is.Logging "{" or "}" '
                         'requires escape by doubling {{,  }}. '
                         'Defaults to :' + CONF.survey_action_message_format),
@@ -201,8 +388,11 @@ def _register_rmq_survey_action_group_opts():
                    default=CONF.survey_action_message_format,
                    help="Format of message to send to RMQ on matched pattern. "
                         "Variables within {} will be substituted with its "
-                        "value. Fields {name}, {timestamp}, {line} and "
-                        "{matched_pattern} are computed. "
+                        "value. Fields {name}, {timestamp}, {line}, "
+                        "{context} and {matched_pattern} are computed. "
+                        "Named groups of matched pattern are fields too. "
+                        "Values are escaped to keep the message valid "
+                        "JSON. "
                         "Rest all characters will be sent as it is in "
                         "message. Logging { or } requires escape by doubling "
                         "{{, }}. Defaults to :" +
@@ -216,6 +406,71 @@ def _register_rmq_survey_action_group_opts():
                          "sent to RMQ. These set of key:value pairs"
                          " overrides key:value pairs from reconn "
                          "config group's msg_user_data"),
+        cfg.IntOpt('rmq_queue_size',
+                   default=1000,
+                   min=1,
+                   help='Number of messages queued for the publisher thread '
+                        'to publish to RMQ, beyond which '
+                        'rmq_overflow_policy applies. Defaults to 1000'),
+        cfg.StrOpt('rmq_overflow_policy',
+                   default='block',
+                   choices=reconn_action.overflow_policies,
+                   help='What to do with a message when the queue of '
+                        'messages to publish is full, like when RMQ server '
+                        'is slow, blocked or down. block waits for room, '
+                        'holding up reading target files. drop_oldest drops '
+                        'the oldest queued message. spill holds the message '
+                        'and the ones after it in memory, published after '
+                        'the queue. Defaults to block'),
+        cfg.IntOpt('rmq_confirm_window',
+                   default=64,
+                   min=1,
+                   help='Number of publishes to RMQ waiting for RMQ server '
+                        'to confirm them, beyond which the publisher thread '
+                        'waits for confirms before publishing more. '
+                        'Defaults to 64'),
+        cfg.IntOpt('rmq_publish_retries',
+                   default=3,
+                   min=0,
+                   help='Times a message is published to RMQ again, when '
+                        'its publish fails, is nacked by RMQ server or is '
+                        'not confirmed when the connection is lost, '
+                        'beyond which the message is dropped. Defaults '
+                        'to 3'),
+        cfg.BoolOpt('rmq_batch_messages',
+                    default=False,
+                    help='Publish messages queued within rmq_batch_linger_ms '
+                         'of each other together, as a JSON array of up to '
+                         'rmq_batch_size messages, instead of one publish '
+                         'per message. Defaults to False'),
+        cfg.IntOpt('rmq_batch_size',
+                   default=100,
+                   min=1,
+                   help='Most messages published together with '
+                        'rmq_batch_messages. Defaults to 100'),
+        cfg.IntOpt('rmq_batch_linger_ms',
+                   default=5,
+                   min=0,
+                   help='Milliseconds to wait for more messages to publish '
+                        'together with rmq_batch_messages. Defaults to 5'),
+        cfg.StrOpt('rmq_spool_dir',
+                   default=None,
+                   help='Directory of a spool of messages on disk. '
+                        'rmq_overflow_policy spill spills messages to the '
+                        'spool instead of memory, and messages not '
+                        'published when reconn exits are spooled, to be '
+                        'published once reconn starts again. Not set by '
+                        'default'),
+        cfg.IntOpt('rmq_spool_max_mb',
+                   default=1024,
+                   min=1,
+                   help='MiB of messages in rmq_spool_dir, beyond which '
+                        'spilled messages are dropped. Defaults to 1024'),
+        cfg.IntOpt('rmq_spool_fsync_batch',
+                   default=100,
+                   min=1,
+                   help='Number of messages spooled between fsync of '
+                        'rmq_spool_dir. Defaults to 100'),
     ]
 
     rmq_survey_action_opt_group = cfg.OptGroup(
@@ -248,6 +503,68 @@ def _get_reconn_survey_groups():
     return group_list
 
 
+def get_reconn_target_files():
+    '''Get list of unique target files configured with
+    target_file and target_files, or empty list'''
+    target_files = []
+    if CONF.target_file is not None:
+        target_files.append(CONF.target_file)
+    for target_file in CONF.target_files:
+        target_file = target_file.strip(" ")
+        if target_file != '' and target_file not in target_files:
+            target_files.append(target_file)
+    return target_files
+
+
+def get_reconn_timeout():
+    '''Reconn timeout of a target file in seconds'''
+    if CONF.timeout_seconds is not None:
+        return CONF.timeout_seconds
+    return CONF.timeout * 60
+
+
+def parse_start_position(start_position):
+    '''Parse start_position opt value into a tuple of
+    (kind, N), where kind is one of beginning, end, offset, tail_bytes.
+    Raises ValueError for invalid value'''
+    start_position = start_position.strip()
+    if start_position in ('beginning', 'end'):
+        return start_position, 0
+    kind, sep, value = start_position.partition(':')
+    if sep == '' or kind not in ('offset', 'tail_bytes'):
+        raise ValueError("Invalid start_position %s" % start_position)
+    n = int(value)
+    if n < 0:
+        raise ValueError("Invalid start_position %s" % start_position)
+    return kind, n
+
+
+def get_target_glob_base_dir(target_glob):
+    '''Returns (base_dir, recursive) for target_glob.
+    base_dir is the longest leading directory without glob characters.
+    recursive is True when sub-directories of base_dir are to be watched
+    to find files matching target_glob'''
+    parts = os.path.normpath(target_glob).split(os.sep)
+    for i, part in enumerate(parts):
+        if _glob_magic_re.search(part) is not None:
+            base_dir = os.sep.join(parts[:i]) or os.sep
+            return base_dir, i < len(parts) - 1
+    return os.path.dirname(target_glob), False
+
+
+def match_target_glob(file_path, target_glob):
+    '''Match file_path with target_glob, one path component at a time
+    like glob does, so that * does not span across directories'''
+    path_parts = os.path.normpath(file_path).split(os.sep)
+    glob_parts = os.path.normpath(target_glob).split(os.sep)
+    if len(path_parts) != len(glob_parts):
+        return False
+    for path_part, glob_part in zip(path_parts, glob_parts):
+        if not fnmatch.fnmatchcase(path_part, glob_part):
+            return False
+    return True
+
+
 def _get_all_configured_success_actions():
     '''Returns a list of all unique success action used by all
     survey groups.
@@ -262,30 +579,105 @@ def _get_all_configured_success_actions():
     return unique_survey_actions
 
 
-def create_re_objs():
-    '''Create python re pattern obj for each survey pattern'''
-    re_objs = []
-    for survey_group_name in _get_reconn_survey_groups():
-        re_objs.append((CONF.get(survey_group_name).name,
-                       re.compile(CONF.get(survey_group_name).pattern)))
-
-    return re_objs
-
-
-def search_patterns(re_objs, line):
-    '''Returns first matched pattern in line and its
-     survey pattern group name. On Failure, returns (None,None)'''
-    for survey_grp_name, re_obj in re_objs:
-        match_obj = re_obj.search(line)
-        if match_obj is None:
-            # pattern not in line
-            pass
-        else:
-            # pattern in line
-            s = "Matched %s in line: %s" % (re_obj.pattern, line)
-            LOG.debug(s)
-            return survey_grp_name, re_obj.pattern
-    return None, None
+class SurveyGroup(object):
+    '''Configuration of a survey group, resolved once at init for
+    use on every matched line: survey group name, compiled pattern,
+    survey action object, whether the pattern ends reconn and index of
+    the group in configured order, number of lines it is acted on for
+    before retiring, 0 for no limit, number of context lines before
+    and after a matched line, and of a multiline group, number of lines
+    its pattern is matched over and the anchor literal they end in'''
+    __slots__ = ('name', 're_obj', 'pattern', 'action', 'is_end', 'index',
+                 'max_matches', 'context_before', 'context_after',
+                 'multiline', 'window_lines', 'anchor')
+
+    def __init__(self, name, re_obj, action, is_end, index, pattern=None,
+                 max_matches=0, context_before=0, context_after=0,
+                 multiline=False, window_lines=1, anchor=None):
+        self.name = name
+        self.re_obj = re_obj
+        # Configured pattern text, re_obj may be compiled from its bytes
+        self.pattern = re_obj.pattern if pattern is None else pattern
+        self.action = action
+        self.is_end = is_end
+        self.index = index
+        self.max_matches = max_matches
+        self.context_before = context_before
+        self.context_after = context_after
+        self.multiline = multiline
+        self.window_lines = window_lines
+        self.anchor = anchor
+
+    def __setattr__(self, name, value):
+        if hasattr(self, name):
+            raise AttributeError("SurveyGroup is read only")
+        super(SurveyGroup, self).__setattr__(name, value)
+
+    def __repr__(self):
+        return 'SurveyGroup(%s, %s)' % (self.name, self.pattern)
+
+
+def encode_pattern(pattern):
+    '''Survey pattern as bytes in target_encoding'''
+    if isinstance(pattern, bytes):
+        return pattern
+    return pattern.encode(CONF.target_encoding)
+
+
+def create_survey_groups(get_survey_action):
+    '''Create SurveyGroup for each configured survey group, in
+    configured order. Patterns are compiled as bytes in target_encoding,
+    to match raw lines of target files. get_survey_action returns survey
+    action object for a success action name'''
+    end_reconn_pattern = None
+    if CONF.end_reconn is not None:
+        end_reconn_pattern = CONF.get(CONF.end_reconn).pattern
+    survey_groups = []
+    for index, survey_group_name in enumerate(_get_reconn_survey_groups()):
+        survey_group_conf = CONF.get(survey_group_name)
+        pattern = survey_group_conf.pattern
+        if survey_group_conf.multiline:
+            survey_groups.append(_create_multiline_survey_group(
+                survey_group_name, survey_group_conf,
+                get_survey_action(survey_group_conf.success.strip()),
+                pattern == end_reconn_pattern, index))
+            continue
+        survey_groups.append(SurveyGroup(
+            survey_group_conf.name,
+            re.compile(encode_pattern(pattern)),
+            get_survey_action(survey_group_conf.success.strip()),
+            pattern == end_reconn_pattern,
+            index,
+            pattern=pattern,
+            max_matches=survey_group_conf.max_matches,
+            context_before=survey_group_conf.context_before,
+            context_after=survey_group_conf.context_after))
+    return tuple(survey_groups)
+
+
+def _create_multiline_survey_group(survey_group_name, survey_group_conf,
+                                   action, is_end, index):
+    '''SurveyGroup of a multiline survey group, its pattern compiled in
+    MULTILINE mode. Raises ValueError when it has no anchor'''
+    pattern = survey_group_conf.pattern
+    re_obj = re.compile(encode_pattern(pattern), re.MULTILINE)
+    if survey_group_conf.anchor:
+        anchor = encode_pattern(survey_group_conf.anchor)
+    else:
+        anchor = reconn_matcher.anchor_literal(re_obj)
+    if not anchor or b'\n' in anchor:
+        raise ValueError("Multiline survey group %s requires an anchor, "
+                         "literal text in the last line of its matches"
+                         % survey_group_name)
+    if survey_group_conf.context_before or survey_group_conf.context_after:
+        LOG.warning("context_before and context_after do not apply to "
+                    "multiline survey group %s", survey_group_name)
+    return SurveyGroup(survey_group_conf.name, re_obj, action, is_end,
+                       index, pattern=pattern,
+                       max_matches=survey_group_conf.max_matches,
+                       multiline=True,
+                       window_lines=survey_group_conf.window_lines,
+                       anchor=anchor)
 
 
 def search_end_reconn_pattern(line):
@@ -302,29 +694,6 @@ def search_end_reconn_pattern(line):
         return end_reconn_pattern
 
 
-def is_pattern_to_end_reconn(pattern):
-    '''Returns True if pattern matches with end reconn group's pattern.
-    Returns False otherwise or if end reconn config group is not defined'''
-    if CONF.end_reconn is None:
-        return False
-    reconn_end_group_name = CONF.end_reconn
-    end_reconn_pattern = CONF.get(reconn_end_group_name).pattern
-    if end_reconn_pattern == pattern:
-        return True
-    else:
-        return False
-
-
-def get_survey_success_action_name(pattern):
-    '''For a given survey pattern, get its configured success action name.
-    None on failure'''
-
-    for survey_group_name in _get_reconn_survey_groups():
-        if CONF.get(survey_group_name).pattern == pattern:
-            return CONF.get(survey_group_name).success
-    return None
-
-
 def log_native_threads():
     '''Log native threads to log file
     '''
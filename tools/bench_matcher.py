@@ -0,0 +1,135 @@
+"""Benchmark survey pattern matching cost per line.
+
+Compares per line cost of searching every survey pattern in turn
+against reconn.matcher.SurveyMatcher for 5, 50 and 500 survey patterns.
+SurveyMatcher is measured searching line by line, prefiltering blocks
+of lines as reconn_file does, and scanning blocks of lines as a whole,
+as reconn_file does with scan_mode = block. With --match-all,
+SurveyMatcher searches for all survey patterns in a line, as with
+match_mode = all.
+
+    $ python tools/bench_matcher.py --lines 20000
+"""
+
+import argparse
+import random
+import re
+import time
+
+from reconn import matcher as reconn_matcher
+
+
+_words = ['kernel', 'eth0', 'link', 'up', 'mounted', 'filesystem', 'vda1',
+          'cloud-init', 'Running', 'command', 'resize2fs', 'systemd',
+          'Started', 'Reached', 'target', 'Network', 'dhclient', 'DHCPACK',
+          'from', '10.0.0.1', 'sshd', 'Server', 'listening', 'on', 'port']
+
+
+def generate_patterns(count, seed=0):
+    '''Survey patterns alike console log patterns, that rarely match.
+    Patterns start with different words, so that they share no common
+    prefix'''
+    rnd = random.Random(seed)
+    patterns = ['login:', r'Cloud-init v\. \S+ finished']
+    for i in range(count - len(patterns)):
+        patterns.append(r'%s %s event %d: (\w+) state=(up|down)' % (
+            rnd.choice(_words), rnd.choice(_words), i))
+    return patterns[:count]
+
+
+def generate_lines(count, seed=0):
+    rnd = random.Random(seed)
+    lines = []
+    for i in range(count):
+        lines.append('[%12.6f] %s' % (
+            i / 100.0, ' '.join(rnd.choice(_words) for w in range(12))))
+    # A matching line once in a while
+    for i in range(0, count, 10000):
+        lines[i] = 'ubuntu login:'
+    return lines
+
+
+def generate_blocks(lines, block_size):
+    blocks = []
+    block = []
+    size = 0
+    for line in lines:
+        block.append(line + '\n')
+        size += len(line) + 1
+        if size >= block_size:
+            blocks.append(''.join(block))
+            block = []
+            size = 0
+    if block:
+        blocks.append(''.join(block))
+    return blocks
+
+
+def search_patterns(re_objs, line):
+    for survey_grp_name, re_obj in re_objs:
+        if re_obj.search(line) is not None:
+            return survey_grp_name, re_obj.pattern
+    return None, None
+
+
+def per_pattern_loop(re_objs, lines):
+    for line in lines:
+        search_patterns(re_objs, line)
+
+
+def matcher_loop(matcher, lines):
+    for line in lines:
+        matcher.search_indexes(line)
+
+
+def block_loop(matcher, blocks):
+    for block in blocks:
+        if matcher.prefilter_block(block):
+            for line in block.splitlines(True):
+                matcher.search_indexes(line)
+
+
+def scan_loop(matcher, blocks):
+    for block in blocks:
+        if matcher.prefilter_block(block):
+            for line, found, start in matcher.scan_block(block):
+                pass
+
+
+def _run(f, *args):
+    start = time.time()
+    f(*args)
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--lines', type=int, default=20000)
+    parser.add_argument('--block-size', type=int, default=64 * 1024)
+    parser.add_argument('--patterns', type=int, nargs='+',
+                        default=[5, 50, 500])
+    parser.add_argument('--match-all', action='store_true')
+    args = parser.parse_args()
+
+    lines = generate_lines(args.lines)
+    blocks = generate_blocks(lines, args.block_size)
+    print("%8s %20s %16s %16s %16s" % ('patterns', 'per pattern us/line',
+                                       'matcher us/line', 'blocks us/line',
+                                       'scan us/line'))
+    for count in args.patterns:
+        re_objs = [('group%d' % i, re.compile(pattern))
+                   for i, pattern in enumerate(generate_patterns(count))]
+        matcher = reconn_matcher.SurveyMatcher(re_objs,
+                                               match_all=args.match_all)
+        per_pattern = _run(per_pattern_loop, re_objs, lines)
+        combined = _run(matcher_loop, matcher, lines)
+        prefiltered = _run(block_loop, matcher, blocks)
+        scanned = _run(scan_loop, matcher, blocks)
+        print("%8d %20.2f %16.2f %16.2f %16.2f" % (
+            count, per_pattern * 1e6 / len(lines),
+            combined * 1e6 / len(lines), prefiltered * 1e6 / len(lines),
+            scanned * 1e6 / len(lines)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""Benchmark reading of a synthetic console.log.
+
+Compares lines/sec of the per-line readline() loop reconn used to run
+against reconn.reader.LineReader chunked reads.
+
+    $ python tools/bench_reader.py --size-mb 300 --chunk-size 262144
+"""
+
+import argparse
+import io
+import os
+import re
+import tempfile
+import time
+
+from reconn import reader as reconn_reader
+
+
+_sample_lines = [
+    b'[    0.000000] Initializing cgroup subsys cpuset\n',
+    b'[    0.000000] Linux version 3.2.0-37-virtual (buildd@allspice) '
+    b'(gcc version 4.6.3 (Ubuntu/Linaro 4.6.3-1ubuntu5) ) #58-Ubuntu SMP\n',
+    b'[    1.612347] EXT4-fs (vda1): mounted filesystem with ordered data '
+    b'mode. Opts: (null)\n',
+    b'cloud-init[1234]: util.py[DEBUG]: Running command '
+    b'[\'resize2fs\', \'/dev/vda1\'] with allowed return codes [0]\n',
+    b'\r\n',
+]
+
+
+def generate_console_log(path, size_mb):
+    block = b''.join(_sample_lines) * 1024
+    size = size_mb * 1024 * 1024
+    written = 0
+    with io.open(path, 'wb') as f:
+        while written < size:
+            f.write(block)
+            written += len(block)
+
+
+def readline_loop(path, re_obj):
+    '''Per line reads as done by reconn.scout.reconn_file before
+    LineReader'''
+    count = 0
+    last_line = b''
+    with io.open(path, 'rb') as f:
+        while True:
+            line = f.readline()
+            if line == b'':
+                break
+            if last_line != b'':
+                line = last_line + line
+                last_line = b''
+            if line[-1:] != b'\n':
+                last_line = line
+            else:
+                re_obj.search(line)
+                count += 1
+    return count
+
+
+def chunked_loop(path, re_obj, chunk_size, max_line_bytes=0,
+                 cr_terminates=False):
+    count = 0
+    with io.open(path, 'rb') as f:
+        reader = reconn_reader.LineReader(f, chunk_size,
+                                          max_line_bytes=max_line_bytes,
+                                          cr_terminates=cr_terminates)
+        while True:
+            lines = reader.read_lines()
+            if lines is None:
+                break
+            for line in lines:
+                re_obj.search(line)
+            count += len(lines)
+    return count
+
+
+def _run(name, f, *args):
+    start = time.time()
+    count = f(*args)
+    elapsed = time.time() - start
+    print("%-10s %12d lines %8.2f s %14.0f lines/sec" % (
+        name, count, elapsed, count / elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size-mb', type=int, default=300)
+    parser.add_argument('--chunk-size', type=int,
+                        default=reconn_reader.DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--max-line-bytes', type=int, default=1024 * 1024)
+    parser.add_argument('--cr-line-terminator', action='store_true')
+    parser.add_argument('--file', default=None,
+                        help='Existing console log to read instead of '
+                             'generating a synthetic one')
+    args = parser.parse_args()
+
+    re_obj = re.compile(b'login:')
+    path = args.file
+    if path is None:
+        fd, path = tempfile.mkstemp(suffix='_console.log')
+        os.close(fd)
+        generate_console_log(path, args.size_mb)
+    try:
+        print("File: %s (%d bytes)" % (path, os.path.getsize(path)))
+        _run('readline', readline_loop, path, re_obj)
+        _run('chunked', chunked_loop, path, re_obj, args.chunk_size,
+             args.max_line_bytes, args.cr_line_terminator)
+    finally:
+        if args.file is None:
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Benchmark RMQSurvey publish throughput against a fake RMQ server.
+
+reconn.tests.fake_rmq.FakeBroker stands in for an RMQ server, confirming
+every publish --rtt milliseconds after it. Messages for --messages lines
+are executed on RMQSurvey, and msgs/sec measured till all of them are
+confirmed, for every rmq_confirm_window in --windows. With --batch,
+messages are also published in batches of up to --batch-size messages,
+as with rmq_batch_messages.
+
+    $ python tools/bench_rmq.py --messages 5000 --rtt 1
+"""
+
+import argparse
+import time
+
+import mock
+
+from reconn import action as reconn_action
+from reconn.tests import fake_rmq
+
+
+def run(messages, rtt, window, batch_size=None):
+    '''Returns msgs/sec publishing messages, with confirm window and
+    batch size'''
+    broker = fake_rmq.FakeBroker(rtt=rtt / 1000.0)
+    rmq_params = {'rmq_queue_size': messages,
+                  'rmq_confirm_window': window}
+    if batch_size:
+        rmq_params.update(rmq_batch_messages=True,
+                          rmq_batch_size=batch_size)
+    renderer = reconn_action.create_message_renderer(
+        '{{"line":"{line}", "name":"{name}"}}', json_template=True)
+    with mock.patch('pika.BlockingConnection', broker.connection):
+        rmq_survey_obj = reconn_action.RMQSurvey(rmq_params, renderer)
+        start = time.time()
+        for i in range(messages):
+            rmq_survey_obj.execute('grp', 'line', u'line %d' % i)
+        while rmq_survey_obj.published < messages:
+            time.sleep(0.001)
+        elapsed = time.time() - start
+        rmq_survey_obj.destructor()
+    return messages / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--rtt', type=float, default=1.0,
+                        help='milliseconds to confirm a publish')
+    parser.add_argument('--windows', type=int, nargs='+',
+                        default=[1, 8, 64, 256])
+    parser.add_argument('--batch', action='store_true')
+    parser.add_argument('--batch-size', type=int, default=100)
+    args = parser.parse_args()
+
+    print("%8s %16s %16s" % ('window', 'msgs/sec',
+                             'batched msgs/sec' if args.batch else ''))
+    for window in args.windows:
+        single = run(args.messages, args.rtt, window)
+        batched = ''
+        if args.batch:
+            batched = '%.0f' % run(args.messages, args.rtt, window,
+                                   args.batch_size)
+        print("%8d %16.0f %16s" % (window, single, batched))
+
+
+if __name__ == '__main__':
+    main()